@@ -133,15 +133,23 @@ export default function LiveAttendanceModal({ sessionId, subjectId, onClose, sub
       socket.emit("join_session", payload);
     };
 
-    const onStudentScanned = (data) => {
+    // Scans arrive in batches, applied with a single state update
+    const onStudentsScanned = ({ scans }) => {
       setScannedStudents((prev) => {
-        if (prev.some(s => s.student.roll === data.student.roll)) return prev;
-        return [data, ...prev];
+        const seen = new Set(prev.map(s => s.student.roll));
+        const added = [];
+        for (const data of scans) {
+          // A malformed scan must not drop the rest of the batch
+          if (!data.student || seen.has(data.student.roll)) continue;
+          seen.add(data.student.roll);
+          added.unshift(data);
+        }
+        return added.length ? [...added, ...prev] : prev;
       });
     };
 
     socket.on("connect", onConnect);
-    socket.on("student_scanned", onStudentScanned);
+    socket.on("students_scanned", onStudentsScanned);
 
     if (socket.connected) {
       onConnect();
@@ -158,7 +166,7 @@ export default function LiveAttendanceModal({ sessionId, subjectId, onClose, sub
 
     return () => {
       socket.off("connect", onConnect);
-      socket.off("student_scanned", onStudentScanned);
+      socket.off("students_scanned", onStudentsScanned);
       window.removeEventListener('beforeunload', handleBeforeUnload);
     };
   }, [sessionId, subjectId, teacherLocation]);
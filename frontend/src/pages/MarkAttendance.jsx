@@ -238,6 +238,8 @@ export default function MarkAttendance() {
   }, [selectedSubject])
 
   const frameInFlightRef = useRef(false);
+  // Frame interval recommended by the server (frame_rate messages)
+  const frameIntervalRef = useRef(1000);
 
   useEffect(() => {
     if (!selectedSubject || attendanceSubmitted) return;
@@ -302,6 +304,10 @@ export default function MarkAttendance() {
       frameInFlightRef.current = false;
     };
 
+    const onFrameRate = (data) => {
+      if (data.interval_ms > 0) frameIntervalRef.current = data.interval_ms;
+    };
+
     socket.on("connect", onConnect);
     socket.on("disconnect", onDisconnect);
     socket.on("processing_started", onProcessingStarted);
@@ -309,6 +315,7 @@ export default function MarkAttendance() {
     socket.on("complete", onComplete);
     socket.on("ml_error", onMlError);
     socket.on("frame_skipped", onFrameSkipped);
+    socket.on("frame_rate", onFrameRate);
 
     if (socket.connected) {
       setMlStatus("ready");
@@ -316,28 +323,42 @@ export default function MarkAttendance() {
       socket.connect();
     }
 
-    // Send frame periodically via Socket.IO
-    const interval = setInterval(() => {
+    // Send frames via Socket.IO at the rate the server recommends
+    let frameTimer;
+    const sendFrame = () => {
       if (
         socket.connected &&
         webcamRef.current &&
         !frameInFlightRef.current
       ) {
-        const image = webcamRef.current.getScreenshot();
-        if (image) {
+        // The JPEG goes out as a binary attachment, without base64
+        const canvas = webcamRef.current.getCanvas();
+        if (canvas) {
           frameInFlightRef.current = true;
-          socket.emit("process_frame", {
-            session_id: mlSessionId,
-            image,
-            subject_id: selectedSubject,
-            token,
-          });
+          canvas.toBlob(
+            (image) => {
+              if (!image) {
+                frameInFlightRef.current = false;
+                return;
+              }
+              socket.emit("process_frame", {
+                session_id: mlSessionId,
+                image,
+                subject_id: selectedSubject,
+                token,
+              });
+            },
+            "image/jpeg",
+            0.92
+          );
         }
       }
-    }, 1000);
+      frameTimer = setTimeout(sendFrame, frameIntervalRef.current);
+    };
+    frameTimer = setTimeout(sendFrame, frameIntervalRef.current);
 
     return () => {
-      clearInterval(interval);
+      clearTimeout(frameTimer);
       frameInFlightRef.current = false;
       socket.off("connect", onConnect);
       socket.off("disconnect", onDisconnect);
@@ -346,6 +367,7 @@ export default function MarkAttendance() {
       socket.off("complete", onComplete);
       socket.off("ml_error", onMlError);
       socket.off("frame_skipped", onFrameSkipped);
+      socket.off("frame_rate", onFrameRate);
     };
   }, [selectedSubject, attendanceSubmitted]);
 
@@ -1,9 +1,9 @@
 import base64
 import base64
+import json
 import logging
-import time
 from datetime import date
-from typing import Dict
+from typing import Dict, List
 
 from bson import ObjectId
 from bson import errors as bson_errors
@@ -21,14 +21,23 @@ from pymongo import UpdateOne
 
 from geopy.distance import geodesic
 from app.core.config import (
+    ML_DETECTION_MODEL,
     ML_CONFIDENT_THRESHOLD,
     ML_UNCERTAIN_THRESHOLD,
+    ML_MATCH_SIMILARITY,
     RATE_LIMIT_ATTENDANCE_MARK,
 )
 from app.db.mongo import db
 from app.services.attendance_daily import save_daily_summary
 from app.services.attendance import log_grouped_attendance
 from app.services.ml_client import ml_client
+from app.services.face_gallery import (
+    build_candidate_embeddings,
+    gallery_version,
+    subject_gallery_id,
+)
+from app.services.recognition_pipeline import Frame, RecognitionStream
+from app.services.session_state import session_state
 from app.schemas.attendance import AttendanceConfirm
 from app.utils.geo import calculate_distance
 from app.schemas.attendance import QRAttendanceRequest
@@ -36,7 +45,10 @@ from app.core.security import get_current_user
 from app.utils.jwt_token import decode_jwt
 from fastapi import Depends
 
-from app.services.attendance_socket_service import stop_and_save_session, sio
+from app.services.attendance_socket_service import (
+    scan_broadcaster,
+    stop_and_save_session,
+)
 
 # Import WebAuthn verification
 from app.services.webauthn_service import verify_auth_response, get_rp_id
@@ -48,6 +60,9 @@ from app.core.limiter import limiter, get_teacher_rate_limit_key
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/attendance", tags=["Attendance"])
 
+# Photos accepted by one /mark request (matches the ML service limit)
+MAX_MARK_IMAGES = 10
+
 
 @router.post("/stop-session/{session_id}")
 async def stop_session(session_id: str, current_user: dict = Depends(get_current_user)):
@@ -67,6 +82,10 @@ async def websocket_endpoint(
     """
     WebSocket endpoint for real-time attendance marking.
     Streams incremental match results as faces are processed.
+
+    Frames are JSON ``process_frame`` commands with a base64 image, or
+    binary messages holding the JPEG itself for the subject named by the
+    last ``subject`` command.
     """
     await websocket.accept()
 
@@ -98,36 +117,62 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    last_process_time = 0
-    min_process_interval = 0.5  # Limit to ~2 FPS per client to prevent flooding
+    async def emit(event: str, payload: Dict) -> None:
+        if event == "skipped":
+            # Lets the client clear its in-flight flag
+            await websocket.send_json(
+                {"type": "complete", "status": "ignored", **payload}
+            )
+            return
+        await websocket.send_json({"type": event, **payload})
+        if event == "error" and payload.get("code") == "forbidden":
+            logger.warning(f"Subject mismatch for user {user_id}")
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+
+    stream = RecognitionStream(emit)
+
+    # Subject of binary frames, which carry nothing but the JPEG
+    binary_subject_id = None
 
     try:
         while True:
-            # 2. Receive JSON command
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            # 2a. Binary frame: the JPEG bytes go to the ML service as-is
+            if message.get("bytes") is not None:
+                if not binary_subject_id:
+                    await websocket.send_json(
+                        {"type": "error", "message": "Missing subject_id"}
+                    )
+                    continue
+                await stream.submit(
+                    Frame(
+                        image=message["bytes"],
+                        subject_id=binary_subject_id,
+                        user=user,
+                    )
+                )
+                continue
+
+            # 2b. JSON command
             # Expected format: {"command": "process_frame", "image": "base64...", "subject_id": "..."}
-            data = await websocket.receive_json()
+            data = json.loads(message["text"])
             command = data.get("command")
 
             if command == "ping":
                 await websocket.send_json({"type": "pong"})
                 continue
 
-            # 3. Process Frame
-            if command == "process_frame":
-                current_time = time.time()
-                if current_time - last_process_time < min_process_interval:
-                    # Drop frame if sending too fast
-                    # Send completion so client clears in-flight flag
-                    await websocket.send_json(
-                        {"type": "complete", "status": "ignored"}
-                    )
-                    continue
-                last_process_time = current_time
+            if command == "subject":
+                binary_subject_id = data.get("subject_id")
+                continue
 
+            # 3. Queue the frame; results are sent by the recognition stream
+            if command == "process_frame":
                 image_b64 = data.get("image")
                 subject_id = data.get("subject_id")
-                matched_results = []
-                unmatched_results = []
 
                 if not image_b64 or not subject_id:
                     await websocket.send_json(
@@ -135,228 +180,19 @@ async def websocket_endpoint(
                     )
                     continue
 
-                try:
-                    # Strip header
-                    if "," in image_b64:
-                        _, image_b64 = image_b64.split(",", 1)
-
-                    # Detect Faces
-                    # Using same parameters as mark_attendance
-                    ml_response = await ml_client.detect_faces(
-                        image_base64=image_b64,
-                        min_face_area_ratio=0.01,
-                        num_jitters=3,
-                        model="hog",
-                    )
-
-                    if not ml_response.get("success"):
-                        await websocket.send_json(
-                            {
-                                "type": "error",
-                                "message": ml_response.get("error", "ML Error"),
-                            }
-                        )
-                        continue
-
-                    faces = ml_response.get("faces", [])
-                    count = len(faces)
-
-                    # Notify start of processing
-                    # Use 'processing' status as requested
-                    await websocket.send_json(
-                        {
-                            "type": "processing_started",
-                            "status": "processing",
-                            "matched": [],
-                            "pending": count,
-                        }
-                    )
-
-                    if count == 0:
-                        await websocket.send_json(
-                            {
-                                "type": "complete",
-                                "status": "complete",
-                                "matched": [],
-                                "unmatched": [],
-                            }
-                        )
-                        continue
-
-                    # Fetch Candidates
-                    try:
-                        subject_oid = ObjectId(subject_id)
-                        subject = await db.subjects.find_one(
-                            {"_id": subject_oid},
-                            {"students": 1, "professor_ids": 1},
-                        )
-                    except bson_errors.InvalidId:
-                        subject = None
-
-                    if not subject:
-                        await websocket.send_json(
-                            {"type": "error", "message": "Subject not found"}
-                        )
-                        continue
-
-                    if user.get("role") != "admin" and user["_id"] not in subject.get(
-                        "professor_ids", []
-                    ):
-                        logger.warning(
-                            f"Subject mismatch for user {user_id}. Subject: {subject_id}"
-                        )
-                        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-                        return
-
-                    student_user_ids = [
-                        s["student_id"]
-                        for s in subject.get("students", [])
-                        if s.get("verified", False)
-                    ]
-
-                    students_cursor = db.students.find(
-                        {
-                            "userId": {"$in": student_user_ids},
-                            "verified": True,
-                            "face_embeddings": {"$exists": True, "$ne": []},
-                        }
-                    )
-                    students_list = await students_cursor.to_list(length=500)
-
-                    candidate_embeddings = []
-                    for s in students_list:
-                        candidate_embeddings.append(
-                            {
-                                "student_id": str(s["userId"]),
-                                "embeddings": s["face_embeddings"],
-                            }
-                        )
-
-                    for i, face in enumerate(faces):
-                        match_resp = await ml_client.match_faces(
-                            query_embedding=face["embedding"],
-                            candidate_embeddings=candidate_embeddings,
-                            threshold=ML_UNCERTAIN_THRESHOLD,
-                        )
-
-                        if not match_resp.get("success"):
-                            raise RuntimeError(
-                                match_resp.get("error", "ML match failed")
-                            )
-
-                        match_data = match_resp.get("match") or {}
-                        best_student_id = match_data.get("student_id")
-                        distance = match_data.get("distance", 1.0)
-                        confidence = match_data.get("confidence", 0.0)
-
-                        status_str = "unknown"
-                        student_details = None
-
-                        match_found = False
-                        if best_student_id:
-                            # Verify thresholds
-                            if distance < ML_CONFIDENT_THRESHOLD:
-                                status_str = "present"
-                                match_found = True
-                            elif distance < ML_UNCERTAIN_THRESHOLD:
-                                status_str = "uncertain"
-                                match_found = True
-
-                            if match_found:
-                                matched_student = next(
-                                    (
-                                        s
-                                        for s in students_list
-                                        if str(s["userId"]) == best_student_id
-                                    ),
-                                    None,
-                                )
-                                if matched_student:
-                                    user_info = await db.users.find_one(
-                                        {"_id": matched_student["userId"]},
-                                        {"name": 1, "roll": 1},
-                                    )
-                                    student_details = {
-                                        "id": str(matched_student["userId"]),
-                                        "name": matched_student.get("name")
-                                        or (
-                                            user_info.get("name")
-                                            if user_info
-                                            else "Unknown"
-                                        ),
-                                        "roll": user_info.get("roll")
-                                        if user_info
-                                        else "",
-                                    }
-
-                        # Check liveness
-                        is_live = face.get("is_live")  # Don't default to True!
-                        if is_live is False:
-                            status_str = "spoof"
-                            student_details = None
-                        elif is_live is None:
-                            status_str = "unknown"
-                            student_details = None
-                            logger.warning(f"Face live check returned None (index {i})")
-
-                        result_item = {
-                            "box": {
-                                "top": face["location"].get("top"),
-                                "right": face["location"].get("right"),
-                                "bottom": face["location"].get("bottom"),
-                                "left": face["location"].get("left"),
-                            },
-                            "status": status_str,
-                            "distance": round(distance, 4) if best_student_id else None,
-                            "confidence": round(confidence, 3)
-                            if best_student_id
-                            else None,
-                            "student": student_details,
-                        }
-
-                        if status_str == "present" or status_str == "uncertain":
-                            matched_results.append(result_item)
-                        else:
-                            unmatched_results.append(result_item)
-
-                        # Send incremental update per face
-                        await websocket.send_json(
-                            {
-                                "type": "match_update",
-                                "match": result_item,
-                                "pending": count - (i + 1),
-                            }
-                        )
-
-                    # Final Complete Message
-                    await websocket.send_json(
-                        {
-                            "type": "complete",
-                            "status": "complete",
-                            "matched": matched_results,
-                            "unmatched": unmatched_results,
-                        }
-                    )
-
-                except Exception as ex:
-                    logger.error(f"Error processing frame: {ex}", exc_info=True)
-                    await websocket.send_json(
-                        {
-                            "type": "error",
-                            "message": f"Processing failed: {str(ex)}",
-                        }
-                    )
-                    await websocket.send_json(
-                        {
-                            "type": "complete",
-                            "status": "failed",
-                            "matched": matched_results,
-                            "unmatched": unmatched_results,
-                        }
+                await stream.submit(
+                    Frame(
+                        image=image_b64,
+                        subject_id=subject_id,
+                        user=user,
+                        frame_id=data.get("frame_id"),
                     )
+                )
 
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected: {session_id}")
+    finally:
+        await stream.close()
 
 
 def _parse_object_id(value: str, field_name: str) -> ObjectId:
@@ -505,11 +341,9 @@ async def mark_attendance_qr(
     is_proxy_suspected = False
     dist = 0.0
 
-    # Try to get live session location first from socket service
+    # Try to get live session location first from the shared session state
     # This allows for dynamic location updates per session
-    from app.services.attendance_socket_service import session_locations
-
-    session_loc = session_locations.get(payload.sessionId)
+    session_loc = await session_state.get_location(payload.sessionId)
 
     logger.debug("Session id: %s, session_loc: %s", payload.sessionId, session_loc)
 
@@ -645,9 +479,9 @@ async def mark_attendance_qr(
     student_name = student_info.get("name", "Unknown") if student_info else "Unknown"
     student_roll = student_info.get("roll", "") if student_info else ""
 
-    # Emit to teacher's room
-    await sio.emit(
-        "student_scanned",
+    # Queue for the teacher's room
+    await scan_broadcaster.publish(
+        payload.sessionId,
         {
             "student": {
                 "name": student_name,
@@ -662,7 +496,6 @@ async def mark_attendance_qr(
             "is_proxy_suspected": is_proxy_suspected,
             "distance": dist,
         },
-        room=payload.sessionId,
     )
 
     return {
@@ -688,6 +521,10 @@ async def mark_attendance(request: Request, response: Response, payload: Dict):
       "subject_id": "..."
     }
 
+    Several photos of the same room can be sent as "images" instead of
+    "image"; faces are then detected in parallel and each student is
+    reported once across all photos.
+
     headers:
     {
       "X-Device-ID": "unique-device-uuid"
@@ -766,9 +603,20 @@ async def mark_attendance(request: Request, response: Response, payload: Dict):
         )
 
     image_b64 = payload.get("image")
+    images_b64 = payload.get("images")
     subject_id = payload.get("subject_id")
 
-    if not image_b64 or not subject_id:
+    if images_b64 is not None and (
+        not isinstance(images_b64, list)
+        or not images_b64
+        or len(images_b64) > MAX_MARK_IMAGES
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=f"images must be a list of 1 to {MAX_MARK_IMAGES} images",
+        )
+
+    if not (image_b64 or images_b64) or not subject_id:
         raise HTTPException(status_code=400, detail="image and subject_id required")
 
     # Load subject
@@ -821,19 +669,22 @@ async def mark_attendance(request: Request, response: Response, payload: Dict):
         s["student_id"] for s in subject.get("students", []) if s.get("verified", False)
     ]
 
-    # Strip base64 header
-    if "," in image_b64:
-        _, image_b64 = image_b64.split(",", 1)
+    if images_b64:
+        return await _mark_attendance_images(
+            [_strip_image_header(image) for image in images_b64],
+            subject_id,
+            student_user_ids,
+        )
 
-    try:
-        _ = base64.b64decode(image_b64)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid base64 image")
+    image_b64 = _strip_image_header(image_b64)
 
     # Call ML service to detect faces
     try:
         ml_response = await ml_client.detect_faces(
-            image_base64=image_b64, min_face_area_ratio=0.01, num_jitters=3, model="hog"
+            image_base64=image_b64,
+            min_face_area_ratio=0.01,
+            num_jitters=3,
+            model=ML_DETECTION_MODEL,
         )
 
         if not ml_response.get("success"):
@@ -861,25 +712,17 @@ async def mark_attendance(request: Request, response: Response, payload: Dict):
 
     students = await students_cursor.to_list(length=500)
 
-    # Prepare candidate embeddings for batch matching
-    candidate_embeddings = []
-    for student in students:
-        candidate_embeddings.append(
-            {
-                "student_id": str(student["userId"]),
-                "embeddings": student["face_embeddings"],
-            }
-        )
-
     # Call ML service to match faces
     try:
         match_response = await ml_client.batch_match(
             detected_faces=[
                 {"embedding": face["embedding"]} for face in detected_faces
             ],
-            candidate_embeddings=candidate_embeddings,
+            candidate_embeddings=build_candidate_embeddings(students),
             confident_threshold=ML_CONFIDENT_THRESHOLD,
             uncertain_threshold=ML_UNCERTAIN_THRESHOLD,
+            gallery_id=subject_gallery_id(subject_id),
+            gallery_version=gallery_version(students),
         )
 
         if not match_response.get("success"):
@@ -896,8 +739,9 @@ async def mark_attendance(request: Request, response: Response, payload: Dict):
         raise HTTPException(status_code=500, detail=f"Failed to match faces: {str(e)}")
 
     # Build results
-    results = []
     logger.info("Faces detected: %d", len(detected_faces))
+    students_by_id = {str(s["userId"]): s for s in students}
+    resolved = []
 
     for i, (face, match) in enumerate(zip(detected_faces, matches)):
         student_id = match.get("student_id")
@@ -905,11 +749,7 @@ async def mark_attendance(request: Request, response: Response, payload: Dict):
         status = match.get("status")  # "present" or "unknown"
 
         # Find student details
-        best_match = None
-        if student_id:
-            best_match = next(
-                (s for s in students if str(s["userId"]) == student_id), None
-            )
+        best_match = students_by_id.get(student_id) if student_id else None
 
         # Determine status based on config thresholds
         if distance < ML_CONFIDENT_THRESHOLD:
@@ -933,40 +773,163 @@ async def mark_attendance(request: Request, response: Response, payload: Dict):
             distance,
             is_live,
         )
+        resolved.append((face, status, distance, best_match))
+
+    # Get user details of every matched student at once
+    users = await _users_by_id(best_match for _, _, _, best_match in resolved)
+    results = [
+        _face_result(
+            face.get("location", {}),
+            status,
+            distance,
+            best_match,
+            users.get(best_match["userId"]) if best_match else None,
+        )
+        for face, status, distance, best_match in resolved
+    ]
+
+    return {"faces": results, "count": len(results)}
+
+
+def _strip_image_header(image_b64: str) -> str:
+    """Strip a data URL header and reject payloads that are not base64."""
+    if "," in image_b64:
+        _, image_b64 = image_b64.split(",", 1)
+
+    try:
+        _ = base64.b64decode(image_b64)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid base64 image")
+
+    return image_b64
+
+
+async def _users_by_id(students) -> Dict:
+    """Name and roll of the given students' users, fetched in one query."""
+    user_ids = list({s["userId"] for s in students if s})
+    if not user_ids:
+        return {}
+    users = await db.users.find(
+        {"_id": {"$in": user_ids}}, {"name": 1, "roll": 1}
+    ).to_list(length=None)
+    return {u["_id"]: u for u in users}
+
+
+def _face_result(location: Dict, status: str, distance, best_match, user) -> Dict:
+    """Face entry of a /mark response."""
+    return {
+        "box": {
+            "top": location.get("top"),
+            "right": location.get("right"),
+            "bottom": location.get("bottom"),
+            "left": location.get("left"),
+        },
+        "status": status,
+        "distance": None if not best_match else round(distance, 4),
+        "confidence": None if not best_match else round(max(0.0, 1.0 - distance), 3),
+        "student": None
+        if not best_match
+        else {
+            "id": str(best_match["userId"]),
+            "roll": user.get("roll") if user else None,
+            "name": best_match["name"],
+        },
+    }
+
+
+async def _mark_attendance_images(
+    images_b64: List[str], subject_id: str, student_user_ids: List
+) -> Dict:
+    """
+    /mark for several photos of the same room.
+
+    The ML service detects all photos in parallel, matches them in one pass
+    and dedupes students across photos; only each student's best face is
+    returned, tagged with the photo it came from.
+    """
+    students_cursor = db.students.find(
+        {
+            "userId": {"$in": student_user_ids},
+            "verified": True,
+            "face_embeddings": {"$exists": True, "$ne": []},
+        }
+    )
+    students = await students_cursor.to_list(length=500)
+
+    try:
+        ml_response = await ml_client.detect_faces_batch(
+            images_base64=images_b64,
+            candidate_embeddings=build_candidate_embeddings(students),
+            threshold=ML_MATCH_SIMILARITY,
+            min_face_area_ratio=0.01,
+            model=ML_DETECTION_MODEL,
+            gallery_id=subject_gallery_id(subject_id),
+            gallery_version=gallery_version(students),
+        )
 
-        # Get user details
-        user = None
-        if best_match:
-            user = await db.users.find_one(
-                {"_id": best_match["userId"]}, {"name": 1, "roll": 1}
+        if not ml_response.get("success"):
+            raise HTTPException(
+                status_code=500,
+                detail=f"ML service error: {ml_response.get('error', 'Unknown error')}",
             )
 
-        # Build result
-        location = face.get("location", {})
-        results.append(
-            {
-                "box": {
-                    "top": location.get("top"),
-                    "right": location.get("right"),
-                    "bottom": location.get("bottom"),
-                    "left": location.get("left"),
-                },
-                "status": status,
-                "distance": None if not best_match else round(distance, 4),
-                "confidence": None
-                if not best_match
-                else round(max(0.0, 1.0 - distance), 3),
-                "student": None
-                if not best_match
-                else {
-                    "id": str(best_match["userId"]),
-                    "roll": user.get("roll") if user else None,
-                    "name": best_match["name"],
-                },
-            }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to detect faces: {str(e)}")
+
+    students_by_id = {str(s["userId"]): s for s in students}
+    resolved = []
+
+    for image in ml_response.get("images", []):
+        if not image.get("success"):
+            logger.warning(
+                "Image %s could not be processed: %s",
+                image.get("image_index"),
+                image.get("error"),
+            )
+            continue
+
+        for face in image.get("faces", []):
+            # Seen with higher confidence in another photo
+            if face.get("duplicate"):
+                continue
+
+            match = face.get("match") or {}
+            best_match = students_by_id.get(match.get("student_id"))
+            distance = match.get("distance", 1.0)
+
+            if distance < ML_CONFIDENT_THRESHOLD:
+                status = "present"
+            elif distance < ML_UNCERTAIN_THRESHOLD:
+                status = "uncertain"
+            else:
+                status = "unknown"
+                best_match = None
+
+            if not face.get("is_live", True):
+                status = "spoof"
+                best_match = None
+
+            resolved.append(
+                (image.get("image_index"), face, status, distance, best_match)
+            )
+
+    users = await _users_by_id(best_match for *_, best_match in resolved)
+    results = []
+    for image_index, face, status, distance, best_match in resolved:
+        result = _face_result(
+            face.get("location", {}),
+            status,
+            distance,
+            best_match,
+            users.get(best_match["userId"]) if best_match else None,
         )
+        result["image_index"] = image_index
+        results.append(result)
 
-    return {"faces": results, "count": len(results)}
+    logger.info(
+        "Faces detected across %d images: %d", len(images_b64), len(results)
+    )
+    return {"faces": results, "count": len(results), "images": len(images_b64)}
 
 
 @router.post("/confirm")
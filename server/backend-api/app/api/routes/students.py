@@ -10,7 +10,10 @@ from ...db.mongo import db
 from ...core.security import get_current_user
 from app.services.students import get_student_profile
 from app.services.ml_client import ml_client
-from app.services import schedule_service
+from app.services.face_gallery import LEGACY_EMBEDDING_MODEL, embedding_model
+from app.core.config import EMBEDDING_STORAGE_FORMAT
+from app.utils.embedding_storage import pack_embedding
+from app.services import gallery_cache, schedule_service
 from app.utils.file_security import file_validator
 from app.utils.rate_limiter import enforce_upload_rate_limit
 
@@ -260,21 +263,48 @@ async def upload_image_url(
 
     # 7. Store image_url + embeddings with audit trail
     try:
-        update_result = await db.students.update_one(
+        model_version = ml_response.get("model_version") or LEGACY_EMBEDDING_MODEL
+        embedding = pack_embedding(embedding, EMBEDDING_STORAGE_FORMAT)
+        update = {
+            "$set": {
+                "image_url": image_url, 
+                "verified": True,
+                "last_face_update": datetime.now(timezone.utc),
+                "face_image_hash": validation_result['hash'],
+                "face_embedding_model": model_version,
+            },
+            "$push": {"face_embeddings": embedding},
+            # Copies re-encoded from the previous photo are stale now; the
+            # embedding migration job picks the student up again
+            "$unset": {"face_embeddings_by_model": ""},
+        }
+
+        # Embeddings of different encoders cannot be compared; start over
+        # instead of appending to another encoder's embeddings
+        existing = await db.students.find_one(
             {"userId": student_user_id},
             {
-                "$set": {
-                    "image_url": image_url, 
-                    "verified": True,
-                    "last_face_update": datetime.now(timezone.utc),
-                    "face_image_hash": validation_result['hash']
-                },
-                "$push": {"face_embeddings": embedding},
+                "face_embedding_model": 1,
+                "face_embeddings": {"$slice": 1},
+                "subjects": 1,
             },
         )
+        if (
+            existing
+            and existing.get("face_embeddings")
+            and embedding_model(existing) != model_version
+        ):
+            del update["$push"]
+            update["$set"]["face_embeddings"] = [embedding]
+
+        update_result = await db.students.update_one(
+            {"userId": student_user_id}, update
+        )
         
         if update_result.modified_count == 0:
             logger.warning(f"No student record updated for user {user_id}")
+        elif existing:
+            await gallery_cache.invalidate(*existing.get("subjects", []))
             
     except Exception as e:
         logger.error(f"Database update failed for user {user_id}: {e}")
@@ -432,6 +462,7 @@ async def add_subject(subject_id: str, current_user: dict = Depends(get_current_
             }
         },
     )
+    await gallery_cache.invalidate(subject_oid)
 
     # 5️⃣ CREATE NOTIFICATION FOR TEACHERS
     # Get all professor IDs for this subject
@@ -494,6 +525,7 @@ async def remove_subject(
     await db.subjects.update_one(
         {"_id": subject_oid}, {"$pull": {"students": {"student_id": user_oid}}}
     )
+    await gallery_cache.invalidate(subject_oid)
 
     return {"message": "Subject removed successfully"}
 
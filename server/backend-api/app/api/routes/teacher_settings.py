@@ -8,10 +8,11 @@ from bson import ObjectId, errors as bson_errors
 
 from app.core.cloudinary_config import cloudinary
 from app.utils.utils import serialize_bson
+from app.utils.embedding_storage import embeddings_to_lists
 from app.api.deps import get_current_teacher
 from app.services.subject_service import add_subject_for_teacher
 from app.db.subjects_repo import get_subjects_by_ids
-from app.services import schedule_service
+from app.services import gallery_cache, schedule_service
 from app.schemas.schedule import Schedule
 from app.services.attendance_alerts import send_low_attendance_for_teacher
 from app.utils.file_security import file_validator
@@ -490,7 +491,7 @@ async def get_subject_students(
                 "roll": student_doc.get("roll"),
                 "year": student_doc.get("year"),
                 "branch": student_doc.get("branch"),
-                "embeddings": student_doc.get("face_embeddings", []),
+                "embeddings": embeddings_to_lists(student_doc.get("face_embeddings")),
                 "avatar": student_doc.get("image_url"),
                 "verified": s.get("verified", False),
                 "attendance": s.get("attendance", {"present": 0, "absent": 0}),
@@ -661,6 +662,7 @@ async def verify_student(
             status_code=404, detail="Student not enrolled in this subject"
         )
 
+    await gallery_cache.invalidate(subj_id)
     return {"message": "Student verified successfully"}
 
 
@@ -685,6 +687,7 @@ async def remove_student(
     )
 
     await db.students.update_one({"userId": stud_id}, {"$pull": {"subjects": subj_id}})
+    await gallery_cache.invalidate(subj_id)
 
     return {"message": "Student removed from subject"}
 
@@ -73,6 +73,60 @@ ML_SERVICE_URL = os.getenv("ML_SERVICE_URL", "http://localhost:8001")
 ML_SERVICE_TIMEOUT = float(os.getenv("ML_SERVICE_TIMEOUT", "30"))
 ML_SERVICE_MAX_RETRIES = int(os.getenv("ML_SERVICE_MAX_RETRIES", "3"))
 ML_API_KEY = os.getenv("ML_API_KEY")
+# Embedding wire format requested from the ML service: f32, f16 or json
+ML_EMBEDDING_FORMAT = os.getenv("ML_EMBEDDING_FORMAT", "f32")
+# Encoder version (ML_ENCODER on the ML service) whose embeddings are matched:
+# "patch-96-v1" for the legacy patch encoder, "sface-2021dec" for SFace
+ML_EMBEDDING_MODEL = os.getenv("ML_EMBEDDING_MODEL", "patch-96-v1")
+# Images per encode-faces-batch call (MAX_BATCH_IMAGES on the ML service)
+ML_MAX_BATCH_IMAGES = int(os.getenv("ML_MAX_BATCH_IMAGES", "10"))
+# Precision of embeddings stored in Mongo as packed binary: f32 or f16
+EMBEDDING_STORAGE_FORMAT = os.getenv("EMBEDDING_STORAGE_FORMAT", "f32")
+# Detection model for /attendance/mark photos: "hog" detects on the whole
+# image; "tiled" finds back-row faces in high-resolution lecture-hall photos
+# at several detector passes per photo
+ML_DETECTION_MODEL = os.getenv("ML_DETECTION_MODEL", "hog")
+
+# Redis (optional): shared state and invalidation messages across workers
+REDIS_URL = os.getenv("REDIS_URL", "")
+# Seconds a cached subject gallery may be served before it is reloaded, as a
+# bound on staleness from writes made outside the API (0 disables the cache)
+GALLERY_CACHE_TTL_SECONDS = float(os.getenv("GALLERY_CACHE_TTL_SECONDS", "300"))
+# Seconds live QR session state (teacher location, unflushed scans) is kept
+# in Redis after its last update
+SESSION_STATE_TTL_SECONDS = int(os.getenv("SESSION_STATE_TTL_SECONDS", "43200"))
+# Append-only journal of live QR scans not yet saved to Mongo, replayed on
+# startup when session state is kept in memory (empty disables it)
+SCAN_JOURNAL_PATH = os.getenv(
+    "SCAN_JOURNAL_PATH", str(BASE_DIR / "data" / "scan_journal.jsonl")
+)
+
+# Live QR scans are flushed to Mongo once a session has this many pending,
+# once its oldest pending scan is this old, or when the session ends
+ATTENDANCE_FLUSH_BATCH_SIZE = int(os.getenv("ATTENDANCE_FLUSH_BATCH_SIZE", "50"))
+ATTENDANCE_FLUSH_MAX_AGE_SECONDS = float(
+    os.getenv("ATTENDANCE_FLUSH_MAX_AGE_SECONDS", "60")
+)
+# How often sessions are checked for an age-triggered flush, and how many
+# sessions may be flushed at once
+ATTENDANCE_FLUSH_CHECK_SECONDS = float(
+    os.getenv("ATTENDANCE_FLUSH_CHECK_SECONDS", "10")
+)
+ATTENDANCE_FLUSH_CONCURRENCY = int(os.getenv("ATTENDANCE_FLUSH_CONCURRENCY", "8"))
+
+# Milliseconds a live session's accepted scans are collected before they
+# are broadcast to the teacher as one students_scanned event (0 disables)
+SCAN_BROADCAST_WINDOW_MS = float(os.getenv("SCAN_BROADCAST_WINDOW_MS", "200"))
+
+# Live recognition streams: how many frames of one connection may be at the
+# ML service at once, and the range of frame rates recommended to clients
+FRAME_MAX_IN_FLIGHT = int(os.getenv("FRAME_MAX_IN_FLIGHT", "2"))
+FRAME_MAX_FPS = float(os.getenv("FRAME_MAX_FPS", "2.0"))
+FRAME_MIN_FPS = float(os.getenv("FRAME_MIN_FPS", "0.25"))
+# Frames a client may send back to back before the rate applies
+FRAME_BURST = float(os.getenv("FRAME_BURST", "2"))
+# ML queue load (in flight / capacity) above which the frame rate is lowered
+FRAME_LOAD_LOW = float(os.getenv("FRAME_LOAD_LOW", "0.5"))
 
 # Rate Limiting Configuration
 RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "10/minute")
@@ -87,6 +141,9 @@ TRUSTED_PROXIES = os.getenv("TRUSTED_PROXIES", "")
 # ML Thresholds
 ML_CONFIDENT_THRESHOLD = float(os.getenv("ML_CONFIDENT_THRESHOLD", "0.50"))
 ML_UNCERTAIN_THRESHOLD = float(os.getenv("ML_UNCERTAIN_THRESHOLD", "0.60"))
+# The thresholds above are distances; the ML service takes a minimum
+# similarity (1 - distance), so every uncertain match comes back
+ML_MATCH_SIMILARITY = 1.0 - ML_UNCERTAIN_THRESHOLD
 
 CLOUDINARY_CLOUD_NAME = os.getenv("CLOUDINARY_CLOUD_NAME")
 CLOUDINARY_API_KEY = os.getenv("CLOUDINARY_API_KEY")
@@ -1,4 +1,4 @@
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 # Business Logic Metrics
 ATTENDANCE_MARKED = Counter(
@@ -13,3 +13,32 @@ STUDENT_REGISTRATION = Counter(
 # but usually business metrics are what we add manually.
 
 ACTIVE_TEACHERS = Gauge("active_teachers_total", "Number of currently active teachers")
+
+# Re-embedding of stored face photos with a new encoder
+EMBEDDING_MIGRATION_STUDENTS = Counter(
+    "embedding_migration_students_total",
+    "Students processed by the embedding migration job",
+    ["model", "outcome"],
+)
+EMBEDDING_MIGRATION_PROGRESS = Gauge(
+    "embedding_migration_progress_ratio",
+    "Fraction of students with embeddings for the target encoder",
+    ["model"],
+)
+
+# Live frame recognition
+RECOGNITION_STAGE_SECONDS = Histogram(
+    "recognition_stage_seconds",
+    "Time spent per stage of live frame recognition",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+RECOGNITION_FRAMES = Counter(
+    "recognition_frames_total",
+    "Live frames by outcome",
+    ["outcome"],
+)
+RECOMMENDED_FRAME_RATE = Gauge(
+    "recommended_frame_rate_fps",
+    "Frame rate currently recommended to live recognition clients",
+)
@@ -1,6 +1,7 @@
 import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from app.core.config import ATTENDANCE_FLUSH_CHECK_SECONDS
 from app.services.attendance_alerts import process_monthly_low_attendance_alerts
 from app.services.attendance_socket_service import flush_attendance_data
 
@@ -18,11 +19,12 @@ def start_scheduler():
         name="Monthly Low Attendance Alerts",
     )
 
-    # Batch flush every 5 minutes
+    # Flush live scan buffers whose oldest scan is due; full buffers and
+    # ended sessions are flushed right away
     scheduler.add_job(
         flush_attendance_data,
         trigger="interval",
-        minutes=5,
+        seconds=ATTENDANCE_FLUSH_CHECK_SECONDS,
         id="flush_attendance_data",
         replace_existing=True,
         name="Flush Attendance Buffer",
@@ -31,8 +31,11 @@ NONCE_TTL_SECONDS: int = int(os.getenv("NONCE_TTL_SECONDS", "30"))
 _redis_client = None  # lazily initialised
 
 
-async def _get_redis():
-    """Return an async Redis client, creating it on first call."""
+async def get_redis():
+    """
+    Return the worker's async Redis client, creating it on first call.
+    Other Redis users in the worker (e.g. gallery invalidation) share it.
+    """
     global _redis_client
     if _redis_client is not None:
         return _redis_client
@@ -91,7 +94,7 @@ async def is_nonce_used(nonce: str) -> bool:
     `consume_nonce` call performs the actual atomic insert/set.
     This function is a fast pre-check to short-circuit early.
     """
-    r = await _get_redis()
+    r = await get_redis()
 
     if r is not None:
         # Redis: key exists → already used
@@ -116,7 +119,7 @@ async def consume_nonce(nonce: str) -> bool:
     Mongo path uses insert_one with `_id = nonce` so a duplicate raises
     DuplicateKeyError — equally atomic.
     """
-    r = await _get_redis()
+    r = await get_redis()
 
     if r is not None:
         # SET NX + EX guarantees atomicity; returns True only on first set.
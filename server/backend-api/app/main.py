@@ -36,6 +36,8 @@ from app.services.attendance import ensure_indexes as ensure_attendance_indexes
 from app.services.schedule_service import ensure_indexes as ensure_schedule_indexes
 from app.services.ml_client import ml_client
 from app.services.attendance_socket_service import sio
+from app.services import gallery_cache
+from app.services.session_state import session_state
 
 # DB
 from app.db.mongo import db, verify_db_connection
@@ -114,6 +116,16 @@ async def lifespan(app: FastAPI):
     except Exception:
         logger.error("Failed to create refresh token indexes", exc_info=True)
 
+    gallery_cache.start_invalidation_listener()
+
+    try:
+        restored = await session_state.restore()
+        if restored:
+            logger.info("Restored unsaved QR scans", count=restored)
+
+    except Exception:
+        logger.error("Failed to restore live session state", exc_info=True)
+
     try:
         start_scheduler()
         logger.info("Scheduler started")
@@ -124,7 +136,9 @@ async def lifespan(app: FastAPI):
     yield
 
     await ml_client.close()
+    await gallery_cache.stop_invalidation_listener()
     await close_redis()
+    await session_state.close()
     shutdown_scheduler()
 
     logger.info("Application shutdown complete")
@@ -1,44 +1,84 @@
+import asyncio
 import logging
 import time
 from datetime import datetime, date
-from typing import Dict, List, Any
+from typing import Any, Dict, List, Optional, Tuple
 
 import socketio
 from bson import ObjectId
 from bson import errors as bson_errors
 from pymongo import UpdateOne
 
-from app.core.config import ORIGINS, ML_CONFIDENT_THRESHOLD, ML_UNCERTAIN_THRESHOLD
+from app.core.config import (
+    ATTENDANCE_FLUSH_BATCH_SIZE,
+    ATTENDANCE_FLUSH_CONCURRENCY,
+    ATTENDANCE_FLUSH_MAX_AGE_SECONDS,
+    ORIGINS,
+    REDIS_URL,
+    SCAN_BROADCAST_WINDOW_MS,
+)
 from app.db.mongo import db
 from app.services.attendance import log_grouped_attendance
 from app.services.attendance_daily import save_daily_summary
+from app.services.recognition_pipeline import Frame, RecognitionStream
+from app.services.scan_broadcaster import ScanBroadcaster
+from app.services.session_state import SESSION_ENDED, session_state
 from app.utils.geo import calculate_distance
 from app.utils.jwt_token import decode_jwt
 
 logger = logging.getLogger(__name__)
 
 # Initialize Socket.IO server
-# cors_allowed_origins uses the same whitelist as the FastAPI CORS middleware
+# cors_allowed_origins uses the same whitelist as the FastAPI CORS middleware.
+# With Redis, room emits reach clients connected to any worker.
 sio = socketio.AsyncServer(
     async_mode="asgi",
     cors_allowed_origins=ORIGINS,
     cors_credentials=True,
+    client_manager=socketio.AsyncRedisManager(REDIS_URL) if REDIS_URL else None,
 )
 
-# In-memory storage for active sessions
-# Key: session_id (str)
-# Value: List of scan records
-active_sessions: Dict[str, List[Dict[str, Any]]] = {}
 
-# Teacher location cache (to avoid DB lookup on every scan)
+async def _emit_to_room(event: str, payload: Dict[str, Any], room: str) -> None:
+    await sio.emit(event, payload, room=room)
+
+
+# Accepted scans reach the teacher's room in batches
+scan_broadcaster = ScanBroadcaster(_emit_to_room, SCAN_BROADCAST_WINDOW_MS / 1000)
+
+# Session locations and scan buffers live in app.services.session_state, so
+# that any worker can handle a session's scans.
+
+# Running flush of each session started by this worker
+# Key: session_id
+_flush_tasks: Dict[str, asyncio.Task] = {}
+_flush_slots = asyncio.Semaphore(ATTENDANCE_FLUSH_CONCURRENCY)
+
+# Teacher and enrolment count of each session's subject, read once per
+# session for the attendance logs and daily summary; dropped by the scheduled
+# flush once the session is closed, whichever worker closed it
 # Key: session_id
-# Value: { lat: float, lon: float, subjectIdx: str }
-session_locations: Dict[str, Dict[str, Any]] = {}
+_session_subjects: Dict[str, Tuple[Any, int]] = {}
+
+# Live recognition stream of each connected teacher
+# Key: sid
+_frame_streams: Dict[str, RecognitionStream] = {}
 
-# Per-connection rate limiting for process_frame
-# Key: sid, Value: last_process_time (float)
-_frame_last_processed: Dict[str, float] = {}
-_MIN_FRAME_INTERVAL = 0.5  # ~2 FPS per client
+# Stream events sent under a different Socket.IO event name
+_STREAM_EVENTS = {"error": "ml_error", "skipped": "frame_skipped"}
+
+
+def _frame_stream(sid: str) -> RecognitionStream:
+    stream = _frame_streams.get(sid)
+    if stream is None:
+
+        async def emit(event: str, payload: Dict[str, Any]) -> None:
+            await sio.emit(
+                _STREAM_EVENTS.get(event, event), {"type": event, **payload}, room=sid
+            )
+
+        stream = _frame_streams[sid] = RecognitionStream(emit)
+    return stream
 
 
 @sio.event
@@ -49,7 +89,9 @@ async def connect(sid, environ):
 @sio.event
 async def disconnect(sid):
     logger.info(f"Socket disconnected: {sid}")
-    _frame_last_processed.pop(sid, None)
+    stream = _frame_streams.pop(sid, None)
+    if stream is not None:
+        await stream.close()
 
 
 @sio.on("join_session")
@@ -68,22 +110,20 @@ async def handle_join_session(sid, data):
     await sio.enter_room(sid, session_id)
 
     # Store teacher location and subject mapping
+    location = None
     if "latitude" in data and "longitude" in data:
-        session_locations[session_id] = {
+        location = {
             "lat": float(data["latitude"]),
             "lon": float(data["longitude"]),
             "subjectId": subject_id,
         }
     elif subject_id:
-        session_locations[session_id] = {
+        location = {
             "lat": 0.0,
             "lon": 0.0,
             "subjectId": subject_id,
         }
-
-    # Initialize buffer for this session if not exists
-    if session_id not in active_sessions:
-        active_sessions[session_id] = []
+    await session_state.join(session_id, location)
 
     logger.info(f"Teacher {sid} joined session {session_id} for subject {subject_id}")
     await sio.emit("session_joined", {"sessionId": session_id}, room=sid)
@@ -106,7 +146,7 @@ async def handle_scan_qr(sid, data):
         return
 
     # Get session info
-    session_info = session_locations.get(session_id)
+    session_info = await session_state.get_location(session_id)
     teacher_lat = session_info.get("lat") if session_info else 0
     teacher_lon = session_info.get("lon") if session_info else 0
     subject_id = session_info.get("subjectId") if session_info else None
@@ -119,7 +159,7 @@ async def handle_scan_qr(sid, data):
     is_proxy = False
     proxy_distance = 0
 
-    teacher_loc = session_locations.get(session_id)
+    teacher_loc = session_info
     if teacher_loc and lat and lon:
         try:
             # Using standard util
@@ -136,49 +176,73 @@ async def handle_scan_qr(sid, data):
         except Exception as e:
             logger.error(f"Error calculating distance: {e}")
 
-    # 2. Deduplication (Simple check in current buffer)
-    already_scanned = any(
-        s["studentId"] == student_id for s in active_sessions.get(session_id, [])
-    )
-
-    scan_status = "Proxy" if is_proxy else "Present"
-    if already_scanned:
-        scan_status = "Duplicate"
-
     scan_data = {
         "studentId": student_id,
         "timestamp": timestamp,
         "location": {"lat": lat, "lon": lon},
-        "status": scan_status,
+        "status": "Proxy" if is_proxy else "Present",
         "distance": proxy_distance,
         "isProxy": is_proxy,
         "subjectId": subject_id,  # Needed for persistence
     }
 
-    # 3. Add to Buffer
-    if session_id not in active_sessions:
-        active_sessions[session_id] = []
-
-    if not already_scanned:
-        active_sessions[session_id].append(scan_data)
-
-    # 4. Emit event to room (Teacher receives this)
-    await sio.emit("student_scanned", scan_data, room=session_id)
+    # 2. Add to Buffer, unless the session has ended or the student already
+    # has a scan in it
+    pending = await session_state.add_scan(session_id, scan_data)
+    if pending == SESSION_ENDED:
+        await sio.emit("scan_error", {"message": "Session has ended"}, room=sid)
+        return
+    if pending >= ATTENDANCE_FLUSH_BATCH_SIZE:
+        _schedule_flush(session_id)
+
+    # 4. Queue new scans for the room's next batch (Teacher receives this),
+    # in the same shape as the /attendance/qr route's
+    if pending:
+        await scan_broadcaster.publish(
+            session_id,
+            {
+                "student": await _scanned_student(student_id),
+                "timestamp": timestamp,
+                "location": {"lat": lat, "lon": lon},
+                "is_proxy_suspected": is_proxy,
+                "distance": proxy_distance,
+            },
+        )
 
     # Acknowledge to student
     await sio.emit("scan_ack", {"status": "recorded", "isProxy": is_proxy}, room=sid)
 
 
+async def _scanned_student(student_id: str) -> Dict[str, Any]:
+    """Name and roll number of a scanning student, for the teacher's list."""
+    try:
+        student_info = await db.students.find_one(
+            {"userId": ObjectId(student_id)}, {"name": 1, "roll": 1}
+        )
+    except bson_errors.InvalidId:
+        student_info = None
+    return {
+        "name": student_info.get("name", "Unknown") if student_info else "Unknown",
+        "roll": student_info.get("roll", "") if student_info else "",
+        "id": str(student_id),
+    }
+
+
 @sio.on("process_frame")
 async def handle_process_frame(sid, data):
     """
     Teacher emits webcam frame for ML face recognition.
-    Data: { session_id, image (base64), subject_id, token }
-    """
-    from app.services.ml_client import ml_client  # local import to avoid circular
+    Data: { session_id, image, subject_id, token, frame_id? }
 
+    ``image`` is a base64 data URL or, sent as a binary attachment, the JPEG
+    bytes themselves, which reach the ML service without base64.
+
+    Results are emitted by the connection's recognition stream as
+    processing_started, match_update and complete events; see
+    app.services.recognition_pipeline.
+    """
     token = data.get("token")
-    image_b64 = data.get("image")
+    image = data.get("image")
     subject_id = data.get("subject_id")
 
     # 1. Authenticate
@@ -207,462 +271,269 @@ async def handle_process_frame(sid, data):
         await sio.emit("ml_error", {"message": "Auth failed"}, room=sid)
         return
 
-    if not image_b64 or not subject_id:
+    if not image or not subject_id:
         await sio.emit("ml_error", {"message": "Missing image or subject_id"}, room=sid)
         return
 
-    # 2. Rate limiting
-    now = time.time()
-    last = _frame_last_processed.get(sid, 0.0)
-    if now - last < _MIN_FRAME_INTERVAL:
-        await sio.emit("frame_skipped", {"status": "rate_limited"}, room=sid)
-        return
-    _frame_last_processed[sid] = now
-
-    matched_results = []
-    unmatched_results = []
-
-    try:
-        # Strip data URL header if present
-        if "," in image_b64:
-            _, image_b64 = image_b64.split(",", 1)
-
-        # Detect faces
-        ml_response = await ml_client.detect_faces(
-            image_base64=image_b64,
-            min_face_area_ratio=0.01,
-            num_jitters=3,
-            model="hog",
+    await _frame_stream(sid).submit(
+        Frame(
+            image=image,
+            subject_id=subject_id,
+            user=user,
+            frame_id=data.get("frame_id"),
         )
+    )
 
-        if not ml_response.get("success"):
-            await sio.emit(
-                "ml_error",
-                {"message": ml_response.get("error", "ML Error")},
-                room=sid,
-            )
-            return
 
-        faces = ml_response.get("faces", [])
-        count = len(faces)
+@sio.on("end_session")
+async def handle_end_session(sid, data):
+    """
+    Teacher ends an attendance session.
+    Data: { sessionId }
+    """
+    session_id = data.get("sessionId")
+    if session_id:
+        logger.info(f"end_session requested for {session_id} by {sid}")
+        await stop_and_save_session(session_id)
+
 
-        await sio.emit(
-            "processing_started",
-            {"status": "processing", "matched": [], "pending": count},
-            room=sid,
+async def _session_subject_id(
+    session_id: str, scans: List[Dict[str, Any]]
+) -> Optional[str]:
+    # Assuming all scans in a session belong to the same subject
+    subject_id = scans[0].get("subjectId") if scans else None
+    if not subject_id:
+        # Fallback to the session's location record
+        sess_loc = await session_state.get_location(session_id)
+        if sess_loc:
+            subject_id = sess_loc.get("subjectId")
+    return subject_id
+
+
+async def _session_subject(session_id: str, subject_id: str) -> Tuple[Any, int]:
+    """Teacher id and number of enrolled students of the session's subject."""
+    info = _session_subjects.get(session_id)
+    if info is None:
+        # Only the first professor and the roster size, not the roster itself
+        subject_doc = await db.subjects.find_one(
+            {"_id": ObjectId(subject_id)},
+            {
+                "professor_ids": {"$slice": 1},
+                "enrolled": {"$size": {"$ifNull": ["$students", []]}},
+            },
         )
+        teacher_id = (
+            subject_doc["professor_ids"][0]
+            if subject_doc and subject_doc.get("professor_ids")
+            else None
+        )
+        info = (teacher_id, subject_doc.get("enrolled", 0) if subject_doc else 0)
+        _session_subjects[session_id] = info
+    return info
+
+
+async def _save_scans(
+    session_id: str, subject_id: str, scans: List[Dict[str, Any]]
+) -> int:
+    """Write buffered scans to MongoDB. Returns the number of records saved."""
+    today_str = date.today().isoformat()
+
+    # Deduplicate by student_id (first scan wins)
+    unique_scans = list({s["studentId"]: s for s in scans}.values())
+
+    operations = []
+    for scan in unique_scans:
+        student_oid = ObjectId(scan["studentId"])
+
+        attendance_record = {
+            "date": today_str,
+            "status": "Present",  # Or scan["status"]
+            "timestamp": scan["timestamp"],
+            "method": "qr",
+            "sessionId": session_id,
+            "isProxy": scan["isProxy"],
+            "distance": scan["distance"],
+        }
 
-        if count == 0:
-            await sio.emit(
-                "complete",
+        # Update subjects collection - push to attendanceRecords
+        operations.append(
+            UpdateOne(
+                {"_id": ObjectId(subject_id), "students.student_id": student_oid},
                 {
-                    "type": "complete",
-                    "status": "complete",
-                    "matched": [],
-                    "unmatched": [],
+                    "$push": {"students.$.attendanceRecords": attendance_record},
+                    "$inc": {
+                        "students.$.attendance.present": 1,
+                        "students.$.attendance.total": 1,
+                    },
+                    "$set": {"students.$.attendance.lastMarkedAt": today_str},
                 },
-                room=sid,
             )
-            return
+        )
 
-        # Fetch subject and enrolled students
-        try:
-            subject_oid = ObjectId(subject_id)
-            subject = await db.subjects.find_one(
-                {"_id": subject_oid}, {"students": 1, "professor_ids": 1}
-            )
-        except bson_errors.InvalidId:
-            subject = None
+    if not operations:
+        return 0
+
+    await db.subjects.bulk_write(operations)
+    logger.info(f"Flushed {len(operations)} records for session {session_id}")
+
+    # Insert grouped logs
+    teacher_id, total_enrolled = await _session_subject(session_id, subject_id)
+
+    log_students_data = [
+        {
+            "studentId": ObjectId(scan["studentId"]),
+            "scanTime": scan["timestamp"],
+            "method": "qr",
+            "sessionId": session_id,
+            "latitude": scan["location"]["lat"],
+            "longitude": scan["location"]["lon"],
+            "distance": scan["distance"],
+            "isProxy": scan["isProxy"],
+        }
+        for scan in unique_scans
+    ]
+
+    updated_logs = await log_grouped_attendance(
+        subject_id=subject_id,
+        date_str=today_str,
+        students=log_students_data,
+        teacher_id=teacher_id,
+    )
 
-        if not subject:
-            await sio.emit("ml_error", {"message": "Subject not found"}, room=sid)
-            return
+    # Update Analytics
+    if updated_logs and "students" in updated_logs:
+        present_count = len(updated_logs["students"])
+        absent_count = max(0, total_enrolled - present_count)
+
+        await save_daily_summary(
+            subject_id=ObjectId(subject_id),
+            teacher_id=teacher_id,
+            record_date=today_str,
+            present=present_count,
+            absent=absent_count,
+        )
 
-        if user.get("role") != "admin" and ObjectId(user_id) not in subject.get(
-            "professor_ids", []
-        ):
-            await sio.emit("ml_error", {"message": "Forbidden"}, room=sid)
-            return
+    return len(operations)
 
-        student_user_ids = [
-            s["student_id"]
-            for s in subject.get("students", [])
-            if s.get("verified", False)
-        ]
 
-        students_cursor = db.students.find(
-            {
-                "userId": {"$in": student_user_ids},
-                "verified": True,
-                "face_embeddings": {"$exists": True, "$ne": []},
-            }
-        )
-        students_list = await students_cursor.to_list(length=500)
+async def _flush_session(session_id: str) -> Optional[int]:
+    """
+    Save the scans a session got since its last flush and move its
+    watermark past them. Returns the number of records saved, or None when
+    nothing could be saved because another worker is flushing the session or
+    its subject is unknown.
+    """
+    async with _flush_slots, session_state.flush_lock(session_id) as acquired:
+        if not acquired:
+            return None
 
-        candidate_embeddings = [
-            {
-                "student_id": str(s["userId"]),
-                "embeddings": s["face_embeddings"],
-            }
-            for s in students_list
-        ]
-
-        for i, face in enumerate(faces):
-            match_resp = await ml_client.match_faces(
-                query_embedding=face["embedding"],
-                candidate_embeddings=candidate_embeddings,
-                threshold=ML_UNCERTAIN_THRESHOLD,
-            )
+        scans = await session_state.get_pending(session_id)
+        if not scans:
+            return 0
 
-            if not match_resp.get("success"):
-                raise RuntimeError(match_resp.get("error", "ML match failed"))
-
-            match_data = match_resp.get("match") or {}
-            best_student_id = match_data.get("student_id")
-            distance = match_data.get("distance", 1.0)
-            confidence = match_data.get("confidence", 0.0)
-
-            status_str = "unknown"
-            student_details = None
-
-            if best_student_id:
-                if distance < ML_CONFIDENT_THRESHOLD:
-                    status_str = "present"
-                elif distance < ML_UNCERTAIN_THRESHOLD:
-                    status_str = "uncertain"
-
-                if status_str in ("present", "uncertain"):
-                    matched_student = next(
-                        (
-                            s
-                            for s in students_list
-                            if str(s["userId"]) == best_student_id
-                        ),
-                        None,
-                    )
-                    if matched_student:
-                        user_info = await db.users.find_one(
-                            {"_id": matched_student["userId"]}, {"name": 1, "roll": 1}
-                        )
-                        student_details = {
-                            "id": str(matched_student["userId"]),
-                            "name": matched_student.get("name")
-                            or (user_info.get("name") if user_info else "Unknown"),
-                            "roll": user_info.get("roll") if user_info else "",
-                        }
-
-            is_live = face.get("is_live")
-            if is_live is False:
-                status_str = "spoof"
-                student_details = None
-            elif is_live is None:
-                status_str = "unknown"
-                student_details = None
-                logger.warning(f"Face live check returned None (index {i})")
-
-            result_item = {
-                "box": {
-                    "top": face["location"].get("top"),
-                    "right": face["location"].get("right"),
-                    "bottom": face["location"].get("bottom"),
-                    "left": face["location"].get("left"),
-                },
-                "status": status_str,
-                "distance": round(distance, 4) if best_student_id else None,
-                "confidence": round(confidence, 3) if best_student_id else None,
-                "student": student_details,
-            }
+        # We need subject_id to update db.subjects
+        subject_id = await _session_subject_id(session_id, scans)
+        if not subject_id:
+            logger.error(f"Cannot flush session {session_id}: Missing subjectId")
+            return None
 
-            if status_str in ("present", "uncertain"):
-                matched_results.append(result_item)
-            else:
-                unmatched_results.append(result_item)
+        saved = await _save_scans(session_id, subject_id, scans)
+        # Scans added while saving stay pending for the next flush
+        await session_state.mark_flushed(session_id, len(scans))
+        return saved
 
-            await sio.emit(
-                "match_update",
-                {"match": result_item, "pending": count - (i + 1)},
-                room=sid,
-            )
 
-        await sio.emit(
-            "complete",
-            {
-                "type": "complete",
-                "status": "complete",
-                "matched": matched_results,
-                "unmatched": unmatched_results,
-            },
-            room=sid,
-        )
+async def _flush_logged(session_id: str) -> Optional[int]:
+    try:
+        saved = await _flush_session(session_id)
+        if await session_state.is_ended(session_id):
+            pending, _since = await session_state.pending_stats(session_id)
+            if not pending:
+                await _close_session(session_id)
+        return saved
+    except Exception as e:
+        logger.error(f"Error flushing session {session_id}: {e}")
+        return None
 
-    except Exception as exc:
-        logger.error(f"Error processing frame for {sid}: {exc}", exc_info=True)
-        await sio.emit("ml_error", {"message": f"Processing failed: {exc}"}, room=sid)
-        await sio.emit(
-            "complete",
-            {
-                "type": "complete",
-                "status": "failed",
-                "matched": matched_results,
-                "unmatched": unmatched_results,
-            },
-            room=sid,
-        )
 
+def _schedule_flush(session_id: str) -> asyncio.Task:
+    """Start flushing a session unless this worker is already flushing it."""
+    task = _flush_tasks.get(session_id)
+    if task is None or task.done():
+        task = _flush_tasks[session_id] = asyncio.create_task(_flush_logged(session_id))
+    return task
 
-@sio.on("end_session")
-async def handle_end_session(sid, data):
-    """
-    Teacher ends an attendance session.
-    Data: { sessionId }
-    """
-    session_id = data.get("sessionId")
-    if session_id:
-        logger.info(f"end_session requested for {session_id} by {sid}")
-        await stop_and_save_session(session_id)
+
+async def _close_session(session_id: str) -> None:
+    """Drop the state of an ended session whose scans are all saved."""
+    await session_state.end(session_id)
+    _flush_tasks.pop(session_id, None)
+    _session_subjects.pop(session_id, None)
 
 
 async def flush_attendance_data():
     """
-    Scheduled task to flush buffered attendance to MongoDB.
+    Scheduled task to flush, concurrently, the sessions whose oldest pending
+    scan is due and the ended ones still to close. Full buffers are flushed
+    as soon as they fill up.
     """
-    if not active_sessions:
-        return
-
-    logger.info("Flushing attendance data...")
+    session_ids = await session_state.session_ids()
 
-    for session_id, scans in list(active_sessions.items()):
-        if not scans:
-            continue
+    # Sessions closed by any worker leave nothing behind on this one
+    for session_id in _session_subjects.keys() - set(session_ids):
+        del _session_subjects[session_id]
+    for session_id in _flush_tasks.keys() - set(session_ids):
+        if _flush_tasks[session_id].done():
+            del _flush_tasks[session_id]
 
-        # We need subject_id to update db.subjects
-        # It should be in the scans or session_locations
-        # Assuming all scans in a session belong to the same subject
-        first_scan = scans[0]
-        subject_id = first_scan.get("subjectId")
-
-        if not subject_id:
-            # Fallback to session_locations
-            sess_loc = session_locations.get(session_id)
-            if sess_loc:
-                subject_id = sess_loc.get("subjectId")
-
-        if not subject_id:
-            logger.error(f"Cannot flush session {session_id}: Missing subjectId")
-            continue
+    if not session_ids:
+        return
 
-        try:
-            operations = []
-            today_str = date.today().isoformat()
-
-            # Deduplicate by student_id (first scan wins)
-            unique_scans = {s["studentId"]: s for s in scans}.values()
-
-            for scan in unique_scans:
-                student_oid = ObjectId(scan["studentId"])
-
-                attendance_record = {
-                    "date": today_str,
-                    "status": "Present",  # Or scan["status"]
-                    "timestamp": scan["timestamp"],
-                    "method": "qr",
-                    "sessionId": session_id,
-                    "isProxy": scan["isProxy"],
-                    "distance": scan["distance"],
-                }
-
-                # Update subjects collection - push to attendanceRecords
-                op_subjects = UpdateOne(
-                    {"_id": ObjectId(subject_id), "students.student_id": student_oid},
-                    {
-                        "$push": {"students.$.attendanceRecords": attendance_record},
-                        "$inc": {
-                            "students.$.attendance.present": 1,
-                            "students.$.attendance.total": 1,
-                        },
-                        "$set": {"students.$.attendance.lastMarkedAt": today_str},
-                    },
-                )
-                operations.append(op_subjects)
-
-            if operations:
-                await db.subjects.bulk_write(operations)
-                logger.info(
-                    f"Flushed {len(operations)} records for session {session_id}"
-                )
-
-                # Insert grouped logs
-                subject_doc = await db.subjects.find_one({"_id": ObjectId(subject_id)})
-                teacher_id = (
-                    subject_doc["professor_ids"][0]
-                    if subject_doc and subject_doc.get("professor_ids")
-                    else None
-                )
-
-                log_students_data = []
-                for scan in unique_scans:
-                    log_students_data.append(
-                        {
-                            "studentId": ObjectId(scan["studentId"]),
-                            "scanTime": scan["timestamp"],
-                            "method": "qr",
-                            "sessionId": session_id,
-                            "latitude": scan["location"]["lat"],
-                            "longitude": scan["location"]["lon"],
-                            "distance": scan["distance"],
-                            "isProxy": scan["isProxy"],
-                        }
-                    )
-
-                updated_logs = None
-                if log_students_data:
-                    updated_logs = await log_grouped_attendance(
-                        subject_id=subject_id,
-                        date_str=today_str,
-                        students=log_students_data,
-                        teacher_id=teacher_id,
-                    )
-
-                # Update Analytics
-                if updated_logs and "students" in updated_logs:
-                    present_count = len(updated_logs["students"])
-                    total_enrolled = (
-                        len(subject_doc.get("students", [])) if subject_doc else 0
-                    )
-                    absent_count = max(0, total_enrolled - present_count)
-
-                    await save_daily_summary(
-                        subject_id=ObjectId(subject_id),
-                        teacher_id=teacher_id,
-                        record_date=today_str,
-                        present=present_count,
-                        absent=absent_count,
-                    )
-
-            # Clear flushed items (keep session active but clear buffer)
-            active_sessions[session_id] = []
+    now = time.time()
+    due = []
+    for session_id in session_ids:
+        pending, since = await session_state.pending_stats(session_id)
+        if (
+            pending >= ATTENDANCE_FLUSH_BATCH_SIZE
+            or (since is not None and now - since >= ATTENDANCE_FLUSH_MAX_AGE_SECONDS)
+            or await session_state.is_ended(session_id)
+        ):
+            due.append(session_id)
 
-        except Exception as e:
-            logger.error(f"Error flushing session {session_id}: {e}")
+    if due:
+        logger.info(f"Flushing attendance data of {len(due)} sessions...")
+        await asyncio.gather(*(_schedule_flush(session_id) for session_id in due))
 
 
 async def stop_and_save_session(session_id: str):
     """
-    Triggers immediate flush for a specific session and clears it.
+    Ends a session and saves its pending scans.
+
+    The session takes no more scans from now on. It is cleared once all its
+    scans are saved; when some stay unsaved (another worker holds the flush
+    lock, the subject is unknown or the save fails), the scheduled flush
+    saves them and closes the session, so ending never waits on a retry.
     """
     result_msg = "Session not found or empty"
+    pending = None
 
-    if session_id in active_sessions:
-        # Reuse flush logic for this session?
-        # Or just copy paste for simplicity/isolation
-
-        # To reuse flush, we can just call it, but flush iterates all.
-        # Let's extract flush logic for one session?
-        # For MVP, I'll essentially run the same logic.
-
-        scans = active_sessions[session_id]
-        if scans:
-            subject_id = scans[0].get("subjectId")
-            if not subject_id:
-                sess_loc = session_locations.get(session_id)
-                if sess_loc:
-                    subject_id = sess_loc.get("subjectId")
-
-            if subject_id:
-                try:
-                    operations = []
-                    today_str = date.today().isoformat()
-                    unique_scans = {s["studentId"]: s for s in scans}.values()
-
-                    # Grouped Logs & Analytics
-                    subject_doc = await db.subjects.find_one(
-                        {"_id": ObjectId(subject_id)}
-                    )
-                    teacher_id = (
-                        subject_doc["professor_ids"][0]
-                        if subject_doc and subject_doc.get("professor_ids")
-                        else None
-                    )
-
-                    log_students_data = []
-                    for scan in unique_scans:
-                        student_oid = ObjectId(scan["studentId"])
-                        attendance_record = {
-                            "date": today_str,
-                            "status": "Present",
-                            "timestamp": scan["timestamp"],
-                            "method": "qr",
-                            "sessionId": session_id,
-                            "isProxy": scan["isProxy"],
-                            "distance": scan["distance"],
-                        }
-
-                        op_subjects = UpdateOne(
-                            {
-                                "_id": ObjectId(subject_id),
-                                "students.student_id": student_oid,
-                            },
-                            {
-                                "$push": {
-                                    "students.$.attendanceRecords": attendance_record
-                                },
-                                "$inc": {
-                                    "students.$.attendance.present": 1,
-                                    "students.$.attendance.total": 1,
-                                },
-                                "$set": {
-                                    "students.$.attendance.lastMarkedAt": today_str
-                                },
-                            },
-                        )
-                        operations.append(op_subjects)
-
-                        log_students_data.append(
-                            {
-                                "studentId": ObjectId(scan["studentId"]),
-                                "scanTime": scan["timestamp"],
-                                "method": "qr",
-                                "sessionId": session_id,
-                                "latitude": scan["location"]["lat"],
-                                "longitude": scan["location"]["lon"],
-                                "distance": scan["distance"],
-                                "isProxy": scan["isProxy"],
-                            }
-                        )
-
-                    updated_logs = None
-                    if log_students_data:
-                        updated_logs = await log_grouped_attendance(
-                            subject_id=subject_id,
-                            date_str=today_str,
-                            students=log_students_data,
-                            teacher_id=teacher_id,
-                        )
-
-                    if updated_logs and "students" in updated_logs:
-                        present_count = len(updated_logs["students"])
-                        total_enrolled = (
-                            len(subject_doc.get("students", [])) if subject_doc else 0
-                        )
-                        absent_count = max(0, total_enrolled - present_count)
-
-                        await save_daily_summary(
-                            subject_id=ObjectId(subject_id),
-                            teacher_id=teacher_id,
-                            record_date=today_str,
-                            present=present_count,
-                            absent=absent_count,
-                        )
-
-                    if operations:
-                        await db.subjects.bulk_write(operations)
-                        result_msg = f"Saved {len(operations)} records."
-                except Exception as e:
-                    logger.error(f"Error saving session {session_id}: {e}")
-                    result_msg = f"Error: {str(e)}"
-
-        del active_sessions[session_id]
-        if session_id in session_locations:
-            del session_locations[session_id]
-
-    return {"message": "Session closed", "details": result_msg}
+    try:
+        await session_state.mark_ended(session_id)
+        # Joins a flush already running here; it closes the session if that
+        # saves everything
+        saved = await _schedule_flush(session_id)
+        if saved:
+            result_msg = f"Saved {saved} records."
+        pending, _since = await session_state.pending_stats(session_id)
+    except Exception as e:
+        logger.error(f"Error saving session {session_id}: {e}")
+        result_msg = f"Error: {str(e)}"
+
+    # The teacher sees the last scans before the session closes
+    await scan_broadcaster.flush(session_id)
+    if pending == 0:
+        await _close_session(session_id)
+        return {"message": "Session closed", "details": result_msg}
+
+    logger.warning(f"Session {session_id} ended with unsaved scans, kept for retry")
+    return {"message": "Session closing", "details": result_msg}
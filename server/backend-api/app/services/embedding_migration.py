@@ -0,0 +1,219 @@
+"""
+Background re-embedding of stored face photos with a new encoder.
+
+Switching the ML service's encoder makes every stored embedding
+incomparable with new ones. This job streams students with an ``_id``
+cursor, downloads each ``image_url`` with bounded concurrency, re-encodes
+the photos in batches on the ML service with the target encoder and stores
+the result under ``face_embeddings_by_model.<model_version>`` next to the
+existing embeddings. Progress is checkpointed in ``embedding_migrations``
+after every batch, so an interrupted run resumes where it stopped.
+
+The model version to store under is the one the ML service reports for the
+encoder, and every batch is checked against it.
+
+Once a run completes, switch ``ML_ENCODER`` on the ML service and
+``ML_EMBEDDING_MODEL`` on the backend together; matching then reads the
+re-encoded copies without re-enrolling anyone.
+"""
+
+import asyncio
+import base64
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.core.config import EMBEDDING_STORAGE_FORMAT, ML_MAX_BATCH_IMAGES
+from app.core.metrics import EMBEDDING_MIGRATION_PROGRESS, EMBEDDING_MIGRATION_STUDENTS
+from app.db.mongo import db
+from app.services.ml_client import ml_client
+from app.utils.embedding_storage import pack_embedding
+
+logger = logging.getLogger(__name__)
+
+
+async def _fetch_image(
+    http: httpx.AsyncClient, semaphore: asyncio.Semaphore, url: str
+) -> Optional[str]:
+    """Download a stored photo as base64, or None if it cannot be fetched."""
+    async with semaphore:
+        try:
+            response = await http.get(url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"Could not fetch face image {url}: {e}")
+            return None
+    return base64.b64encode(response.content).decode("utf-8")
+
+
+async def _migrate_batch(
+    http: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    students: List[Dict[str, Any]],
+    encoder: str,
+    model_version: str,
+) -> Tuple[int, int]:
+    """Re-encode one batch of students. Returns (migrated, failed)."""
+    images = await asyncio.gather(
+        *(_fetch_image(http, semaphore, s["image_url"]) for s in students)
+    )
+    fetched = [(s, image) for s, image in zip(students, images) if image is not None]
+    failed = len(students) - len(fetched)
+    if not fetched:
+        return 0, failed
+
+    response = await ml_client.encode_faces_batch(
+        [image for _, image in fetched], encoder=encoder
+    )
+    if not response.get("success"):
+        raise RuntimeError(f"ML service error: {response.get('error')}")
+    if response.get("model_version") != model_version:
+        raise RuntimeError(
+            f"ML service encoded with {response.get('model_version')}, "
+            f"expected {model_version}"
+        )
+
+    migrated = 0
+    for (student, _), result in zip(fetched, response.get("results", [])):
+        if not result.get("success"):
+            logger.warning(
+                f"Re-encoding failed for student {student['_id']}: "
+                f"{result.get('error_code') or result.get('error')}"
+            )
+            failed += 1
+            continue
+
+        # Skip the write if the student uploaded a new photo meanwhile
+        await db.students.update_one(
+            {"_id": student["_id"], "image_url": student["image_url"]},
+            {
+                "$set": {
+                    f"face_embeddings_by_model.{model_version}": [
+                        pack_embedding(result["embedding"], EMBEDDING_STORAGE_FORMAT)
+                    ]
+                }
+            },
+        )
+        migrated += 1
+
+    return migrated, failed
+
+
+async def migrate_embeddings(
+    encoder: str,
+    batch_size: int = ML_MAX_BATCH_IMAGES,
+    concurrency: int = 8,
+    restart: bool = False,
+) -> Dict[str, Any]:
+    """
+    Re-encode every student's stored photo with ``encoder``.
+
+    Resumes from the last checkpoint unless ``restart`` is set; a restart
+    also retries students that failed before, since only students still
+    missing embeddings for the encoder's model version are selected. Fails
+    before the first batch if the ML service cannot run ``encoder``.
+    """
+    info = await ml_client.encoder_info(encoder)
+    if not info.get("success"):
+        raise RuntimeError(
+            f"Encoder {encoder!r} is not available on the ML service: "
+            f"{info.get('error_code') or info.get('error')}"
+        )
+    model_version = info["model_version"]
+    batch_size = max(1, min(batch_size, ML_MAX_BATCH_IMAGES))
+    checkpoint_id = f"embeddings:{model_version}"
+
+    if restart:
+        await db.embedding_migrations.delete_one({"_id": checkpoint_id})
+    state = await db.embedding_migrations.find_one({"_id": checkpoint_id}) or {}
+    migrated = state.get("migrated", 0)
+    failed = state.get("failed", 0)
+
+    with_photo = {"image_url": {"$nin": [None, ""]}}
+    pending = {
+        **with_photo,
+        "face_embedding_model": {"$ne": model_version},
+        f"face_embeddings_by_model.{model_version}": {"$exists": False},
+    }
+    total = await db.students.count_documents(with_photo)
+    remaining = await db.students.count_documents(pending)
+
+    def report_progress() -> None:
+        EMBEDDING_MIGRATION_PROGRESS.labels(model=model_version).set(
+            1 - remaining / total if total else 1.0
+        )
+
+    report_progress()
+    logger.info(
+        f"Embedding migration to {model_version}: {remaining} of {total} "
+        f"students pending, resuming after {state.get('last_id')}"
+    )
+
+    query = dict(pending)
+    if state.get("last_id") is not None:
+        query["_id"] = {"$gt": state["last_id"]}
+    cursor = (
+        db.students.find(query, {"_id": 1, "image_url": 1})
+        .sort("_id", 1)
+        .batch_size(batch_size * 10)
+    )
+
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as http:
+
+        async def run_batch(batch: List[Dict[str, Any]]) -> None:
+            nonlocal migrated, failed, remaining
+            ok, bad = await _migrate_batch(
+                http, semaphore, batch, encoder, model_version
+            )
+            migrated += ok
+            failed += bad
+            remaining -= ok
+            EMBEDDING_MIGRATION_STUDENTS.labels(
+                model=model_version, outcome="migrated"
+            ).inc(ok)
+            EMBEDDING_MIGRATION_STUDENTS.labels(
+                model=model_version, outcome="failed"
+            ).inc(bad)
+            report_progress()
+
+            await db.embedding_migrations.update_one(
+                {"_id": checkpoint_id},
+                {
+                    "$set": {
+                        "encoder": encoder,
+                        "last_id": batch[-1]["_id"],
+                        "migrated": migrated,
+                        "failed": failed,
+                        "updated_at": datetime.now(timezone.utc),
+                    }
+                },
+                upsert=True,
+            )
+
+        batch: List[Dict[str, Any]] = []
+        async for student in cursor:
+            batch.append(student)
+            if len(batch) >= batch_size:
+                await run_batch(batch)
+                batch = []
+        if batch:
+            await run_batch(batch)
+
+    await db.embedding_migrations.update_one(
+        {"_id": checkpoint_id},
+        {"$set": {"completed_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    logger.info(
+        f"Embedding migration to {model_version} finished: "
+        f"{migrated} migrated, {failed} failed"
+    )
+    return {
+        "model_version": model_version,
+        "migrated": migrated,
+        "failed": failed,
+        "remaining": remaining,
+    }
@@ -0,0 +1,77 @@
+"""
+Candidate galleries sent to the ML service for face matching.
+
+A subject's gallery is registered once on the ML service under
+``subject:<subject_id>`` and then referenced by ID and version on every
+match call, instead of re-uploading every embedding with each frame.
+"""
+
+import hashlib
+from typing import Any, Dict, List
+
+from app.core.config import ML_EMBEDDING_MODEL
+from app.utils.embedding_storage import unpack_embeddings
+
+# Encoder of embeddings stored before documents were tagged with one
+LEGACY_EMBEDDING_MODEL = "patch-96-v1"
+
+
+def subject_gallery_id(subject_id) -> str:
+    return f"subject:{subject_id}"
+
+
+def embedding_model(student: Dict[str, Any]) -> str:
+    """Encoder version that produced a student's stored embeddings."""
+    return student.get("face_embedding_model") or LEGACY_EMBEDDING_MODEL
+
+
+def stored_embeddings(student: Dict[str, Any], model: str) -> List[Any]:
+    """
+    A student's embeddings from the given encoder.
+
+    ``face_embeddings`` holds the embeddings of the encoder the student
+    enrolled with; re-encoded copies for other encoders are kept under
+    ``face_embeddings_by_model.<model_version>`` by the migration job.
+    """
+    if embedding_model(student) == model:
+        return student.get("face_embeddings") or []
+    return (student.get("face_embeddings_by_model") or {}).get(model) or []
+
+
+def gallery_version(students: List[Dict[str, Any]]) -> str:
+    """
+    Cheap version tag for a set of student documents.
+
+    Derived from each student's ID, embedding count and last face update,
+    which change whenever a student's embeddings change, so the full
+    embedding payload never has to be hashed per frame.
+    """
+    digest = hashlib.sha1(ML_EMBEDDING_MODEL.encode("utf-8"))
+    for student in sorted(students, key=lambda s: str(s["userId"])):
+        digest.update(
+            f"{student['userId']}:"
+            f"{len(stored_embeddings(student, ML_EMBEDDING_MODEL))}:"
+            f"{student.get('last_face_update') or ''};".encode("utf-8")
+        )
+    return digest.hexdigest()
+
+
+def build_candidate_embeddings(
+    students: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Candidates for matching, using each student's embeddings from the
+    encoder the ML service is running and skipping students without any.
+    Embeddings are returned as (n, dim) float32 matrices.
+    """
+    candidates = []
+    for student in students:
+        embeddings = stored_embeddings(student, ML_EMBEDDING_MODEL)
+        if len(embeddings):
+            candidates.append(
+                {
+                    "student_id": str(student["userId"]),
+                    "embeddings": unpack_embeddings(embeddings),
+                }
+            )
+    return candidates
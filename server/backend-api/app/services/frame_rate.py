@@ -0,0 +1,85 @@
+"""
+Adaptive frame rate for live recognition streams.
+
+The server recommends a per-client frame rate from the ML service's queue
+load (reported on every ML response) and the recent latency of the
+recognize stage, pushes it to clients in a ``frame_rate`` message and
+enforces it with a token bucket per connection. Below ``FRAME_LOAD_LOW``
+queue load clients get ``FRAME_MAX_FPS``; above it the rate falls linearly
+to ``FRAME_MIN_FPS`` at a full queue. It is also capped at the rate the ML
+service actually sustains for one connection, ``FRAME_MAX_IN_FLIGHT``
+frames per recognize latency.
+"""
+
+import time
+
+from app.core.config import (
+    FRAME_BURST,
+    FRAME_LOAD_LOW,
+    FRAME_MAX_FPS,
+    FRAME_MAX_IN_FLIGHT,
+    FRAME_MIN_FPS,
+)
+from app.core.metrics import RECOMMENDED_FRAME_RATE
+from app.services.ml_client import ml_client
+
+# Weight of the newest sample in the latency average
+_LATENCY_ALPHA = 0.2
+
+
+class TokenBucket:
+    """Tokens refill at ``rate`` per second, holding at most ``burst``."""
+
+    def __init__(self, rate: float, burst: float = FRAME_BURST):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float) -> None:
+        self._refill()
+        self.rate = rate
+
+    def delay(self) -> float:
+        """Seconds until a token is available."""
+        self._refill()
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self._tokens -= 1
+
+
+class FrameRateAdvisor:
+    """Recommended frame rate shared by every stream of this worker."""
+
+    def __init__(self):
+        self.latency = 0.0
+
+    def record_latency(self, seconds: float) -> None:
+        if self.latency == 0.0:
+            self.latency = seconds
+        else:
+            self.latency += _LATENCY_ALPHA * (seconds - self.latency)
+
+    def recommended_fps(self) -> float:
+        fps = FRAME_MAX_FPS
+        load = ml_client.queue_load
+        if load > FRAME_LOAD_LOW:
+            headroom = (1.0 - load) / (1.0 - FRAME_LOAD_LOW)
+            fps = FRAME_MIN_FPS + (FRAME_MAX_FPS - FRAME_MIN_FPS) * headroom
+        if self.latency > 0:
+            fps = min(fps, FRAME_MAX_IN_FLIGHT / self.latency)
+        fps = max(FRAME_MIN_FPS, min(FRAME_MAX_FPS, fps))
+        RECOMMENDED_FRAME_RATE.set(fps)
+        return fps
+
+
+frame_rate_advisor = FrameRateAdvisor()
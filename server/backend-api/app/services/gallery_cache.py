@@ -0,0 +1,260 @@
+"""
+In-process cache of everything live recognition needs for a subject.
+
+Live attendance streams send about two frames per second per teacher, and
+each frame used to re-read the subject roster and every enrolled student's
+embeddings from Mongo. That data only changes when a face is uploaded, a
+student is verified or removed, or enrollment changes, so it is loaded once
+per subject and kept until one of those writes calls ``invalidate``.
+
+With ``REDIS_URL`` set, invalidations are also published on a Redis channel
+so that every worker drops its copy. ``GALLERY_CACHE_TTL_SECONDS`` bounds
+how long a copy can outlive writes made outside the API.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson import errors as bson_errors
+
+from app.core.config import GALLERY_CACHE_TTL_SECONDS, ML_EMBEDDING_MODEL, REDIS_URL
+from app.db.mongo import db
+from app.db.nonce_store import get_redis
+from app.services.face_gallery import (
+    build_candidate_embeddings,
+    gallery_version,
+    subject_gallery_id,
+)
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "gallery:invalidate"
+
+
+@dataclass
+class SubjectGallery:
+    """Roster, match candidates and display data of one subject."""
+
+    subject_id: str
+    professor_ids: List[ObjectId]
+    # Candidates in the form sent to the ML service, with (n, dim) matrices
+    candidates: List[Dict[str, Any]]
+    version: str
+    # str(student userId) -> {"id", "name", "roll"}
+    roster: Dict[str, Dict[str, Any]]
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def gallery_id(self) -> str:
+        return subject_gallery_id(self.subject_id)
+
+
+_galleries: Dict[str, SubjectGallery] = {}
+# Bumped on every invalidation so a load that raced with a write is neither
+# stored nor joined by later misses
+_generations: Dict[str, int] = {}
+# Load in flight per subject, with the generation it started at
+_loading: Dict[str, Tuple[int, "asyncio.Future[Optional[SubjectGallery]]"]] = {}
+
+_listener_task: Optional[asyncio.Task] = None
+
+
+async def _load(subject_id: str, subject_oid: ObjectId) -> Optional[SubjectGallery]:
+    subject = await db.subjects.find_one(
+        {"_id": subject_oid}, {"students": 1, "professor_ids": 1}
+    )
+    if not subject:
+        return None
+
+    student_user_ids = [
+        s["student_id"] for s in subject.get("students", []) if s.get("verified", False)
+    ]
+    students = await db.students.find(
+        {
+            "userId": {"$in": student_user_ids},
+            "verified": True,
+            "face_embeddings": {"$exists": True, "$ne": []},
+        },
+        {
+            "userId": 1,
+            "name": 1,
+            "face_embeddings": 1,
+            "face_embedding_model": 1,
+            f"face_embeddings_by_model.{ML_EMBEDDING_MODEL}": 1,
+            "last_face_update": 1,
+        },
+    ).to_list(length=500)
+
+    users = await db.users.find(
+        {"_id": {"$in": [s["userId"] for s in students]}}, {"name": 1, "roll": 1}
+    ).to_list(length=None)
+    users_by_id = {u["_id"]: u for u in users}
+
+    roster = {}
+    for student in students:
+        user_info = users_by_id.get(student["userId"])
+        roster[str(student["userId"])] = {
+            "id": str(student["userId"]),
+            "name": student.get("name")
+            or (user_info.get("name") if user_info else "Unknown"),
+            "roll": user_info.get("roll") if user_info else "",
+        }
+
+    return SubjectGallery(
+        subject_id=subject_id,
+        professor_ids=subject.get("professor_ids", []),
+        candidates=build_candidate_embeddings(students),
+        version=gallery_version(students),
+        roster=roster,
+    )
+
+
+async def _load_and_store(
+    subject_id: str, subject_oid: ObjectId, generation: int
+) -> Optional[SubjectGallery]:
+    gallery = await _load(subject_id, subject_oid)
+    if gallery is not None and _generations.get(subject_id, 0) == generation:
+        _galleries[subject_id] = gallery
+    return gallery
+
+
+def _cached(subject_id: str) -> Optional[SubjectGallery]:
+    gallery = _galleries.get(subject_id)
+    if gallery is not None:
+        if time.monotonic() - gallery.loaded_at < GALLERY_CACHE_TTL_SECONDS:
+            return gallery
+        _galleries.pop(subject_id, None)
+    return None
+
+
+async def get_gallery(subject_id: str) -> Optional[SubjectGallery]:
+    """
+    The subject's gallery, loaded from Mongo on a miss. Concurrent misses for
+    one subject share a single load, unless the subject was invalidated
+    since that load started; a caller whose load is invalidated while it
+    waits loads once more. Returns None if the subject does not exist.
+    """
+    subject_id = str(subject_id)
+    gallery = _cached(subject_id)
+    if gallery is not None:
+        return gallery
+
+    try:
+        subject_oid = ObjectId(subject_id)
+    except bson_errors.InvalidId:
+        return None
+
+    for attempt in range(2):
+        if attempt:
+            # Another caller may already have reloaded it
+            cached = _cached(subject_id)
+            if cached is not None:
+                return cached
+        generation = _generations.get(subject_id, 0)
+        entry = _loading.get(subject_id)
+        if entry is None or entry[0] != generation:
+            entry = _start_load(subject_id, subject_oid, generation)
+        # A cancelled caller must not cancel the load other frames are awaiting
+        gallery = await asyncio.shield(entry[1])
+        if _generations.get(subject_id, 0) == generation:
+            break
+    return gallery
+
+
+def _start_load(
+    subject_id: str, subject_oid: ObjectId, generation: int
+) -> Tuple[int, "asyncio.Future[Optional[SubjectGallery]]"]:
+    loading = asyncio.ensure_future(
+        _load_and_store(subject_id, subject_oid, generation)
+    )
+    entry = _loading[subject_id] = (generation, loading)
+
+    def done(_) -> None:
+        # A newer load may have replaced this one
+        if _loading.get(subject_id) is entry:
+            del _loading[subject_id]
+
+    loading.add_done_callback(done)
+    return entry
+
+
+def _drop(subject_id: str) -> None:
+    _generations[subject_id] = _generations.get(subject_id, 0) + 1
+    _galleries.pop(subject_id, None)
+
+
+async def invalidate(*subject_ids: Any) -> None:
+    """
+    Drop the cached galleries of the given subjects here and, through Redis,
+    on every other worker. Never raises: a failed publish only delays other
+    workers until their TTL runs out.
+    """
+    subject_ids = [str(s) for s in subject_ids if s]
+    for subject_id in subject_ids:
+        _drop(subject_id)
+
+    client = await get_redis()
+    if client is None:
+        return
+    try:
+        for subject_id in subject_ids:
+            await client.publish(INVALIDATION_CHANNEL, subject_id)
+    except Exception as exc:
+        logger.warning(f"Could not publish gallery invalidation: {exc}")
+
+
+def clear() -> None:
+    """Drop every cached gallery in this worker."""
+    for subject_id in list(_galleries):
+        _drop(subject_id)
+
+
+# ── Cross-worker invalidation ─────────────────────────────────
+
+
+async def _listen() -> None:
+    while True:
+        try:
+            # Shares the nonce store's client; the subscription takes its own
+            # connection from the pool
+            client = await get_redis()
+            if client is None:
+                raise ConnectionError("Redis unavailable")
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Anything written while unsubscribed may have been missed
+                clear()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        _drop(message["data"])
+            finally:
+                await pubsub.aclose()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning(f"Gallery invalidation listener failed, retrying: {exc}")
+            await asyncio.sleep(5)
+
+
+def start_invalidation_listener() -> None:
+    """Subscribe to invalidations from other workers, if Redis is configured."""
+    global _listener_task
+    if REDIS_URL and _listener_task is None:
+        _listener_task = asyncio.create_task(_listen())
+
+
+async def stop_invalidation_listener() -> None:
+    """Stop listening; the shared Redis client is closed by ``close_redis``."""
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
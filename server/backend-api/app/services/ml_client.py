@@ -1,12 +1,28 @@
 import httpx
+import numpy as np
 from typing import Optional, List, Dict, Any
 
 from app.core.config import (
     ML_API_KEY,
+    ML_EMBEDDING_FORMAT,
+    ML_EMBEDDING_MODEL,
     ML_SERVICE_MAX_RETRIES,
     ML_SERVICE_TIMEOUT,
     ML_SERVICE_URL,
 )
+from app.utils.embedding_codec import (
+    EMBEDDING_FORMAT_HEADER,
+    FORMAT_JSON,
+    decode_embedding,
+    encode_embedding,
+)
+
+# Returned by the ML service when a referenced gallery is unknown or stale
+ML_GALLERY_NOT_FOUND = "GALLERY_NOT_FOUND"
+
+# ML service executor load reported on every response
+QUEUE_DEPTH_HEADER = "X-Queue-Depth"
+QUEUE_CAPACITY_HEADER = "X-Queue-Capacity"
 
 
 class MLClient:
@@ -17,6 +33,13 @@ class MLClient:
         self.api_key = ML_API_KEY
         self.timeout = ML_SERVICE_TIMEOUT
         self.max_retries = ML_SERVICE_MAX_RETRIES
+        self.embedding_format = ML_EMBEDDING_FORMAT
+        # Set once the ML service echoes the requested embedding format;
+        # until then embeddings are sent as JSON lists.
+        self.binary_embeddings = False
+        # Fraction of the ML service's stage queue in use, as of its last
+        # response (1.0 once it rejects requests as overloaded)
+        self.queue_load = 0.0
 
         # Create httpx client with connection pooling.
         # Only attach API key header when configured.
@@ -25,9 +48,10 @@ class MLClient:
             "base_url": self.base_url,
             "timeout": self.timeout,
             "limits": httpx.Limits(max_keepalive_connections=5, max_connections=10),
+            "headers": {EMBEDDING_FORMAT_HEADER: self.embedding_format},
         }
         if self.api_key:
-            client_kwargs["headers"] = {"X-API-Key": self.api_key}
+            client_kwargs["headers"]["X-API-Key"] = self.api_key
 
         self.client = httpx.AsyncClient(**client_kwargs)
 
@@ -43,29 +67,61 @@ class MLClient:
         """Close the HTTP client"""
         await self.client.aclose()
 
+    def _observe_load(self, response: httpx.Response) -> None:
+        if response.status_code == 503:
+            self.queue_load = 1.0
+            return
+        try:
+            depth = int(response.headers[QUEUE_DEPTH_HEADER])
+            capacity = int(response.headers[QUEUE_CAPACITY_HEADER])
+        except (KeyError, ValueError):
+            return
+        if capacity > 0:
+            self.queue_load = min(1.0, depth / capacity)
+
     async def _make_request(
         self,
         method: str,
         endpoint: str,
         json_data: Optional[Dict] = None,
         retries: int = 0,
+        content: Optional[bytes] = None,
+        params: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
         """
         Make HTTP request to ML service with retry logic
+
+        ``content`` is sent as-is as a JPEG body instead of ``json_data``.
         """
         self._ensure_ml_api_key_configured()
 
         try:
-            response = await self.client.request(
-                method=method, url=endpoint, json=json_data
-            )
+            if content is not None:
+                response = await self.client.request(
+                    method=method,
+                    url=endpoint,
+                    content=content,
+                    params=params,
+                    headers={"Content-Type": "image/jpeg"},
+                )
+            else:
+                response = await self.client.request(
+                    method=method, url=endpoint, json=json_data, params=params
+                )
+            self._observe_load(response)
             response.raise_for_status()
+            echoed_format = response.headers.get(EMBEDDING_FORMAT_HEADER)
+            if echoed_format is not None:
+                self.binary_embeddings = (
+                    echoed_format == self.embedding_format
+                    and echoed_format != FORMAT_JSON
+                )
             return response.json()
 
         except httpx.TimeoutException:
             if retries < self.max_retries:
                 return await self._make_request(
-                    method, endpoint, json_data, retries + 1
+                    method, endpoint, json_data, retries + 1, content, params
                 )
             raise Exception(f"ML Service timeout after {self.max_retries} retries")
 
@@ -77,7 +133,7 @@ class MLClient:
         except Exception as e:
             if retries < self.max_retries:
                 return await self._make_request(
-                    method, endpoint, json_data, retries + 1
+                    method, endpoint, json_data, retries + 1, content, params
                 )
             raise Exception(f"ML Service communication error: {str(e)}")
 
@@ -94,7 +150,7 @@ class MLClient:
         Returns:
             {
                 "success": bool,
-                "embedding": List[float],
+                "embedding": np.ndarray,
                 "face_location": {...},
                 "metadata": {...},
                 "error": str (optional)
@@ -107,7 +163,57 @@ class MLClient:
             "num_jitters": num_jitters,
         }
 
-        return await self._make_request("POST", "/api/ml/encode-face", request_data)
+        response = await self._make_request("POST", "/api/ml/encode-face", request_data)
+        # Decoded to a NumPy vector, which pack_embedding stores as is
+        if response.get("embedding") is not None:
+            response["embedding"] = decode_embedding(response["embedding"])
+        return response
+
+    async def encode_faces_batch(
+        self,
+        images_base64: List[str],
+        num_jitters: int = 5,
+        encoder: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Encode the single face of each image, optionally with a non-active encoder
+
+        Returns:
+            {
+                "success": bool,
+                "model_version": str,
+                "results": [{"success": bool, "embedding": np.ndarray, ...}]
+            }
+        """
+        request_data = {
+            "images": images_base64,
+            "num_jitters": num_jitters,
+            "encoder": encoder,
+        }
+
+        response = await self._make_request(
+            "POST", "/api/ml/encode-faces-batch", request_data
+        )
+        for result in response.get("results") or []:
+            if result.get("embedding") is not None:
+                result["embedding"] = decode_embedding(result["embedding"])
+        return response
+
+    async def encoder_info(self, encoder: str) -> Dict[str, Any]:
+        """
+        Model version and dimension of an ML service encoder
+
+        Returns:
+            {
+                "success": bool,
+                "encoder": str,
+                "model_version": str,
+                "dimension": int,
+                "error_code": str (optional, MODEL_UNAVAILABLE if its model
+                                   file is missing)
+            }
+        """
+        return await self._make_request("GET", f"/api/ml/encoders/{encoder}")
 
     async def detect_faces(
         self,
@@ -123,7 +229,7 @@ class MLClient:
             {
                 "success": bool,
                 "faces": [{
-                    "embedding": List[float],
+                    "embedding": List[float] or encoded str,
                     "location": {...},
                     "face_area_ratio": float
                 }],
@@ -140,12 +246,113 @@ class MLClient:
 
         return await self._make_request("POST", "/api/ml/detect-faces", request_data)
 
+    def _encode_candidates(
+        self, candidate_embeddings: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Pack candidate embeddings in the negotiated binary format."""
+        if not self.binary_embeddings:
+            # Stored embeddings arrive as NumPy matrices; JSON needs lists
+            return [
+                {**candidate, "embeddings": candidate["embeddings"].tolist()}
+                if isinstance(candidate["embeddings"], np.ndarray)
+                else candidate
+                for candidate in candidate_embeddings
+            ]
+        return [
+            {
+                **candidate,
+                "embeddings": [
+                    encode_embedding(emb, self.embedding_format)
+                    for emb in candidate["embeddings"]
+                ],
+            }
+            for candidate in candidate_embeddings
+        ]
+
+    async def register_gallery(
+        self,
+        gallery_id: str,
+        candidate_embeddings: List[Dict[str, Any]],
+        version: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Register a candidate gallery so later match calls can reference it
+
+        Returns:
+            {
+                "success": bool,
+                "gallery_id": str,
+                "version": str,
+                "student_count": int,
+                "embedding_count": int
+            }
+        """
+        request_data = {
+            "gallery_id": gallery_id,
+            "version": version,
+            "candidate_embeddings": self._encode_candidates(candidate_embeddings),
+            "model_version": ML_EMBEDDING_MODEL,
+        }
+
+        return await self._make_request("POST", "/api/ml/galleries", request_data)
+
+    async def invalidate_gallery(self, gallery_id: str) -> Dict[str, Any]:
+        """Drop a registered gallery from the ML service"""
+        return await self._make_request("DELETE", f"/api/ml/galleries/{gallery_id}")
+
+    async def _request_with_gallery(
+        self,
+        endpoint: str,
+        request_data: Dict[str, Any],
+        candidate_embeddings: List[Dict[str, Any]],
+        gallery_id: Optional[str],
+        gallery_version: Optional[str],
+    ) -> Dict[str, Any]:
+        """
+        Send a match request, referencing a registered gallery when possible.
+
+        Without a gallery_id the candidates are sent inline. With one, only the
+        reference is sent; on a cache miss the gallery is registered and the
+        request is retried once.
+        """
+        if not gallery_id:
+            return await self._make_request(
+                "POST",
+                endpoint,
+                {
+                    **request_data,
+                    "candidate_embeddings": self._encode_candidates(
+                        candidate_embeddings
+                    ),
+                    "model_version": ML_EMBEDDING_MODEL,
+                },
+            )
+
+        request_data = {
+            **request_data,
+            "gallery_id": gallery_id,
+            "gallery_version": gallery_version,
+        }
+        response = await self._make_request("POST", endpoint, request_data)
+        if response.get("error_code") != ML_GALLERY_NOT_FOUND:
+            return response
+
+        registered = await self.register_gallery(
+            gallery_id, candidate_embeddings, gallery_version
+        )
+        if not registered.get("success"):
+            return registered
+
+        return await self._make_request("POST", endpoint, request_data)
+
     async def match_faces(
         self,
         query_embedding: List[float],
         candidate_embeddings: List[Dict[str, Any]],
         threshold: float = 0.6,
         return_all_distances: bool = False,
+        gallery_id: Optional[str] = None,
+        gallery_version: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         Match a face embedding against candidate embeddings
@@ -158,6 +365,9 @@ class MLClient:
             ...
         ]
 
+        When gallery_id is given the candidates are only uploaded if the ML
+        service does not already hold that gallery at gallery_version.
+
         Returns:
             {
                 "success": bool,
@@ -172,12 +382,17 @@ class MLClient:
         """
         request_data = {
             "query_embedding": query_embedding,
-            "candidate_embeddings": candidate_embeddings,
             "threshold": threshold,
             "return_all_distances": return_all_distances,
         }
 
-        return await self._make_request("POST", "/api/ml/match-faces", request_data)
+        return await self._request_with_gallery(
+            "/api/ml/match-faces",
+            request_data,
+            candidate_embeddings,
+            gallery_id,
+            gallery_version,
+        )
 
     async def batch_match(
         self,
@@ -185,6 +400,8 @@ class MLClient:
         candidate_embeddings: List[Dict[str, Any]],
         confident_threshold: float = 0.50,
         uncertain_threshold: float = 0.60,
+        gallery_id: Optional[str] = None,
+        gallery_version: Optional[str] = None,
     ) -> Dict[str, Any]:
         """
         Match multiple detected faces against candidate embeddings
@@ -215,12 +432,183 @@ class MLClient:
         """
         request_data = {
             "detected_faces": detected_faces,
-            "candidate_embeddings": candidate_embeddings,
             "confident_threshold": confident_threshold,
             "uncertain_threshold": uncertain_threshold,
         }
 
-        return await self._make_request("POST", "/api/ml/batch-match", request_data)
+        return await self._request_with_gallery(
+            "/api/ml/batch-match",
+            request_data,
+            candidate_embeddings,
+            gallery_id,
+            gallery_version,
+        )
+
+    async def recognize_frame(
+        self,
+        image_base64: str,
+        candidate_embeddings: List[Dict[str, Any]],
+        threshold: float = 0.6,
+        min_face_area_ratio: float = 0.01,
+        gallery_id: Optional[str] = None,
+        gallery_version: Optional[str] = None,
+        session_id: Optional[str] = None,
+        confirm_threshold: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Detect, liveness-check and match every face of a frame in one call
+
+        With a session_id the ML service tracks faces across the session's
+        frames and reuses the result of faces it has recognized recently.
+        Students matched with at least confirm_threshold similarity are
+        confirmed for the session and left out of later matching unless a
+        face has no confident match among the others.
+
+        Returns:
+            {
+                "success": bool,
+                "faces": [{
+                    "location": {...},
+                    "face_area_ratio": float,
+                    "is_live": bool,
+                    "match": {
+                        "student_id": str,
+                        "distance": float,
+                        "confidence": float,
+                        "status": str
+                    } or None,
+                    "track_id": int or None,
+                    "tracked": bool
+                }],
+                "count": int,
+                "metadata": {...}
+            }
+        """
+        request_data = {
+            "image_base64": image_base64,
+            "threshold": threshold,
+            "min_face_area_ratio": min_face_area_ratio,
+        }
+        if session_id:
+            request_data["session_id"] = session_id
+            request_data["confirm_threshold"] = confirm_threshold
+
+        return await self._request_with_gallery(
+            "/api/ml/recognize-frame",
+            request_data,
+            candidate_embeddings,
+            gallery_id,
+            gallery_version,
+        )
+
+    async def recognize_frame_bytes(
+        self,
+        image_bytes: bytes,
+        candidate_embeddings: List[Dict[str, Any]],
+        gallery_id: str,
+        gallery_version: Optional[str] = None,
+        threshold: float = 0.6,
+        min_face_area_ratio: float = 0.01,
+        session_id: Optional[str] = None,
+        confirm_threshold: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        ``recognize_frame`` for an encoded JPEG frame, sent as the raw request
+        body without base64. Needs a gallery_id; the gallery is registered
+        and the request retried once when the ML service does not have it.
+        """
+        params = {
+            "gallery_id": gallery_id,
+            "threshold": threshold,
+            "min_face_area_ratio": min_face_area_ratio,
+        }
+        if gallery_version:
+            params["gallery_version"] = gallery_version
+        if session_id:
+            params["session_id"] = session_id
+        if confirm_threshold is not None:
+            params["confirm_threshold"] = confirm_threshold
+
+        endpoint = "/api/ml/recognize-frame/raw"
+        response = await self._make_request(
+            "POST", endpoint, content=image_bytes, params=params
+        )
+        if response.get("error_code") != ML_GALLERY_NOT_FOUND:
+            return response
+
+        registered = await self.register_gallery(
+            gallery_id, candidate_embeddings, gallery_version
+        )
+        if not registered.get("success"):
+            return registered
+
+        return await self._make_request(
+            "POST", endpoint, content=image_bytes, params=params
+        )
+
+    async def detect_faces_batch(
+        self,
+        images_base64: List[str],
+        candidate_embeddings: Optional[List[Dict[str, Any]]] = None,
+        threshold: float = 0.6,
+        min_face_area_ratio: float = 0.01,
+        return_embeddings: bool = False,
+        model: str = "hog",
+        gallery_id: Optional[str] = None,
+        gallery_version: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Detect faces in several photos of one room, processed in parallel
+
+        Faces are matched when candidates or a gallery_id are given; a student
+        seen in several images is listed once under "students" and their
+        other faces are flagged as duplicates.
+
+        Returns:
+            {
+                "success": bool,
+                "images": [{
+                    "image_index": int,
+                    "success": bool,
+                    "faces": [{
+                        "location": {...},
+                        "is_live": bool,
+                        "match": {...} or None,
+                        "duplicate": bool
+                    }],
+                    "error": str (optional)
+                }],
+                "students": [{
+                    "student_id": str,
+                    "image_index": int,
+                    "face_index": int,
+                    "distance": float,
+                    "confidence": float,
+                    "sightings": int
+                }],
+                "count": int
+            }
+        """
+        request_data = {
+            "images": images_base64,
+            "threshold": threshold,
+            "min_face_area_ratio": min_face_area_ratio,
+            "return_embeddings": return_embeddings,
+            "model": model,
+        }
+
+        if candidate_embeddings is None and not gallery_id:
+            return await self._make_request(
+                "POST", "/api/ml/detect-faces-batch", request_data
+            )
+
+        return await self._request_with_gallery(
+            "/api/ml/detect-faces-batch",
+            request_data,
+            candidate_embeddings or [],
+            gallery_id,
+            gallery_version,
+        )
 
     async def health_check(self) -> Dict[str, Any]:
         """
@@ -0,0 +1,372 @@
+"""
+Live face recognition shared by the Socket.IO and WebSocket transports.
+
+Each connection gets a ``RecognitionStream``. A frame goes through explicit
+stages (decode, gallery, recognize, resolve, emit) whose durations are
+exported as ``recognition_stage_seconds`` and returned with every result.
+Each stream is its own face-tracking session at the ML service, so faces
+that stay in view are recognized once and then only followed from frame to
+frame until their result is due for a refresh. Students the session has
+confirmed present are left out of matching for other faces, so the
+per-frame matching cost falls as attendance fills up.
+
+Frames wait in a single latest-frame-wins slot: a frame still queued when
+the next one arrives is replaced and reported as superseded, instead of new
+frames being rejected while an old one waits. Up to ``FRAME_MAX_IN_FLIGHT``
+frames per connection are at the ML service at once, so ML latency overlaps
+with sending the previous results. Results are delivered in frame order; a
+frame that finishes after a newer one has been reported is dropped. Frames
+start no faster than the adaptive rate of ``app.services.frame_rate``, which
+is also pushed to the client so it does not send frames that would only be
+superseded.
+
+Frames are either base64 data URLs or, from binary WebSocket messages and
+Socket.IO binary attachments, the raw JPEG bytes. Bytes are posted as-is to
+the ML service's ``recognize-frame/raw`` endpoint, without base64 encoding.
+
+Transports only authenticate, build ``Frame`` objects and map the stream's
+events onto their own messages:
+
+* ``processing_started`` - ``{"status", "matched", "pending"}``
+* ``match_update`` - ``{"match", "pending"}``, once per face
+* ``complete`` - ``{"status", "matched", "unmatched", "timings"}``
+* ``error`` - ``{"code", "message"}``; ``code`` is one of
+  ``subject_not_found``, ``forbidden``, ``ml_error`` or
+  ``processing_failed`` (which is followed by a failed ``complete``)
+* ``skipped`` - ``{"status": "superseded"}``
+* ``frame_rate`` - ``{"fps", "interval_ms"}``, when the stream starts and
+  whenever the recommended rate changes by more than 10%
+
+Every payload carries the frame's ``frame_id`` when the client sent one.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Union
+
+from app.core.config import (
+    FRAME_MAX_IN_FLIGHT,
+    ML_CONFIDENT_THRESHOLD,
+    ML_MATCH_SIMILARITY,
+    ML_UNCERTAIN_THRESHOLD,
+)
+from app.core.metrics import RECOGNITION_FRAMES, RECOGNITION_STAGE_SECONDS
+from app.services.frame_rate import FrameRateAdvisor, TokenBucket, frame_rate_advisor
+from app.services.gallery_cache import SubjectGallery, get_gallery
+from app.services.ml_client import ml_client
+
+logger = logging.getLogger(__name__)
+
+Emit = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+# Similarity at which the ML service confirms a student as present: a
+# confident match, and never below the match similarity sent with the frame
+_CONFIRM_SIMILARITY = max(1.0 - ML_CONFIDENT_THRESHOLD, ML_MATCH_SIMILARITY)
+
+
+@dataclass
+class Frame:
+    # Base64 image (optionally a data URL) or encoded JPEG bytes
+    image: Union[str, bytes]
+    subject_id: str
+    # Authenticated teacher or admin user document
+    user: Dict[str, Any]
+    frame_id: Any = None
+
+
+@contextmanager
+def _stage(timings: Dict[str, float], name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def _strip_data_url(image_b64: str) -> str:
+    if "," in image_b64:
+        _, image_b64 = image_b64.split(",", 1)
+    return image_b64
+
+
+def resolve_face(face: Dict[str, Any], gallery: SubjectGallery, index: int) -> Dict:
+    """Result item of one recognized face, with the matched student's details."""
+    match_data = face.get("match") or {}
+    best_student_id = match_data.get("student_id")
+    distance = match_data.get("distance", 1.0)
+    confidence = match_data.get("confidence", 0.0)
+
+    status = "unknown"
+    student_details = None
+
+    if best_student_id:
+        if distance < ML_CONFIDENT_THRESHOLD:
+            status = "present"
+        elif distance < ML_UNCERTAIN_THRESHOLD:
+            status = "uncertain"
+
+        if status in ("present", "uncertain"):
+            student_details = gallery.roster.get(best_student_id)
+
+    is_live = face.get("is_live")  # Don't default to True!
+    if is_live is False:
+        status = "spoof"
+        student_details = None
+    elif is_live is None:
+        status = "unknown"
+        student_details = None
+        logger.warning(f"Face live check returned None (index {index})")
+
+    location = face["location"]
+    return {
+        "box": {
+            "top": location.get("top"),
+            "right": location.get("right"),
+            "bottom": location.get("bottom"),
+            "left": location.get("left"),
+        },
+        "status": status,
+        "distance": round(distance, 4) if best_student_id else None,
+        "confidence": round(confidence, 3) if best_student_id else None,
+        "student": student_details,
+        "track_id": face.get("track_id"),
+    }
+
+
+class RecognitionStream:
+    """Recognition of one connection's frames; see the module docstring."""
+
+    def __init__(
+        self,
+        emit: Emit,
+        max_in_flight: int = FRAME_MAX_IN_FLIGHT,
+        advisor: FrameRateAdvisor = frame_rate_advisor,
+    ):
+        self._emit_fn = emit
+        # Face-tracking session of this stream at the ML service
+        self.session_id = uuid.uuid4().hex
+        self._emit_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self._advisor = advisor
+        self._bucket = TokenBucket(advisor.recommended_fps())
+        self._announced_fps: Optional[float] = None
+        self._pending: Optional[Frame] = None
+        self._ready = asyncio.Event()
+        self._started = 0
+        self._reported = 0
+        self._runner: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, frame: Frame) -> None:
+        """Queue a frame, replacing one that has not started yet."""
+        stale, self._pending = self._pending, frame
+        self._ready.set()
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+            await self._update_rate()
+        if stale is not None:
+            RECOGNITION_FRAMES.labels(outcome="superseded").inc()
+            await self._emit("skipped", stale, {"status": "superseded"})
+
+    async def close(self) -> None:
+        """Stop processing; frames in flight are abandoned."""
+        tasks = [t for t in (self._runner, *self._tasks) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._runner = None
+
+    async def _run(self) -> None:
+        while True:
+            await self._ready.wait()
+            await self._slots.acquire()
+            # The rate may change while waiting, so the delay is re-checked
+            delay = self._bucket.delay()
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = self._bucket.delay()
+            self._bucket.take()
+
+            # Taken only now, so a frame that arrived meanwhile wins
+            frame, self._pending = self._pending, None
+            self._ready.clear()
+            self._started += 1
+
+            task = asyncio.create_task(self._process(self._started, frame))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(
+        self, event: str, frame: Optional[Frame], payload: Dict[str, Any]
+    ) -> None:
+        if frame is not None and frame.frame_id is not None:
+            payload = {**payload, "frame_id": frame.frame_id}
+        try:
+            await self._emit_fn(event, payload)
+        except Exception as exc:
+            # The client is usually just gone; the transport notices on its own
+            logger.debug(f"Could not send {event}: {exc}")
+
+    async def _emit(
+        self, event: str, frame: Optional[Frame], payload: Dict[str, Any]
+    ) -> None:
+        async with self._emit_lock:
+            await self._send(event, frame, payload)
+
+    async def _update_rate(self) -> None:
+        fps = self._advisor.recommended_fps()
+        self._bucket.set_rate(fps)
+        announced = self._announced_fps
+        if announced is None or abs(fps - announced) > 0.1 * announced:
+            self._announced_fps = fps
+            await self._emit(
+                "frame_rate",
+                None,
+                {"fps": round(fps, 2), "interval_ms": round(1000 / fps)},
+            )
+
+    async def _process(self, seq: int, frame: Frame) -> None:
+        timings: Dict[str, float] = {}
+        outcome = "failed"
+        try:
+            with _stage(timings, "decode"):
+                image = frame.image
+                if isinstance(image, str):
+                    image = _strip_data_url(image)
+
+            with _stage(timings, "gallery"):
+                gallery = await get_gallery(frame.subject_id)
+            if gallery is None:
+                outcome = "rejected"
+                await self._emit(
+                    "error",
+                    frame,
+                    {"code": "subject_not_found", "message": "Subject not found"},
+                )
+                return
+            if (
+                frame.user.get("role") != "admin"
+                and frame.user["_id"] not in gallery.professor_ids
+            ):
+                outcome = "rejected"
+                await self._emit(
+                    "error", frame, {"code": "forbidden", "message": "Forbidden"}
+                )
+                return
+
+            # Detect, check liveness and match all faces in one ML call
+            with _stage(timings, "recognize"):
+                if isinstance(image, str):
+                    ml_response = await ml_client.recognize_frame(
+                        image_base64=image,
+                        candidate_embeddings=gallery.candidates,
+                        threshold=ML_MATCH_SIMILARITY,
+                        min_face_area_ratio=0.01,
+                        gallery_id=gallery.gallery_id,
+                        gallery_version=gallery.version,
+                        session_id=self.session_id,
+                        confirm_threshold=_CONFIRM_SIMILARITY,
+                    )
+                else:
+                    ml_response = await ml_client.recognize_frame_bytes(
+                        image,
+                        gallery.candidates,
+                        gallery_id=gallery.gallery_id,
+                        gallery_version=gallery.version,
+                        threshold=ML_MATCH_SIMILARITY,
+                        min_face_area_ratio=0.01,
+                        session_id=self.session_id,
+                        confirm_threshold=_CONFIRM_SIMILARITY,
+                    )
+            if not ml_response.get("success"):
+                outcome = "ml_error"
+                await self._emit(
+                    "error",
+                    frame,
+                    {
+                        "code": "ml_error",
+                        "message": ml_response.get("error", "ML Error"),
+                    },
+                )
+                return
+
+            with _stage(timings, "resolve"):
+                results = [
+                    resolve_face(face, gallery, i)
+                    for i, face in enumerate(ml_response.get("faces", []))
+                ]
+
+            async with self._emit_lock:
+                if seq < self._reported:
+                    outcome = "superseded"
+                    await self._send("skipped", frame, {"status": "superseded"})
+                    return
+                self._reported = seq
+
+                with _stage(timings, "emit"):
+                    await self._emit_results(frame, results, timings)
+                outcome = "complete"
+
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except Exception as exc:
+            logger.error(f"Error processing frame: {exc}", exc_info=True)
+            await self._emit(
+                "error",
+                frame,
+                {"code": "processing_failed", "message": f"Processing failed: {exc}"},
+            )
+            await self._emit(
+                "complete",
+                frame,
+                {"status": "failed", "matched": [], "unmatched": []},
+            )
+        finally:
+            self._slots.release()
+            RECOGNITION_FRAMES.labels(outcome=outcome).inc()
+            for stage, seconds in timings.items():
+                RECOGNITION_STAGE_SECONDS.labels(stage=stage).observe(seconds)
+            if outcome != "cancelled":
+                if "recognize" in timings:
+                    self._advisor.record_latency(timings["recognize"])
+                await self._update_rate()
+
+    async def _emit_results(
+        self, frame: Frame, results: list, timings: Dict[str, float]
+    ) -> None:
+        count = len(results)
+        await self._send(
+            "processing_started",
+            frame,
+            {"status": "processing", "matched": [], "pending": count},
+        )
+
+        matched, unmatched = [], []
+        for i, result in enumerate(results):
+            if result["status"] in ("present", "uncertain"):
+                matched.append(result)
+            else:
+                unmatched.append(result)
+            await self._send(
+                "match_update", frame, {"match": result, "pending": count - (i + 1)}
+            )
+
+        await self._send(
+            "complete",
+            frame,
+            {
+                "status": "complete",
+                "matched": matched,
+                "unmatched": unmatched,
+                # Milliseconds per stage, up to sending the results
+                "timings": {
+                    stage: round(seconds * 1000, 1)
+                    for stage, seconds in timings.items()
+                },
+            },
+        )
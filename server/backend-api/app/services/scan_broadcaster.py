@@ -0,0 +1,66 @@
+"""
+Coalesced ``students_scanned`` broadcasts to live session rooms.
+
+At the start of a lecture hundreds of students scan within seconds. Instead
+of one ``student_scanned`` event per scan, the scans accepted for a room are
+collected for ``SCAN_BROADCAST_WINDOW_MS`` after the first one and sent as
+a single ``students_scanned`` event, ``{"scans": [...]}`` in the order they
+were accepted. The student's own ``scan_ack`` is not delayed. A window of 0
+sends every scan as a batch of one right away.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+EVENT = "students_scanned"
+
+Emit = Callable[..., Awaitable[Any]]
+
+
+class ScanBroadcaster:
+    """Batches scans per room; ``emit(event, data, room=...)`` sends a batch."""
+
+    def __init__(self, emit: Emit, window_seconds: float):
+        self._emit = emit
+        self.window_seconds = window_seconds
+        self._batches: Dict[str, List[Dict[str, Any]]] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+
+    async def publish(self, room: str, scan: Dict[str, Any]) -> None:
+        """Queue a scan for the room's next batch."""
+        if self.window_seconds <= 0:
+            await self._send(room, [scan])
+            return
+        batch = self._batches.get(room)
+        if batch is not None:
+            batch.append(scan)
+            return
+        self._batches[room] = [scan]
+        self._timers[room] = asyncio.create_task(self._send_later(room))
+
+    async def flush(self, room: Optional[str] = None) -> None:
+        """Send the pending batch of a room, or of every room, right away."""
+        rooms = [room] if room is not None else list(self._batches)
+        for name in rooms:
+            timer = self._timers.pop(name, None)
+            if timer is not None:
+                timer.cancel()
+            batch = self._batches.pop(name, None)
+            if batch:
+                await self._send(name, batch)
+
+    async def _send_later(self, room: str) -> None:
+        await asyncio.sleep(self.window_seconds)
+        self._timers.pop(room, None)
+        batch = self._batches.pop(room, None)
+        if batch:
+            await self._send(room, batch)
+
+    async def _send(self, room: str, batch: List[Dict[str, Any]]) -> None:
+        try:
+            await self._emit(EVENT, {"scans": batch}, room=room)
+        except Exception as e:
+            logger.error(f"Error broadcasting {len(batch)} scans to {room}: {e}")
@@ -0,0 +1,612 @@
+"""
+State of live QR attendance sessions, shared by every backend worker.
+
+A session has the teacher's location and subject, set when the teacher
+joins, and the scans accepted so far. Once the teacher ends it, the session
+is marked ended and takes no more scans; its state is dropped when all its
+scans are saved, and the marker stays until it expires. The ids of scanned
+students stay for the whole session so that a student cannot be recorded
+twice, checked in constant time; a watermark separates the scans already
+flushed to Mongo from those pending, so a flush writes only the scans added
+since the previous one. A student's ``student_scan`` or QR request may reach
+a different worker than the teacher's ``join_session``, so with
+``REDIS_URL`` set the state lives in Redis; otherwise it is kept in process
+memory, which limits the backend to a single worker.
+
+Redis keys (all expire after ``SESSION_STATE_TTL_SECONDS``):
+
+* ``attendance:sessions`` - set of session ids with state
+* ``attendance:session:<id>:location`` - JSON ``{"lat", "lon", "subjectId"}``
+* ``attendance:session:<id>:scans`` - hash of studentId -> JSON scan; adding
+  with HSETNX makes the duplicate check atomic across workers
+* ``attendance:session:<id>:pending`` - list of studentIds not flushed yet,
+  trimmed from the front once flushed
+* ``attendance:session:<id>:pending_since`` - when the oldest pending scan
+  was accepted (Unix time)
+* ``attendance:session:<id>:flush`` - lock held while a worker flushes
+* ``attendance:session:<id>:ended`` - set when the session is ended; scans
+  are rejected while it exists
+
+In memory, accepted scans are also appended to a local journal
+(``SCAN_JOURNAL_PATH``) before they are acknowledged, so a restart or a
+killed worker does not lose the scans waiting for the next flush. Each
+process has a journal of its own next to that path; it is replayed on
+startup, with those left by exited processes, and rewritten after each
+flush with the pending scans and only the ids of flushed ones. In Redis the
+scans themselves survive a backend restart.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from app.core.config import REDIS_URL, SCAN_JOURNAL_PATH, SESSION_STATE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Longest a flush may hold a session's lock before another worker may flush
+_FLUSH_LOCK_SECONDS = 120
+
+# Returned by ``add_scan`` for a scan in a session that has ended
+SESSION_ENDED = -1
+
+# Adds a scan unless the session has ended or the student has one; returns
+# the pending count, 0 for a duplicate or -1 (SESSION_ENDED)
+# KEYS: scans, pending, pending_since, sessions, ended
+# ARGV: student id, scan JSON, now, ttl, session id
+_ADD_SCAN_SCRIPT = """
+if redis.call('EXISTS', KEYS[5]) == 1 then
+  return -1
+end
+if redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2]) == 0 then
+  return 0
+end
+local pending = redis.call('RPUSH', KEYS[2], ARGV[1])
+if pending == 1 then
+  redis.call('SET', KEYS[3], ARGV[3])
+end
+for i = 1, 3 do
+  redis.call('EXPIRE', KEYS[i], ARGV[4])
+end
+redis.call('SADD', KEYS[4], ARGV[5])
+redis.call('EXPIRE', KEYS[4], ARGV[4])
+return pending
+"""
+
+# Moves the watermark past the first ARGV[1] pending scans
+# KEYS: pending, pending_since
+# ARGV: count, now
+_MARK_FLUSHED_SCRIPT = """
+redis.call('LTRIM', KEYS[1], ARGV[1], -1)
+if redis.call('LLEN', KEYS[1]) > 0 then
+  redis.call('SET', KEYS[2], ARGV[2], 'KEEPTTL')
+else
+  redis.call('DEL', KEYS[2])
+end
+"""
+
+
+class ScanJournal:
+    """
+    Append-only JSON-lines files of session state changes, one per process.
+
+    Each process journals to its own slot, the first of ``path``,
+    ``path.1``, ``path.2``, ... whose ``.lock`` file no live process holds
+    locked, so workers never rewrite each other's journals. A slot is freed
+    when its process exits; on startup a process replays its slot and adopts
+    any other free one, so each journal is replayed once.
+
+    Each line is flushed to the OS before ``append`` returns, which survives
+    the process being killed; it is not fsynced, so a power loss may still
+    drop the last scans. The methods do blocking file I/O; see
+    ``MemorySessionState`` for how they are kept off the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.base_path = path
+        self.path: Optional[str] = None
+        self._file = None
+        self._lock_file = None
+        # Locks of the slots adopted by ``adopt``, held until ``release_adopted``
+        self._adopted: Dict[str, Any] = {}
+
+    def _slot_path(self, slot: int) -> str:
+        return self.base_path if slot == 0 else f"{self.base_path}.{slot}"
+
+    def _slot_paths(self) -> List[str]:
+        """Paths of the slots that have a journal on disk."""
+        directory = os.path.dirname(self.base_path) or "."
+        prefix = os.path.basename(self.base_path) + "."
+        paths = [self.base_path] if os.path.exists(self.base_path) else []
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name[len(prefix) :].isdigit():
+                paths.append(os.path.join(directory, name))
+        return paths
+
+    @staticmethod
+    def _try_lock(path: str):
+        """The open, locked lock file of a slot, or None if a process holds it."""
+        lock_file = open(f"{path}.lock", "a")
+        if fcntl is None:
+            # No advisory locks here; a single process is assumed
+            return lock_file
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _claim(self) -> str:
+        if self.path is None:
+            directory = os.path.dirname(self.base_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            slot = 0
+            while True:
+                path = self._slot_path(slot)
+                if path not in self._adopted:
+                    lock_file = self._try_lock(path)
+                    if lock_file is not None:
+                        break
+                slot += 1
+            self.path, self._lock_file = path, lock_file
+        return self.path
+
+    def append(self, record: Dict[str, Any]) -> None:
+        if self._file is None:
+            self._file = open(self._claim(), "a", encoding="utf-8")
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    @staticmethod
+    def _read(path: str) -> List[Dict[str, Any]]:
+        records = []
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A line cut short by a crash mid-write
+                        logger.warning(f"Skipping unreadable line in {path}")
+        except FileNotFoundError:
+            pass
+        return records
+
+    def records(self) -> List[Dict[str, Any]]:
+        """Records of this process's slot."""
+        return self._read(self._claim())
+
+    def adopt(self) -> List[Dict[str, Any]]:
+        """
+        Lock the other slots no process holds and return their records. They
+        stay locked until ``release_adopted``, called once the records are
+        journaled in this process's slot.
+        """
+        own = self._claim()
+        records = []
+        for path in self._slot_paths():
+            if path == own or path in self._adopted:
+                continue
+            lock_file = self._try_lock(path)
+            if lock_file is None:
+                continue
+            self._adopted[path] = lock_file
+            records.extend(self._read(path))
+        return records
+
+    def release_adopted(self) -> None:
+        """Delete the adopted journals and free their slots."""
+        for path, lock_file in self._adopted.items():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            # The lock file stays, so a slot is always locked through one inode
+            lock_file.close()
+        self._adopted.clear()
+
+    def rewrite(self, records: Iterable[Dict[str, Any]]) -> None:
+        """Atomically replace this process's journal with ``records``."""
+        path = self._claim()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, path)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.release_adopted()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+            self.path = None
+
+
+class MemorySessionState:
+    """
+    Session state of this process only, journaled when a path is given.
+
+    Journal I/O runs on a single thread of its own, in call order, so that
+    it neither blocks the event loop nor reorders records. State is changed
+    before its record is queued, so a compaction queued in between already
+    holds the change and the record lands in the rewritten journal.
+    """
+
+    def __init__(self, journal_path: Optional[str] = None):
+        # Students with a scan in each session, for constant-time dedup
+        self._scanned: Dict[str, Set[str]] = {}
+        # Payloads of the scans not flushed yet, oldest first
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending_since: Dict[str, float] = {}
+        self._locations: Dict[str, Dict[str, Any]] = {}
+        # When each ended session was ended
+        self._ended: Dict[str, float] = {}
+        self._flushing: Set[str] = set()
+        self._journal = ScanJournal(journal_path) if journal_path else None
+        self._journal_thread = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="scan-journal")
+            if journal_path
+            else None
+        )
+
+    async def _run_journal(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._journal_thread, fn, *args)
+
+    async def _log(self, record: Dict[str, Any]) -> None:
+        if self._journal is not None:
+            await self._run_journal(self._journal.append, record)
+
+    async def _compact(self) -> None:
+        """Rewrite the journal with the state still held."""
+        if self._journal is None:
+            return
+        records = []
+        for session_id in self._scanned.keys() | self._locations.keys():
+            records.append(
+                {
+                    "op": "join",
+                    "session": session_id,
+                    "location": self._locations.get(session_id),
+                }
+            )
+            pending = self._pending.get(session_id, [])
+            flushed = self._scanned.get(session_id, set()).difference(
+                scan["studentId"] for scan in pending
+            )
+            if flushed:
+                records.append(
+                    {"op": "flushed", "session": session_id, "students": list(flushed)}
+                )
+            records.extend(
+                {"op": "scan", "session": session_id, "scan": scan} for scan in pending
+            )
+        # After the scans, so that replaying them is not rejected
+        records.extend(
+            {"op": "ended", "session": session_id, "at": at}
+            for session_id, at in self._ended.items()
+        )
+        await self._run_journal(self._journal.rewrite, records)
+
+    def _prune_ended(self) -> None:
+        cutoff = time.time() - SESSION_STATE_TTL_SECONDS
+        for session_id, at in list(self._ended.items()):
+            if at < cutoff:
+                del self._ended[session_id]
+
+    async def restore(self) -> int:
+        """
+        Replay the journal this process's slot holds from a previous run,
+        and those of exited processes. Returns the number of pending scans
+        restored.
+        """
+        if self._journal is None:
+            return 0
+        records = await self._run_journal(self._journal.records)
+        records += await self._run_journal(self._journal.adopt)
+        for record in records:
+            session_id = record.get("session")
+            op = record.get("op")
+            if op == "join":
+                await self.join(session_id, record.get("location"), journal=False)
+            elif op == "scan":
+                await self.add_scan(session_id, record["scan"], journal=False)
+            elif op == "flushed":
+                # Only the ids are kept, to reject duplicates of saved scans
+                self._scanned.setdefault(session_id, set()).update(record["students"])
+            elif op == "ended":
+                self._ended[session_id] = record.get("at", time.time())
+        self._prune_ended()
+        await self._compact()
+        # Only now that this process's journal holds them
+        await self._run_journal(self._journal.release_adopted)
+        return sum(len(pending) for pending in self._pending.values())
+
+    async def join(
+        self,
+        session_id: str,
+        location: Optional[Dict[str, Any]] = None,
+        journal: bool = True,
+    ) -> None:
+        """Register a session, storing the teacher's location when given."""
+        if location is not None:
+            self._locations[session_id] = location
+        self._scanned.setdefault(session_id, set())
+        if journal:
+            await self._log({"op": "join", "session": session_id, "location": location})
+
+    async def get_location(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._locations.get(session_id)
+
+    async def add_scan(
+        self, session_id: str, scan: Dict[str, Any], journal: bool = True
+    ) -> int:
+        """
+        Buffer a scan unless the session has ended or the student already
+        has a scan in it. Returns the number of scans pending a flush
+        including this one, 0 for such a duplicate or ``SESSION_ENDED``. The
+        scan is journaled before this returns, so an acknowledged scan is
+        never lost.
+        """
+        if session_id in self._ended:
+            return SESSION_ENDED
+        scanned = self._scanned.setdefault(session_id, set())
+        if scan["studentId"] in scanned:
+            return 0
+        scanned.add(scan["studentId"])
+        pending = self._pending.setdefault(session_id, [])
+        pending.append(scan)
+        count = len(pending)
+        if count == 1:
+            self._pending_since[session_id] = time.time()
+        if journal:
+            try:
+                await self._log({"op": "scan", "session": session_id, "scan": scan})
+            except Exception:
+                # Not durable, so not accepted, unless a flush saved it meanwhile
+                if any(p is scan for p in pending):
+                    pending[:] = [p for p in pending if p is not scan]
+                    scanned.discard(scan["studentId"])
+                    if not pending:
+                        self._pending_since.pop(session_id, None)
+                    raise
+        return count
+
+    async def session_ids(self) -> List[str]:
+        return list(self._scanned)
+
+    async def get_pending(self, session_id: str) -> List[Dict[str, Any]]:
+        """Scans added since the last flush, oldest first."""
+        return list(self._pending.get(session_id, []))
+
+    async def pending_stats(self, session_id: str) -> Tuple[int, Optional[float]]:
+        """Number of pending scans and when the oldest was accepted."""
+        pending = len(self._pending.get(session_id, []))
+        return pending, self._pending_since.get(session_id) if pending else None
+
+    async def mark_flushed(self, session_id: str, count: int) -> None:
+        """Move the watermark past the first ``count`` pending scans."""
+        pending = self._pending.get(session_id)
+        if pending is None:
+            return
+        del pending[:count]
+        if pending:
+            # Scans added while the flush ran; their age is counted from now
+            self._pending_since[session_id] = time.time()
+        else:
+            self._pending_since.pop(session_id, None)
+        # Called once the scans are saved, so the journal may drop them
+        await self._compact()
+
+    async def mark_ended(self, session_id: str) -> None:
+        """Stop taking scans for a session; its pending ones stay to flush."""
+        self._ended[session_id] = time.time()
+        self._prune_ended()
+        await self._log(
+            {"op": "ended", "session": session_id, "at": self._ended[session_id]}
+        )
+
+    async def is_ended(self, session_id: str) -> bool:
+        return session_id in self._ended
+
+    async def end(self, session_id: str) -> bool:
+        """
+        Forget a session; an ended marker stays. Returns False if it was not
+        known.
+        """
+        had_scans = self._scanned.pop(session_id, None) is not None
+        had_location = self._locations.pop(session_id, None) is not None
+        self._pending.pop(session_id, None)
+        self._pending_since.pop(session_id, None)
+        if had_scans or had_location:
+            await self._compact()
+        return had_scans or had_location
+
+    @asynccontextmanager
+    async def flush_lock(self, session_id: str) -> AsyncIterator[bool]:
+        """Yields True if the caller may flush the session now."""
+        if session_id in self._flushing:
+            yield False
+            return
+        self._flushing.add(session_id)
+        try:
+            yield True
+        finally:
+            self._flushing.discard(session_id)
+
+    async def close(self) -> None:
+        if self._journal is not None:
+            # The thread stays, so a late flush can still journal
+            await self._run_journal(self._journal.close)
+
+
+class RedisSessionState:
+    """Session state in Redis, shared by all workers; see the module docstring."""
+
+    SESSIONS_KEY = "attendance:sessions"
+
+    def __init__(self, url: str, ttl_seconds: int):
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self._client = None
+        self._add_scan = None
+        self._mark_flushed = None
+
+    def _redis(self):
+        if self._client is None:
+            import redis.asyncio as aioredis
+
+            self._client = aioredis.from_url(
+                self.url, decode_responses=True, socket_connect_timeout=3
+            )
+            self._add_scan = self._client.register_script(_ADD_SCAN_SCRIPT)
+            self._mark_flushed = self._client.register_script(_MARK_FLUSHED_SCRIPT)
+        return self._client
+
+    @staticmethod
+    def _key(session_id: str, part: str) -> str:
+        return f"attendance:session:{session_id}:{part}"
+
+    async def join(
+        self, session_id: str, location: Optional[Dict[str, Any]] = None
+    ) -> None:
+        async with self._redis().pipeline(transaction=False) as pipe:
+            pipe.sadd(self.SESSIONS_KEY, session_id)
+            pipe.expire(self.SESSIONS_KEY, self.ttl_seconds)
+            if location is not None:
+                pipe.set(
+                    self._key(session_id, "location"),
+                    json.dumps(location),
+                    ex=self.ttl_seconds,
+                )
+            await pipe.execute()
+
+    async def restore(self) -> int:
+        # Buffered scans are already kept in Redis
+        return 0
+
+    async def get_location(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis().get(self._key(session_id, "location"))
+        return json.loads(raw) if raw else None
+
+    async def add_scan(self, session_id: str, scan: Dict[str, Any]) -> int:
+        self._redis()
+        pending = await self._add_scan(
+            keys=[
+                self._key(session_id, "scans"),
+                self._key(session_id, "pending"),
+                self._key(session_id, "pending_since"),
+                self.SESSIONS_KEY,
+                self._key(session_id, "ended"),
+            ],
+            args=[
+                scan["studentId"],
+                json.dumps(scan),
+                time.time(),
+                self.ttl_seconds,
+                session_id,
+            ],
+        )
+        return int(pending)
+
+    async def session_ids(self) -> List[str]:
+        return list(await self._redis().smembers(self.SESSIONS_KEY))
+
+    async def get_pending(self, session_id: str) -> List[Dict[str, Any]]:
+        redis = self._redis()
+        student_ids = await redis.lrange(self._key(session_id, "pending"), 0, -1)
+        if not student_ids:
+            return []
+        values = await redis.hmget(self._key(session_id, "scans"), student_ids)
+        return [json.loads(v) for v in values if v is not None]
+
+    async def pending_stats(self, session_id: str) -> Tuple[int, Optional[float]]:
+        async with self._redis().pipeline(transaction=False) as pipe:
+            pipe.llen(self._key(session_id, "pending"))
+            pipe.get(self._key(session_id, "pending_since"))
+            pending, since = await pipe.execute()
+        return pending, float(since) if pending and since else None
+
+    async def mark_flushed(self, session_id: str, count: int) -> None:
+        self._redis()
+        await self._mark_flushed(
+            keys=[
+                self._key(session_id, "pending"),
+                self._key(session_id, "pending_since"),
+            ],
+            args=[count, time.time()],
+        )
+
+    async def mark_ended(self, session_id: str) -> None:
+        await self._redis().set(
+            self._key(session_id, "ended"), "1", ex=self.ttl_seconds
+        )
+
+    async def is_ended(self, session_id: str) -> bool:
+        return bool(await self._redis().exists(self._key(session_id, "ended")))
+
+    async def end(self, session_id: str) -> bool:
+        async with self._redis().pipeline(transaction=False) as pipe:
+            pipe.delete(
+                *(
+                    self._key(session_id, part)
+                    for part in ("scans", "pending", "pending_since", "location")
+                )
+            )
+            pipe.srem(self.SESSIONS_KEY, session_id)
+            deleted, removed = await pipe.execute()
+        return bool(deleted or removed)
+
+    @asynccontextmanager
+    async def flush_lock(self, session_id: str) -> AsyncIterator[bool]:
+        key = self._key(session_id, "flush")
+        acquired = await self._redis().set(key, "1", nx=True, ex=_FLUSH_LOCK_SECONDS)
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                await self._redis().delete(key)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+            self._add_scan = self._mark_flushed = None
+
+
+def _create_state():
+    if REDIS_URL:
+        logger.info("Live session state is kept in Redis")
+        return RedisSessionState(REDIS_URL, SESSION_STATE_TTL_SECONDS)
+    return MemorySessionState(journal_path=SCAN_JOURNAL_PATH or None)
+
+
+session_state = _create_state()
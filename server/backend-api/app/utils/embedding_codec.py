@@ -0,0 +1,53 @@
+"""
+Encoding of face embeddings on the wire to the ML service.
+
+Mirrors the ML service format: an embedding is either a JSON float list or
+a string ``"<format>:<base64>"`` holding a little-endian float32 (``f32``)
+or float16 (``f16``) buffer. Encoded strings decode with ``np.frombuffer``
+into NumPy vectors, like stored embeddings in
+``app.utils.embedding_storage``; callers convert to lists only where JSON
+needs them.
+"""
+
+import base64
+from typing import Any, List, Union
+
+import numpy as np
+
+EMBEDDING_FORMAT_HEADER = "X-Embedding-Format"
+
+FORMAT_JSON = "json"
+BINARY_FORMATS = {"f32": np.dtype("<f4"), "f16": np.dtype("<f2")}
+
+
+def encode_embedding(values: Any, fmt: str) -> Union[List[float], str]:
+    """
+    Encode a float list or NumPy vector as ``fmt``; strings pass through and
+    the JSON format yields a float list.
+    """
+    if isinstance(values, str):
+        return values
+    dtype = BINARY_FORMATS.get(fmt)
+    if dtype is None:
+        if isinstance(values, np.ndarray):
+            return values.astype(float).tolist()
+        return values
+
+    raw = np.asarray(values, dtype=dtype).tobytes()
+    return f"{fmt}:{base64.b64encode(raw).decode('ascii')}"
+
+
+def decode_embedding(value: Any) -> np.ndarray:
+    """Decode a float list or an encoded embedding string to a float32 vector."""
+    if isinstance(value, np.ndarray):
+        return value
+    if not isinstance(value, str):
+        return np.asarray(value, dtype=np.float32)
+
+    fmt, _, payload = value.partition(":")
+    dtype = BINARY_FORMATS.get(fmt)
+    if dtype is None:
+        raise ValueError(f"Unsupported embedding encoding '{fmt}'")
+    return np.frombuffer(base64.b64decode(payload), dtype=dtype).astype(
+        np.float32, copy=False
+    )
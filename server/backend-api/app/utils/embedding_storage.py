@@ -0,0 +1,75 @@
+"""
+Storage of face embeddings in MongoDB as packed binary.
+
+Each embedding is a BSON ``Binary`` holding a little-endian float32 or
+float16 buffer, marked by a user-defined subtype. Compared with a BSON
+array of doubles this is 2-4x smaller in Mongo and on the wire, and it
+decodes into bytes rather than hundreds of Python floats per embedding:
+``unpack_embeddings`` joins a student's buffers and views them as one NumPy
+matrix with ``np.frombuffer``.
+
+Documents written before the conversion still hold float lists; every read
+helper accepts both.
+"""
+
+from typing import Any, List, Sequence
+
+import numpy as np
+from bson.binary import Binary
+
+SUBTYPE_F32 = 0x80
+SUBTYPE_F16 = 0x81
+
+_SUBTYPES = {"f32": SUBTYPE_F32, "f16": SUBTYPE_F16}
+_DTYPES = {SUBTYPE_F32: np.dtype("<f4"), SUBTYPE_F16: np.dtype("<f2")}
+
+
+def pack_embedding(values: Any, fmt: str = "f32") -> Binary:
+    """Pack a float sequence (or an already packed embedding) as ``fmt``."""
+    if isinstance(values, Binary) and values.subtype in _DTYPES:
+        if values.subtype == _SUBTYPES[fmt]:
+            return values
+        values = _as_array(values)
+    raw = np.asarray(values, dtype=_DTYPES[_SUBTYPES[fmt]]).tobytes()
+    return Binary(raw, _SUBTYPES[fmt])
+
+
+def _as_array(value: Any) -> np.ndarray:
+    if isinstance(value, Binary) and value.subtype in _DTYPES:
+        return np.frombuffer(value, dtype=_DTYPES[value.subtype])
+    return np.asarray(value, dtype=np.float32)
+
+
+def unpack_embeddings(embeddings: Sequence[Any]) -> np.ndarray:
+    """
+    A student's stored embeddings as an (n, dim) float32 matrix.
+
+    When all embeddings are float32 binaries of one length, the result is a
+    read-only view over a single joined buffer; nothing is parsed per value.
+    """
+    if not embeddings:
+        return np.zeros((0, 0), dtype=np.float32)
+
+    first = embeddings[0]
+    if (
+        isinstance(first, Binary)
+        and first.subtype == SUBTYPE_F32
+        and all(
+            isinstance(e, Binary) and e.subtype == SUBTYPE_F32 and len(e) == len(first)
+            for e in embeddings
+        )
+    ):
+        return np.frombuffer(b"".join(embeddings), dtype="<f4").reshape(
+            len(embeddings), -1
+        )
+
+    return np.stack([_as_array(e).astype(np.float32, copy=False) for e in embeddings])
+
+
+def embeddings_to_lists(embeddings: Sequence[Any]) -> List[List[float]]:
+    """Stored embeddings as JSON-friendly float lists."""
+    return [_as_array(e).astype(float).tolist() for e in embeddings or []]
+
+
+def is_packed(embedding: Any) -> bool:
+    return isinstance(embedding, Binary) and embedding.subtype in _DTYPES
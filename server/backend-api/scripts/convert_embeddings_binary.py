@@ -0,0 +1,91 @@
+"""
+Convert stored face embeddings from BSON double arrays to packed binary.
+
+Rewrites ``face_embeddings`` and every ``face_embeddings_by_model`` entry
+of each student with ``app.utils.embedding_storage.pack_embedding``.
+Already packed embeddings are left as they are, so the script can be
+re-run safely.
+
+    python scripts/convert_embeddings_binary.py [--format f16] [--dry-run]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+load_dotenv()
+
+from app.utils.embedding_storage import is_packed, pack_embedding  # noqa: E402
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("MONGO_DB_NAME", "smart-attendance")
+BATCH_SIZE = 500
+
+
+def _converted(embeddings, fmt):
+    if not embeddings or all(is_packed(e) for e in embeddings):
+        return None
+    return [pack_embedding(e, fmt) for e in embeddings]
+
+
+async def convert_embeddings(fmt: str, dry_run: bool):
+    print(f"Connecting to {MONGO_URI} / {DB_NAME}")
+    client = AsyncIOMotorClient(MONGO_URI)
+    students = client[DB_NAME]["students"]
+
+    cursor = students.find(
+        {
+            "$or": [
+                {"face_embeddings.0": {"$type": "array"}},
+                {"face_embeddings_by_model": {"$exists": True}},
+            ]
+        },
+        {"face_embeddings": 1, "face_embeddings_by_model": 1, "last_face_update": 1},
+    )
+
+    ops = []
+    converted = 0
+    async for doc in cursor:
+        update = {}
+        packed = _converted(doc.get("face_embeddings"), fmt)
+        if packed is not None:
+            update["face_embeddings"] = packed
+        for model, embeddings in (doc.get("face_embeddings_by_model") or {}).items():
+            packed = _converted(embeddings, fmt)
+            if packed is not None:
+                update[f"face_embeddings_by_model.{model}"] = packed
+        if not update:
+            continue
+
+        converted += 1
+        # A photo uploaded meanwhile wins; the next run converts it
+        ops.append(
+            UpdateOne(
+                {"_id": doc["_id"], "last_face_update": doc.get("last_face_update")},
+                {"$set": update},
+            )
+        )
+        if len(ops) >= BATCH_SIZE and not dry_run:
+            await students.bulk_write(ops, ordered=False)
+            ops = []
+
+    if ops and not dry_run:
+        await students.bulk_write(ops, ordered=False)
+
+    action = "Would convert" if dry_run else "Converted"
+    print(f"{action} embeddings of {converted} students to {fmt}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--format", choices=["f32", "f16"], default="f32")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(convert_embeddings(args.format, args.dry_run))
@@ -0,0 +1,62 @@
+"""
+Re-embed every student's stored face photo with a new ML encoder.
+
+Safe to stop and re-run: progress is checkpointed after every batch.
+
+    python scripts/migrate_embeddings.py --encoder sface
+    python scripts/migrate_embeddings.py --encoder sface --restart  # retry failures
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+from prometheus_client import start_http_server
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+load_dotenv()
+
+from app.core.config import ML_MAX_BATCH_IMAGES  # noqa: E402
+from app.services.embedding_migration import migrate_embeddings  # noqa: E402
+from app.services.ml_client import ml_client  # noqa: E402
+
+
+async def main(args):
+    try:
+        summary = await migrate_embeddings(
+            encoder=args.encoder,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            restart=args.restart,
+        )
+    finally:
+        await ml_client.close()
+    print(
+        f"Migrated {summary['migrated']}, failed {summary['failed']}, "
+        f"{summary['remaining']} still pending for {summary['model_version']}."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--encoder", required=True, help="ML service encoder, e.g. sface"
+    )
+    parser.add_argument("--batch-size", type=int, default=ML_MAX_BATCH_IMAGES)
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Parallel image downloads"
+    )
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint")
+    parser.add_argument(
+        "--metrics-port", type=int, help="Expose progress metrics on this port"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    asyncio.run(main(args))
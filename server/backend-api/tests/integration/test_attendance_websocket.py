@@ -5,6 +5,7 @@ from datetime import datetime, timedelta, timezone
 from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock
 from app.main import app
+from app.services import gallery_cache
 from app.utils.jwt_token import JWT_SECRET, JWT_ALGORITHM
 
 
@@ -46,9 +47,10 @@ def test_websocket_process_frame(client):
     token = create_token(user_id)
     session_id = "test-session"
 
+    gallery_cache.clear()
     with patch("app.api.routes.attendance.db") as mock_db, \
-         patch("app.api.routes.attendance.ml_client.detect_faces", new_callable=AsyncMock) as mock_detect, \
-         patch("app.api.routes.attendance.ml_client.match_faces", new_callable=AsyncMock) as mock_match:
+         patch("app.services.gallery_cache.db", mock_db), \
+         patch("app.api.routes.attendance.ml_client.recognize_frame", new_callable=AsyncMock) as mock_recognize:
 
         # Setup mocks on mock_db
         mock_db.users.find_one = AsyncMock(
@@ -63,10 +65,14 @@ def test_websocket_process_frame(client):
             }
         )
 
-        mock_detect.return_value = {
+        mock_recognize.return_value = {
             "success": True,
             "faces": [
-                {"embedding": [0.1] * 128, "location": {"top": 0}, "is_live": True}
+                {
+                    "location": {"top": 0},
+                    "is_live": True,
+                    "match": {"student_id": "std1", "distance": 0.1, "confidence": 0.9},
+                }
             ],
         }
 
@@ -76,11 +82,9 @@ def test_websocket_process_frame(client):
             {"userId": "std1", "face_embeddings": [[0.1] * 128], "name": "Student 1"}
         ]
         mock_db.students.find.return_value = mock_cursor
-
-        mock_match.return_value = {
-            "success": True,
-            "match": {"student_id": "std1", "distance": 0.1, "confidence": 0.9},
-        }
+        users_cursor = AsyncMock()
+        users_cursor.to_list.return_value = []
+        mock_db.users.find.return_value = users_cursor
 
         with client.websocket_connect(
             f"/api/attendance/ws/{session_id}?token={token}"
@@ -95,6 +99,11 @@ def test_websocket_process_frame(client):
             )
 
             # Expect messages
+            # 0. frame rate the client should send at
+            msg0 = websocket.receive_json()
+            assert msg0["type"] == "frame_rate"
+            assert msg0["fps"] > 0
+
             # 1. processing_started
             msg1 = websocket.receive_json()
             assert msg1["type"] == "processing_started"
@@ -108,3 +117,47 @@ def test_websocket_process_frame(client):
             # 3. complete
             msg3 = websocket.receive_json()
             assert msg3["type"] == "complete"
+
+        # One ML round trip per frame, referencing the subject's gallery
+        mock_recognize.assert_awaited_once()
+        assert mock_recognize.await_args.kwargs["gallery_id"] == f"subject:{subject_id}"
+
+
+def test_websocket_binary_frame(client):
+    user_id = ObjectId()
+    subject_id = ObjectId()
+    token = create_token(user_id)
+    jpeg = b"\xff\xd8\xff\xe0 frame"
+
+    gallery_cache.clear()
+    with patch("app.api.routes.attendance.db") as mock_db, \
+         patch("app.services.gallery_cache.db", mock_db), \
+         patch("app.api.routes.attendance.ml_client.recognize_frame_bytes", new_callable=AsyncMock) as mock_recognize:
+
+        mock_db.users.find_one = AsyncMock(
+            return_value={"_id": user_id, "role": "teacher"}
+        )
+        mock_db.subjects.find_one = AsyncMock(
+            return_value={"_id": subject_id, "students": [], "professor_ids": [user_id]}
+        )
+        empty_cursor = AsyncMock()
+        empty_cursor.to_list.return_value = []
+        mock_db.students.find.return_value = empty_cursor
+        mock_db.users.find.return_value = empty_cursor
+        mock_recognize.return_value = {"success": True, "faces": []}
+
+        with client.websocket_connect(
+            f"/api/attendance/ws/test-session?token={token}"
+        ) as websocket:
+            # Binary frames need the subject first
+            websocket.send_bytes(jpeg)
+            assert websocket.receive_json()["message"] == "Missing subject_id"
+
+            websocket.send_json({"command": "subject", "subject_id": str(subject_id)})
+            websocket.send_bytes(jpeg)
+
+            types = [websocket.receive_json()["type"] for _ in range(3)]
+            assert types == ["frame_rate", "processing_started", "complete"]
+
+        # The JPEG reaches the ML client as received, without base64
+        assert mock_recognize.await_args.args[0] == jpeg
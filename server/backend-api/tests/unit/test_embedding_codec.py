@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from app.utils.embedding_codec import decode_embedding, encode_embedding
+
+
+def test_f32_round_trip():
+    values = [0.5, -1.25, 3.0]
+    encoded = encode_embedding(values, "f32")
+    assert encoded.startswith("f32:")
+    decoded = decode_embedding(encoded)
+    assert decoded.dtype == np.float32
+    assert decoded.tolist() == values
+
+
+def test_f16_round_trip():
+    values = np.array([0.5, -1.25, 3.0], dtype=np.float32)
+    np.testing.assert_array_equal(
+        decode_embedding(encode_embedding(values, "f16")), values
+    )
+
+
+def test_json_format_and_encoded_strings_pass_through():
+    assert encode_embedding([0.5], "json") == [0.5]
+    assert encode_embedding(np.array([0.5], np.float32), "json") == [0.5]
+    encoded = encode_embedding([0.5], "f32")
+    assert encode_embedding(encoded, "f32") == encoded
+    assert decode_embedding([0.5]).tolist() == [0.5]
+
+
+def test_decode_unknown_format():
+    with pytest.raises(ValueError):
+        decode_embedding("f64:AAAAAAAAAAA=")
@@ -0,0 +1,149 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.services import embedding_migration
+from app.utils.embedding_storage import unpack_embeddings
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args):
+        return self
+
+    def batch_size(self, *args):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+@pytest.fixture(autouse=True)
+def sface_info():
+    info = {"success": True, "model_version": "sface-2021dec", "dimension": 128}
+    with patch.object(
+        embedding_migration.ml_client, "encoder_info", new=AsyncMock(return_value=info)
+    ) as mock_info:
+        yield mock_info
+
+
+def _mock_db(students, checkpoint=None):
+    mock_db = MagicMock()
+    mock_db.students.find.return_value = FakeCursor(students)
+    mock_db.students.count_documents = AsyncMock(return_value=len(students))
+    mock_db.students.update_one = AsyncMock()
+    mock_db.embedding_migrations.find_one = AsyncMock(return_value=checkpoint)
+    mock_db.embedding_migrations.update_one = AsyncMock()
+    mock_db.embedding_migrations.delete_one = AsyncMock()
+    return mock_db
+
+
+@pytest.mark.asyncio
+async def test_migration_stores_embeddings_under_model_key_and_checkpoints():
+    students = [{"_id": i, "image_url": f"https://img/{i}"} for i in range(3)]
+    mock_db = _mock_db(students)
+
+    def encode(images, encoder):
+        return {
+            "success": True,
+            "model_version": "sface-2021dec",
+            "results": [
+                {"success": True, "embedding": [0.1] * 128}
+                if image != "img-1"
+                else {"success": False, "error_code": "NO_FACE_FOUND"}
+                for image in images
+            ],
+        }
+
+    with (
+        patch.object(embedding_migration, "db", mock_db),
+        patch.object(
+            embedding_migration,
+            "_fetch_image",
+            new=AsyncMock(side_effect=lambda http, sem, url: "img-" + url[-1]),
+        ),
+        patch.object(
+            embedding_migration.ml_client,
+            "encode_faces_batch",
+            new=AsyncMock(side_effect=encode),
+        ) as mock_encode,
+    ):
+        summary = await embedding_migration.migrate_embeddings("sface", batch_size=2)
+
+    assert summary == {
+        "model_version": "sface-2021dec",
+        "migrated": 2,
+        "failed": 1,
+        "remaining": 1,
+    }
+    assert [len(c.args[0]) for c in mock_encode.await_args_list] == [2, 1]
+    assert mock_encode.await_args.kwargs["encoder"] == "sface"
+
+    writes = mock_db.students.update_one.await_args_list
+    assert [w.args[0]["_id"] for w in writes] == [0, 2]
+    stored = writes[0].args[1]["$set"]["face_embeddings_by_model.sface-2021dec"]
+    assert unpack_embeddings(stored).shape == (1, 128)
+
+    checkpoints = [
+        c.args[1]["$set"]
+        for c in mock_db.embedding_migrations.update_one.await_args_list
+    ]
+    assert [c.get("last_id") for c in checkpoints[:2]] == [1, 2]
+    assert "completed_at" in checkpoints[-1]
+
+
+@pytest.mark.asyncio
+async def test_migration_resumes_after_checkpoint():
+    mock_db = _mock_db([], checkpoint={"last_id": 41, "migrated": 5, "failed": 1})
+
+    with patch.object(embedding_migration, "db", mock_db):
+        summary = await embedding_migration.migrate_embeddings("sface")
+
+    query = mock_db.students.find.call_args.args[0]
+    assert query["_id"] == {"$gt": 41}
+    assert summary["migrated"] == 5 and summary["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_migration_aborts_on_wrong_encoder_version():
+    mock_db = _mock_db([{"_id": 1, "image_url": "https://img/1"}])
+
+    with (
+        patch.object(embedding_migration, "db", mock_db),
+        patch.object(
+            embedding_migration, "_fetch_image", new=AsyncMock(return_value="img")
+        ),
+        patch.object(
+            embedding_migration.ml_client,
+            "encode_faces_batch",
+            new=AsyncMock(
+                return_value={
+                    "success": True,
+                    "model_version": "patch-96-v1",
+                    "results": [],
+                }
+            ),
+        ),
+    ):
+        with pytest.raises(RuntimeError):
+            await embedding_migration.migrate_embeddings("sface")
+
+    mock_db.students.update_one.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_migration_fails_before_any_batch_without_the_model(sface_info):
+    sface_info.return_value = {"success": False, "error_code": "MODEL_UNAVAILABLE"}
+    mock_db = _mock_db([{"_id": 1, "image_url": "https://img/1"}])
+
+    with patch.object(embedding_migration, "db", mock_db):
+        with pytest.raises(RuntimeError, match="MODEL_UNAVAILABLE"):
+            await embedding_migration.migrate_embeddings("sface")
+
+    mock_db.students.find.assert_not_called()
+    mock_db.embedding_migrations.update_one.assert_not_awaited()
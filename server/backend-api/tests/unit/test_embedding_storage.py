@@ -0,0 +1,44 @@
+import numpy as np
+from bson import BSON
+from bson.binary import Binary
+
+from app.utils.embedding_storage import (
+    SUBTYPE_F16,
+    SUBTYPE_F32,
+    embeddings_to_lists,
+    pack_embedding,
+    unpack_embeddings,
+)
+
+
+def test_packed_embeddings_round_trip_through_bson():
+    doc = {
+        "face_embeddings": [pack_embedding([0.5, -1.0]), pack_embedding([2.0, 0.25])]
+    }
+    decoded = BSON.encode(doc).decode()["face_embeddings"]
+
+    assert all(isinstance(e, Binary) and e.subtype == SUBTYPE_F32 for e in decoded)
+    matrix = unpack_embeddings(decoded)
+    assert matrix.dtype == np.float32
+    np.testing.assert_array_equal(matrix, [[0.5, -1.0], [2.0, 0.25]])
+
+
+def test_unpack_accepts_legacy_lists_and_f16():
+    f16 = pack_embedding([0.5, 1.5], "f16")
+    assert f16.subtype == SUBTYPE_F16
+    assert len(f16) == 4
+
+    matrix = unpack_embeddings([[0.25, 0.75], f16])
+    np.testing.assert_array_equal(matrix, [[0.25, 0.75], [0.5, 1.5]])
+    assert unpack_embeddings([]).shape == (0, 0)
+
+
+def test_pack_converts_between_formats():
+    f32 = pack_embedding([0.5, 1.5])
+    assert pack_embedding(f32) is f32
+    assert pack_embedding(f32, "f16").subtype == SUBTYPE_F16
+
+
+def test_embeddings_to_lists():
+    assert embeddings_to_lists([pack_embedding([0.5]), [1.0]]) == [[0.5], [1.0]]
+    assert embeddings_to_lists(None) == []
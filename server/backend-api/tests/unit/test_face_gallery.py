@@ -0,0 +1,47 @@
+from unittest.mock import patch
+
+import numpy as np
+
+from app.services.face_gallery import build_candidate_embeddings, gallery_version
+
+STUDENTS = [
+    {"userId": "u1", "face_embeddings": [[0.1, 0.2]]},
+    {
+        "userId": "u2",
+        "face_embeddings": [[0.3] * 128],
+        "face_embedding_model": "sface-2021dec",
+    },
+]
+
+
+def test_candidates_skip_other_encoder_embeddings():
+    with patch("app.services.face_gallery.ML_EMBEDDING_MODEL", "patch-96-v1"):
+        legacy = build_candidate_embeddings(STUDENTS)
+    with patch("app.services.face_gallery.ML_EMBEDDING_MODEL", "sface-2021dec"):
+        sface = build_candidate_embeddings(STUDENTS)
+
+    # Untagged documents predate the encoder tag and hold legacy embeddings
+    assert [c["student_id"] for c in legacy] == ["u1"]
+    assert [c["student_id"] for c in sface] == ["u2"]
+
+
+def test_gallery_version_changes_with_encoder():
+    with patch("app.services.face_gallery.ML_EMBEDDING_MODEL", "patch-96-v1"):
+        legacy = gallery_version(STUDENTS)
+    with patch("app.services.face_gallery.ML_EMBEDDING_MODEL", "sface-2021dec"):
+        sface = gallery_version(STUDENTS)
+
+    assert legacy != sface
+
+
+def test_candidates_use_migrated_embeddings():
+    migrated = {
+        "userId": "u1",
+        "face_embeddings": [[0.1, 0.2]],
+        "face_embeddings_by_model": {"sface-2021dec": [[0.5] * 128]},
+    }
+    with patch("app.services.face_gallery.ML_EMBEDDING_MODEL", "sface-2021dec"):
+        candidates = build_candidate_embeddings([migrated])
+
+    assert [c["student_id"] for c in candidates] == ["u1"]
+    np.testing.assert_array_equal(candidates[0]["embeddings"], [[0.5] * 128])
@@ -0,0 +1,37 @@
+from unittest.mock import patch
+
+from app.services import frame_rate
+from app.services.frame_rate import FrameRateAdvisor, TokenBucket
+
+
+def test_token_bucket_allows_burst_then_refills_at_rate():
+    bucket = TokenBucket(rate=2.0, burst=2)
+    bucket.take()
+    assert bucket.delay() == 0.0
+    bucket.take()
+    assert 0.45 < bucket.delay() <= 0.5
+
+
+def test_rate_falls_with_ml_queue_load():
+    advisor = FrameRateAdvisor()
+    with (
+        patch.object(frame_rate, "FRAME_MAX_FPS", 2.0),
+        patch.object(frame_rate, "FRAME_MIN_FPS", 0.25),
+        patch.object(frame_rate, "FRAME_LOAD_LOW", 0.5),
+        patch.object(frame_rate.ml_client, "queue_load", 0.2),
+    ):
+        assert advisor.recommended_fps() == 2.0
+        frame_rate.ml_client.queue_load = 0.75
+        assert advisor.recommended_fps() == 1.125
+        frame_rate.ml_client.queue_load = 1.0
+        assert advisor.recommended_fps() == 0.25
+
+
+def test_rate_is_capped_by_recognize_latency():
+    advisor = FrameRateAdvisor()
+    advisor.record_latency(4.0)
+    with (
+        patch.object(frame_rate.ml_client, "queue_load", 0.0),
+        patch.object(frame_rate, "FRAME_MAX_IN_FLIGHT", 2),
+    ):
+        assert advisor.recommended_fps() == 0.5
@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.services import gallery_cache
+
+SUBJECT_ID = ObjectId()
+PROFESSOR_ID = ObjectId()
+STUDENT_ID = ObjectId()
+
+
+def _cursor(docs):
+    cursor = MagicMock()
+    cursor.to_list = AsyncMock(return_value=docs)
+    return cursor
+
+
+def _mock_db():
+    mock_db = MagicMock()
+    mock_db.subjects.find_one = AsyncMock(
+        return_value={
+            "_id": SUBJECT_ID,
+            "professor_ids": [PROFESSOR_ID],
+            "students": [
+                {"student_id": STUDENT_ID, "verified": True},
+                {"student_id": ObjectId(), "verified": False},
+            ],
+        }
+    )
+    mock_db.students.find.return_value = _cursor(
+        [{"userId": STUDENT_ID, "face_embeddings": [[0.1, 0.2]]}]
+    )
+    mock_db.users.find.return_value = _cursor(
+        [{"_id": STUDENT_ID, "name": "Asha", "roll": "21"}]
+    )
+    return mock_db
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    gallery_cache.clear()
+    yield
+    gallery_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_gallery_is_loaded_once_and_served_from_cache():
+    mock_db = _mock_db()
+    with patch.object(gallery_cache, "db", mock_db):
+        first = await gallery_cache.get_gallery(str(SUBJECT_ID))
+        second = await gallery_cache.get_gallery(str(SUBJECT_ID))
+
+    assert first is second
+    mock_db.subjects.find_one.assert_awaited_once()
+    assert first.professor_ids == [PROFESSOR_ID]
+    assert [c["student_id"] for c in first.candidates] == [str(STUDENT_ID)]
+    assert first.roster[str(STUDENT_ID)] == {
+        "id": str(STUDENT_ID),
+        "name": "Asha",
+        "roll": "21",
+    }
+    # Only verified students are looked up
+    query = mock_db.students.find.call_args.args[0]
+    assert query["userId"] == {"$in": [STUDENT_ID]}
+
+
+@pytest.mark.asyncio
+async def test_invalidate_forces_reload():
+    mock_db = _mock_db()
+    with patch.object(gallery_cache, "db", mock_db):
+        await gallery_cache.get_gallery(str(SUBJECT_ID))
+        await gallery_cache.invalidate(SUBJECT_ID)
+        await gallery_cache.get_gallery(str(SUBJECT_ID))
+
+    assert mock_db.subjects.find_one.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    mock_db = _mock_db()
+    with patch.object(gallery_cache, "db", mock_db):
+        galleries = await asyncio.gather(
+            *(gallery_cache.get_gallery(str(SUBJECT_ID)) for _ in range(5))
+        )
+
+    assert all(g is galleries[0] for g in galleries)
+    mock_db.subjects.find_one.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_load_racing_an_invalidation_is_not_cached():
+    mock_db = _mock_db()
+    subject = mock_db.subjects.find_one.return_value
+
+    async def find_subject(*args):
+        # A write lands while the first roster read is in flight
+        if mock_db.subjects.find_one.await_count == 1:
+            await gallery_cache.invalidate(SUBJECT_ID)
+        return subject
+
+    mock_db.subjects.find_one = AsyncMock(side_effect=find_subject)
+    with patch.object(gallery_cache, "db", mock_db):
+        first = await gallery_cache.get_gallery(str(SUBJECT_ID))
+        second = await gallery_cache.get_gallery(str(SUBJECT_ID))
+
+    # The caller got the reloaded gallery, which is then served from cache
+    assert first is second
+    assert mock_db.subjects.find_one.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_miss_after_an_invalidation_does_not_join_the_stale_load():
+    mock_db = _mock_db()
+    subject = mock_db.subjects.find_one.return_value
+    release = asyncio.Event()
+
+    async def find_subject(*args):
+        if mock_db.subjects.find_one.await_count == 1:
+            await release.wait()
+        return subject
+
+    mock_db.subjects.find_one = AsyncMock(side_effect=find_subject)
+    with patch.object(gallery_cache, "db", mock_db):
+        stale = asyncio.ensure_future(gallery_cache.get_gallery(str(SUBJECT_ID)))
+        await asyncio.sleep(0)
+        await gallery_cache.invalidate(SUBJECT_ID)
+
+        fresh = await gallery_cache.get_gallery(str(SUBJECT_ID))
+        assert mock_db.subjects.find_one.await_count == 2
+        assert await gallery_cache.get_gallery(str(SUBJECT_ID)) is fresh
+
+        release.set()
+        await stale
+
+    # The load that started before the invalidation never replaces the cache
+    assert await gallery_cache.get_gallery(str(SUBJECT_ID)) is fresh
+
+
+@pytest.mark.asyncio
+async def test_unknown_subject_is_not_cached():
+    mock_db = _mock_db()
+    mock_db.subjects.find_one = AsyncMock(return_value=None)
+    with patch.object(gallery_cache, "db", mock_db):
+        assert await gallery_cache.get_gallery("not-an-id") is None
+        assert await gallery_cache.get_gallery(str(SUBJECT_ID)) is None
+        assert await gallery_cache.get_gallery(str(SUBJECT_ID)) is None
+
+    assert mock_db.subjects.find_one.await_count == 2
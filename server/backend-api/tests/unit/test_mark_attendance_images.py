@@ -0,0 +1,77 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from bson import ObjectId
+
+
+@pytest.mark.asyncio
+async def test_mark_attendance_images_returns_each_student_once():
+    from app.api.routes.attendance import _mark_attendance_images
+
+    student_oid = ObjectId()
+    students = [
+        {"userId": student_oid, "name": "Student 1", "face_embeddings": [[0.1, 0.2]]}
+    ]
+    mock_cursor = AsyncMock()
+    mock_cursor.to_list = AsyncMock(return_value=students)
+
+    match = {"student_id": str(student_oid), "distance": 0.2, "confidence": 0.8}
+    ml_response = {
+        "success": True,
+        "images": [
+            {
+                "image_index": 0,
+                "success": True,
+                "faces": [
+                    {"location": {"top": 1}, "is_live": True, "match": match},
+                    {"location": {"top": 2}, "is_live": False, "match": None},
+                ],
+            },
+            {
+                "image_index": 1,
+                "success": True,
+                "faces": [
+                    {
+                        "location": {"top": 3},
+                        "is_live": True,
+                        "match": {**match, "distance": 0.3},
+                        "duplicate": True,
+                    }
+                ],
+            },
+            {"image_index": 2, "success": False, "error": "Invalid image"},
+        ],
+    }
+
+    with (
+        patch("app.api.routes.attendance.db") as mock_db,
+        patch(
+            "app.api.routes.attendance.ml_client.detect_faces_batch",
+            new=AsyncMock(return_value=ml_response),
+        ) as mock_batch,
+    ):
+        mock_db.students.find.return_value = mock_cursor
+        users_cursor = AsyncMock()
+        users_cursor.to_list = AsyncMock(
+            return_value=[{"_id": student_oid, "roll": "R1"}]
+        )
+        mock_db.users.find.return_value = users_cursor
+
+        result = await _mark_attendance_images(
+            ["img0", "img1", "img2"], str(ObjectId()), [student_oid]
+        )
+
+    assert mock_batch.await_args.kwargs["images_base64"] == ["img0", "img1", "img2"]
+    # Display data of all matched students comes from one query
+    mock_db.users.find.assert_called_once()
+    assert mock_db.users.find.call_args.args[0] == {"_id": {"$in": [student_oid]}}
+    assert result["count"] == 2
+    present, spoof = result["faces"]
+    assert present["status"] == "present"
+    assert present["student"] == {
+        "id": str(student_oid),
+        "roll": "R1",
+        "name": "Student 1",
+    }
+    assert present["image_index"] == 0
+    assert spoof["status"] == "spoof"
+    assert spoof["student"] is None
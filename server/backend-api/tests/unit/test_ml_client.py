@@ -0,0 +1,227 @@
+import httpx
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from app.services.ml_client import MLClient
+from app.utils.embedding_codec import encode_embedding
+
+CANDIDATES = [{"student_id": "s1", "embeddings": [[0.1, 0.2]]}]
+
+
+@pytest.mark.asyncio
+async def test_match_faces_reregisters_gallery_on_miss():
+    client = MLClient()
+    responses = [
+        {"success": False, "error_code": "GALLERY_NOT_FOUND"},
+        {"success": True, "version": "v1"},
+        {"success": True, "match": {"student_id": "s1"}},
+    ]
+    with patch.object(
+        client, "_make_request", new=AsyncMock(side_effect=responses)
+    ) as mock_request:
+        result = await client.match_faces(
+            query_embedding=[0.1, 0.2],
+            candidate_embeddings=CANDIDATES,
+            gallery_id="subject:1",
+            gallery_version="v1",
+        )
+
+    assert result["match"]["student_id"] == "s1"
+    calls = mock_request.await_args_list
+    assert [c.args[1] for c in calls] == [
+        "/api/ml/match-faces",
+        "/api/ml/galleries",
+        "/api/ml/match-faces",
+    ]
+    # Candidates are only uploaded with the registration
+    assert "candidate_embeddings" not in calls[0].args[2]
+    assert calls[1].args[2]["candidate_embeddings"] == CANDIDATES
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_match_faces_uses_registered_gallery_on_hit():
+    client = MLClient()
+    with patch.object(
+        client,
+        "_make_request",
+        new=AsyncMock(return_value={"success": True, "match": None}),
+    ) as mock_request:
+        await client.batch_match(
+            detected_faces=[{"embedding": [0.1, 0.2]}],
+            candidate_embeddings=CANDIDATES,
+            gallery_id="subject:1",
+            gallery_version="v1",
+        )
+
+    mock_request.assert_awaited_once()
+    payload = mock_request.await_args.args[2]
+    assert payload["gallery_id"] == "subject:1"
+    assert "candidate_embeddings" not in payload
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_match_faces_inline_without_gallery_id():
+    client = MLClient()
+    with patch.object(
+        client,
+        "_make_request",
+        new=AsyncMock(return_value={"success": True, "match": None}),
+    ) as mock_request:
+        await client.match_faces(
+            query_embedding=[0.1, 0.2], candidate_embeddings=CANDIDATES
+        )
+
+    payload = mock_request.await_args.args[2]
+    assert payload["candidate_embeddings"] == CANDIDATES
+    assert "gallery_id" not in payload
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_candidates_are_packed_once_binary_format_is_negotiated():
+    client = MLClient()
+    client.embedding_format = "f32"
+    client.binary_embeddings = True
+    with patch.object(
+        client,
+        "_make_request",
+        new=AsyncMock(return_value={"success": True, "version": "v1"}),
+    ) as mock_request:
+        await client.register_gallery("subject:1", CANDIDATES)
+
+    payload = mock_request.await_args.args[2]
+    assert payload["candidate_embeddings"][0]["embeddings"][0].startswith("f32:")
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_encode_face_decodes_binary_embedding():
+    client = MLClient()
+    with patch.object(
+        client,
+        "_make_request",
+        new=AsyncMock(return_value={"success": True, "embedding": "f32:AACAPw=="}),
+    ):
+        result = await client.encode_face("image")
+
+    np.testing.assert_array_equal(result["embedding"], np.array([1.0], np.float32))
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_recognize_frame_references_gallery():
+    client = MLClient()
+    with patch.object(
+        client,
+        "_make_request",
+        new=AsyncMock(return_value={"success": True, "faces": [], "count": 0}),
+    ) as mock_request:
+        await client.recognize_frame(
+            image_base64="aGVsbG8=",
+            candidate_embeddings=CANDIDATES,
+            threshold=0.6,
+            gallery_id="subject:1",
+            gallery_version="v1",
+        )
+
+    mock_request.assert_awaited_once()
+    method, endpoint, payload = mock_request.await_args.args
+    assert endpoint == "/api/ml/recognize-frame"
+    assert payload["image_base64"] == "aGVsbG8="
+    assert payload["gallery_version"] == "v1"
+    assert "candidate_embeddings" not in payload
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_recognize_frame_bytes_sends_jpeg_body():
+    jpeg = b"\xff\xd8\xff\xe0 frame"
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"success": True, "faces": [], "count": 0})
+
+    client = MLClient()
+    client.api_key = "test-key"
+    client.client = httpx.AsyncClient(
+        base_url="http://ml", transport=httpx.MockTransport(handler)
+    )
+    await client.recognize_frame_bytes(
+        jpeg, CANDIDATES, gallery_id="subject:1", gallery_version="v1"
+    )
+
+    (request,) = requests
+    assert request.url.path == "/api/ml/recognize-frame/raw"
+    assert request.url.params["gallery_id"] == "subject:1"
+    assert request.url.params["gallery_version"] == "v1"
+    assert request.headers["Content-Type"] == "image/jpeg"
+    assert request.content == jpeg
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_detect_faces_batch_without_gallery_sends_images_only():
+    client = MLClient()
+    with patch.object(
+        client,
+        "_make_request",
+        new=AsyncMock(return_value={"success": True, "images": []}),
+    ) as mock_request:
+        await client.detect_faces_batch(images_base64=["a", "b"])
+
+    method, endpoint, payload = mock_request.await_args.args
+    assert endpoint == "/api/ml/detect-faces-batch"
+    assert payload["images"] == ["a", "b"]
+    assert "candidate_embeddings" not in payload
+    assert "gallery_id" not in payload
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_gallery_registration_is_tagged_with_encoder_version():
+    client = MLClient()
+    with (
+        patch.object(
+            client, "_make_request", new=AsyncMock(return_value={"success": True})
+        ) as mock_request,
+        patch("app.services.ml_client.ML_EMBEDDING_MODEL", "sface-2021dec"),
+    ):
+        await client.register_gallery("subject:1", CANDIDATES)
+
+    assert mock_request.await_args.args[2]["model_version"] == "sface-2021dec"
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_matrix_candidates_are_packed_or_listed():
+    matrix = [{"student_id": "s1", "embeddings": np.array([[0.5, 0.25]], np.float32)}]
+    client = MLClient()
+
+    client.embedding_format = "f32"
+    client.binary_embeddings = True
+    packed = client._encode_candidates(matrix)[0]["embeddings"]
+    assert packed == [encode_embedding([0.5, 0.25], "f32")]
+
+    # Until the ML service confirms the binary format, lists are sent
+    client.binary_embeddings = False
+    assert client._encode_candidates(matrix)[0]["embeddings"] == [[0.5, 0.25]]
+    await client.close()
+
+
+def test_queue_load_follows_ml_response_headers():
+    client = MLClient()
+    client._observe_load(
+        httpx.Response(200, headers={"X-Queue-Depth": "8", "X-Queue-Capacity": "32"})
+    )
+    assert client.queue_load == 0.25
+
+    client._observe_load(httpx.Response(503))
+    assert client.queue_load == 1.0
+
+    # Responses without the headers leave the last reading in place
+    client._observe_load(httpx.Response(200))
+    assert client.queue_load == 1.0
@@ -0,0 +1,273 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from unittest.mock import AsyncMock, patch
+
+from app.services import recognition_pipeline
+from app.services.frame_rate import FrameRateAdvisor, TokenBucket
+from app.services.gallery_cache import SubjectGallery
+from app.services.recognition_pipeline import Frame, RecognitionStream
+
+TEACHER = {"_id": ObjectId(), "role": "teacher"}
+STUDENT = {"id": "s1", "name": "Asha", "roll": "21"}
+
+GALLERY = SubjectGallery(
+    subject_id="subj",
+    professor_ids=[TEACHER["_id"]],
+    candidates=[],
+    version="v1",
+    roster={"s1": STUDENT},
+)
+
+
+def _ml_response(distance=0.1):
+    return {
+        "success": True,
+        "faces": [
+            {
+                "location": {"top": 0, "right": 1, "bottom": 1, "left": 0},
+                "is_live": True,
+                "match": {"student_id": "s1", "distance": distance, "confidence": 0.9},
+            }
+        ],
+    }
+
+
+def _frame(frame_id, user=TEACHER):
+    return Frame(
+        image="data:image/jpeg;base64,abc",
+        subject_id="subj",
+        user=user,
+        frame_id=frame_id,
+    )
+
+
+class FixedRate(FrameRateAdvisor):
+    def __init__(self, fps=1000.0):
+        super().__init__()
+        self.fps = fps
+
+    def recommended_fps(self):
+        return self.fps
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    async def __call__(self, event, payload):
+        self.events.append((event, payload))
+        if event in ("complete", "skipped", "error"):
+            self.expected -= 1
+            if self.expected <= 0:
+                self.done.set()
+
+    async def wait(self, count):
+        self.expected += count
+        if self.expected > 0:
+            self.done.clear()
+        await asyncio.wait_for(self.done.wait(), timeout=2)
+
+    def finished(self):
+        return [
+            (e, p.get("frame_id"), p.get("status"))
+            for e, p in self.events
+            if e in ("complete", "skipped")
+        ]
+
+
+@pytest.mark.asyncio
+async def test_frame_results_are_resolved_from_the_gallery():
+    recorder = Recorder()
+    stream = RecognitionStream(recorder, advisor=FixedRate())
+
+    with (
+        patch.object(
+            recognition_pipeline, "get_gallery", new=AsyncMock(return_value=GALLERY)
+        ),
+        patch.object(
+            recognition_pipeline.ml_client,
+            "recognize_frame",
+            new=AsyncMock(return_value=_ml_response()),
+        ) as mock_recognize,
+    ):
+        await stream.submit(_frame(1))
+        await recorder.wait(1)
+        await stream.close()
+
+    assert [e for e, _ in recorder.events] == [
+        "frame_rate",
+        "processing_started",
+        "match_update",
+        "complete",
+    ]
+    assert mock_recognize.await_args.kwargs["image_base64"] == "abc"
+    assert mock_recognize.await_args.kwargs["gallery_id"] == "subject:subj"
+    # Faces are tracked across the frames of one stream
+    assert mock_recognize.await_args.kwargs["session_id"] == stream.session_id
+    # Thresholds are similarities: every uncertain match comes back, and
+    # only confident ones confirm a student for the session
+    kwargs = mock_recognize.await_args.kwargs
+    assert kwargs["threshold"] == pytest.approx(
+        1 - recognition_pipeline.ML_UNCERTAIN_THRESHOLD
+    )
+    assert kwargs["confirm_threshold"] >= kwargs["threshold"]
+    assert kwargs["confirm_threshold"] == pytest.approx(
+        1 - recognition_pipeline.ML_CONFIDENT_THRESHOLD
+    )
+    complete = recorder.events[-1][1]
+    assert complete["matched"][0]["student"] == STUDENT
+    assert complete["frame_id"] == 1
+    assert {"decode", "gallery", "recognize", "resolve"} <= set(complete["timings"])
+
+
+@pytest.mark.asyncio
+async def test_binary_frame_is_sent_without_base64():
+    recorder = Recorder()
+    stream = RecognitionStream(recorder, advisor=FixedRate())
+    jpeg = b"\xff\xd8\xff\xe0 frame"
+
+    with (
+        patch.object(
+            recognition_pipeline, "get_gallery", new=AsyncMock(return_value=GALLERY)
+        ),
+        patch.object(
+            recognition_pipeline.ml_client, "recognize_frame", new=AsyncMock()
+        ) as mock_b64,
+        patch.object(
+            recognition_pipeline.ml_client,
+            "recognize_frame_bytes",
+            new=AsyncMock(return_value=_ml_response()),
+        ) as mock_bytes,
+    ):
+        await stream.submit(Frame(image=jpeg, subject_id="subj", user=TEACHER))
+        await recorder.wait(1)
+        await stream.close()
+
+    mock_b64.assert_not_awaited()
+    assert mock_bytes.await_args.args[0] is jpeg
+    assert mock_bytes.await_args.kwargs["gallery_id"] == "subject:subj"
+    assert recorder.events[-1][1]["matched"][0]["student"] == STUDENT
+
+
+@pytest.mark.asyncio
+async def test_queued_frame_is_replaced_by_newer_one():
+    recorder = Recorder()
+    stream = RecognitionStream(recorder, max_in_flight=1, advisor=FixedRate())
+    release = asyncio.Event()
+
+    async def recognize(**kwargs):
+        await release.wait()
+        return _ml_response()
+
+    with (
+        patch.object(
+            recognition_pipeline, "get_gallery", new=AsyncMock(return_value=GALLERY)
+        ),
+        patch.object(recognition_pipeline.ml_client, "recognize_frame", new=recognize),
+    ):
+        await stream.submit(_frame(1))
+        await asyncio.sleep(0)  # frame 1 takes the only slot
+        await stream.submit(_frame(2))
+        await stream.submit(_frame(3))
+        release.set()
+        await recorder.wait(3)
+        await stream.close()
+
+    assert recorder.finished() == [
+        ("skipped", 2, "superseded"),
+        ("complete", 1, "complete"),
+        ("complete", 3, "complete"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_frame_finishing_after_a_newer_one_is_dropped():
+    recorder = Recorder()
+    stream = RecognitionStream(recorder, max_in_flight=2, advisor=FixedRate())
+    slow = asyncio.Event()
+
+    async def recognize(**kwargs):
+        if not slow.is_set():
+            slow.set()
+            await asyncio.sleep(0.05)
+        return _ml_response()
+
+    with (
+        patch.object(
+            recognition_pipeline, "get_gallery", new=AsyncMock(return_value=GALLERY)
+        ),
+        patch.object(recognition_pipeline.ml_client, "recognize_frame", new=recognize),
+    ):
+        await stream.submit(_frame(1))
+        await asyncio.sleep(0.01)
+        await stream.submit(_frame(2))
+        await recorder.wait(2)
+        await stream.close()
+
+    assert recorder.finished() == [
+        ("complete", 2, "complete"),
+        ("skipped", 1, "superseded"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_teacher_of_another_subject_is_rejected():
+    recorder = Recorder()
+    stream = RecognitionStream(recorder, advisor=FixedRate())
+    outsider = {"_id": ObjectId(), "role": "teacher"}
+
+    with (
+        patch.object(
+            recognition_pipeline, "get_gallery", new=AsyncMock(return_value=GALLERY)
+        ),
+        patch.object(
+            recognition_pipeline.ml_client, "recognize_frame", new=AsyncMock()
+        ) as mock_recognize,
+    ):
+        await stream.submit(_frame(1, user=outsider))
+        await recorder.wait(1)
+        await stream.close()
+
+    assert recorder.events[1:] == [
+        ("error", {"code": "forbidden", "message": "Forbidden", "frame_id": 1})
+    ]
+    mock_recognize.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_frames_are_paced_by_the_recommended_rate():
+    recorder = Recorder()
+    advisor = FixedRate(fps=20.0)
+    stream = RecognitionStream(recorder, max_in_flight=4, advisor=advisor)
+    stream._bucket = TokenBucket(rate=20.0, burst=1)
+
+    with (
+        patch.object(
+            recognition_pipeline, "get_gallery", new=AsyncMock(return_value=GALLERY)
+        ),
+        patch.object(
+            recognition_pipeline.ml_client,
+            "recognize_frame",
+            new=AsyncMock(return_value=_ml_response()),
+        ),
+    ):
+        start = asyncio.get_running_loop().time()
+        for frame_id in range(3):
+            await stream.submit(_frame(frame_id))
+            await recorder.wait(1)
+        elapsed = asyncio.get_running_loop().time() - start
+
+        # A busier ML service lowers the rate and clients are told so
+        advisor.fps = 5.0
+        for frame_id in (3, 4):
+            await stream.submit(_frame(frame_id))
+            await recorder.wait(1)
+        await stream.close()
+
+    assert elapsed >= 0.09
+    rates = [p["fps"] for e, p in recorder.events if e == "frame_rate"]
+    assert rates == [20.0, 5.0]
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock
+
+from app.services.scan_broadcaster import ScanBroadcaster
+
+
+@pytest.mark.asyncio
+async def test_scans_within_the_window_are_sent_as_one_batch():
+    emit = AsyncMock()
+    broadcaster = ScanBroadcaster(emit, window_seconds=0.05)
+
+    for n in range(3):
+        await broadcaster.publish("room", {"n": n})
+    await broadcaster.publish("other", {"n": 9})
+    emit.assert_not_awaited()
+
+    await asyncio.sleep(0.1)
+
+    sent = {call.kwargs["room"]: call.args for call in emit.await_args_list}
+    assert sent == {
+        "room": ("students_scanned", {"scans": [{"n": 0}, {"n": 1}, {"n": 2}]}),
+        "other": ("students_scanned", {"scans": [{"n": 9}]}),
+    }
+
+
+@pytest.mark.asyncio
+async def test_flush_sends_the_pending_batch_right_away():
+    emit = AsyncMock()
+    broadcaster = ScanBroadcaster(emit, window_seconds=10)
+
+    await broadcaster.publish("room", {"n": 0})
+    await broadcaster.flush("room")
+    await broadcaster.flush("room")
+
+    emit.assert_awaited_once_with(
+        "students_scanned", {"scans": [{"n": 0}]}, room="room"
+    )
+
+
+@pytest.mark.asyncio
+async def test_zero_window_sends_each_scan_immediately():
+    emit = AsyncMock()
+    broadcaster = ScanBroadcaster(emit, window_seconds=0)
+
+    await broadcaster.publish("room", {"n": 0})
+
+    emit.assert_awaited_once_with(
+        "students_scanned", {"scans": [{"n": 0}]}, room="room"
+    )
@@ -0,0 +1,367 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from bson import ObjectId
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.services import attendance_socket_service as socket_service
+from app.services.session_state import SESSION_ENDED, MemorySessionState, ScanJournal
+
+STUDENT_ID = str(ObjectId())
+SUBJECT_ID = str(ObjectId())
+
+
+def _scan(student_id, **extra):
+    return {"studentId": student_id, **extra}
+
+
+@pytest.mark.asyncio
+async def test_duplicate_scans_are_not_buffered():
+    state = MemorySessionState()
+    assert await state.add_scan("s", _scan("a", n=1)) == 1
+    assert await state.add_scan("s", _scan("a", n=2)) == 0
+    assert await state.get_pending("s") == [_scan("a", n=1)]
+
+
+@pytest.mark.asyncio
+async def test_lecture_burst_keeps_first_scan_of_each_student():
+    state = MemorySessionState()
+    students = [str(i) for i in range(300)]
+    counts = [await state.add_scan("s", _scan(sid)) for sid in students]
+    repeats = [await state.add_scan("s", _scan(sid, again=True)) for sid in students]
+
+    assert counts == list(range(1, 301))
+    assert set(repeats) == {0}
+    assert [scan["studentId"] for scan in await state.get_pending("s")] == students
+
+
+@pytest.mark.asyncio
+async def test_flush_watermark_keeps_newer_scans_pending():
+    state = MemorySessionState()
+    await state.add_scan("s", _scan("a"))
+    flushed = await state.get_pending("s")
+    await state.add_scan("s", _scan("b"))
+
+    await state.mark_flushed("s", len(flushed))
+
+    assert await state.get_pending("s") == [_scan("b")]
+    assert (await state.pending_stats("s"))[0] == 1
+    # Flushed students still count as scanned
+    assert await state.add_scan("s", _scan("a")) == 0
+
+
+@pytest.mark.asyncio
+async def test_journal_restores_unsaved_scans(tmp_path):
+    journal = tmp_path / "scans.jsonl"
+    state = MemorySessionState(journal_path=str(journal))
+    await state.join("s", {"lat": 1.0, "lon": 2.0, "subjectId": SUBJECT_ID})
+    await state.add_scan("s", _scan("a"))
+    await state.add_scan("s", _scan("a"))  # duplicates are not journaled
+    await state.add_scan("s", _scan("b"))
+    await state.mark_flushed("s", 1)
+    await state.add_scan("s", _scan("c"))
+    # A line cut short when the process was killed
+    with open(journal, "a") as f:
+        f.write('{"op": "scan", "sess')
+    await state.close()
+
+    restarted = MemorySessionState(journal_path=str(journal))
+    assert await restarted.restore() == 2
+    assert await restarted.get_pending("s") == [_scan("b"), _scan("c")]
+    assert (await restarted.get_location("s"))["subjectId"] == SUBJECT_ID
+    assert await restarted.add_scan("s", _scan("a")) == 0
+
+
+@pytest.mark.asyncio
+async def test_ended_session_rejects_scans_across_restarts(tmp_path):
+    journal = tmp_path / "scans.jsonl"
+    state = MemorySessionState(journal_path=str(journal))
+    await state.add_scan("s", _scan("a"))
+    await state.mark_ended("s")
+
+    assert await state.add_scan("s", _scan("b")) == SESSION_ENDED
+    # Scans accepted before the end are still flushed
+    assert await state.get_pending("s") == [_scan("a")]
+    await state.close()
+
+    restarted = MemorySessionState(journal_path=str(journal))
+    assert await restarted.restore() == 1
+    assert await restarted.is_ended("s")
+    await restarted.end("s")
+    assert await restarted.add_scan("s", _scan("b")) == SESSION_ENDED
+    assert await restarted.session_ids() == []
+
+
+@pytest.mark.asyncio
+async def test_journal_is_truncated_once_everything_is_saved(tmp_path):
+    journal = tmp_path / "scans.jsonl"
+    state = MemorySessionState(journal_path=str(journal))
+    await state.add_scan("s", _scan("a"))
+    assert journal.read_text()
+
+    await state.mark_flushed("s", 1)
+    await state.end("s")
+
+    assert journal.read_text() == ""
+    await state.close()
+    assert await MemorySessionState(journal_path=str(journal)).restore() == 0
+
+
+@pytest.mark.asyncio
+async def test_workers_keep_separate_journals_replayed_once(tmp_path):
+    journal = tmp_path / "scans.jsonl"
+    workers = [MemorySessionState(journal_path=str(journal)) for _ in range(2)]
+    for worker, student in zip(workers, "ab"):
+        await worker.add_scan(student, _scan(student))
+    # A flush on one worker does not drop the other's unsaved scans
+    await workers[0].mark_flushed("a", 1)
+    await workers[0].end("a")
+    await workers[1].add_scan("c", _scan("c"))
+    for worker in workers:
+        await worker.close()
+
+    restarted = [MemorySessionState(journal_path=str(journal)) for _ in range(2)]
+    # The first to start takes over every journal left, the next none
+    assert await restarted[0].restore() == 2
+    assert await restarted[1].restore() == 0
+    assert sorted(await restarted[0].session_ids()) == ["b", "c"]
+    for worker in restarted:
+        await worker.close()
+
+
+@pytest.mark.asyncio
+async def test_journal_is_written_off_the_event_loop(tmp_path):
+    state = MemorySessionState(journal_path=str(tmp_path / "scans.jsonl"))
+    threads = []
+    append = ScanJournal.append
+
+    def recording_append(journal, record):
+        threads.append(threading.current_thread())
+        append(journal, record)
+
+    with patch.object(ScanJournal, "append", recording_append):
+        await state.add_scan("s", _scan("a"))
+    await state.close()
+
+    assert threads and threading.main_thread() not in threads
+
+
+@pytest.mark.asyncio
+async def test_flush_lock_admits_one_flusher():
+    state = MemorySessionState()
+    async with state.flush_lock("s") as first:
+        async with state.flush_lock("s") as second:
+            assert (first, second) == (True, False)
+    async with state.flush_lock("s") as again:
+        assert again is True
+
+
+@pytest.mark.asyncio
+async def test_scans_are_buffered_and_saved_through_session_state():
+    state = MemorySessionState()
+    mock_db = MagicMock()
+    mock_db.subjects.bulk_write = AsyncMock()
+    mock_db.subjects.find_one = AsyncMock(return_value=None)
+    mock_db.students.find_one = AsyncMock(return_value={"name": "Asha", "roll": "21"})
+
+    sio = socket_service.sio
+    with (
+        patch.object(socket_service, "session_state", state),
+        patch.object(socket_service, "db", mock_db),
+        patch.object(sio, "emit", new=AsyncMock()) as mock_emit,
+        patch.object(sio, "enter_room", new=AsyncMock()),
+        patch.object(
+            socket_service, "log_grouped_attendance", new=AsyncMock(return_value=None)
+        ),
+    ):
+        await socket_service.handle_join_session(
+            "teacher", {"sessionId": "s", "subjectId": SUBJECT_ID}
+        )
+        for _ in range(2):
+            await socket_service.handle_scan_qr(
+                "student", {"sessionId": "s", "studentId": STUDENT_ID}
+            )
+        result = await socket_service.stop_and_save_session("s")
+
+    # The duplicate scan is not broadcast; the teacher gets the student the
+    # same way as from the /attendance/qr route
+    broadcast = [
+        scan
+        for call in mock_emit.await_args_list
+        if call.args[0] == "students_scanned"
+        for scan in call.args[1]["scans"]
+    ]
+    assert [scan["student"] for scan in broadcast] == [
+        {"name": "Asha", "roll": "21", "id": STUDENT_ID}
+    ]
+    assert broadcast[0]["is_proxy_suspected"] is False
+    assert len(mock_db.subjects.bulk_write.await_args.args[0]) == 1
+    assert result["details"] == "Saved 1 records."
+    assert await state.session_ids() == []
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_is_flushed_once_and_incrementally():
+    state = MemorySessionState()
+    mock_db = MagicMock()
+    mock_db.subjects.bulk_write = AsyncMock()
+    mock_db.subjects.find_one = AsyncMock(return_value=None)
+    mock_db.students.find_one = AsyncMock(return_value=None)
+    students = [str(ObjectId()) for _ in range(3)]
+
+    sio = socket_service.sio
+    with (
+        patch.object(socket_service, "session_state", state),
+        patch.object(socket_service, "db", mock_db),
+        patch.object(sio, "emit", new=AsyncMock()),
+        patch.object(sio, "enter_room", new=AsyncMock()),
+        patch.object(
+            socket_service, "log_grouped_attendance", new=AsyncMock(return_value=None)
+        ),
+        patch.object(socket_service, "ATTENDANCE_FLUSH_BATCH_SIZE", 2),
+    ):
+        await socket_service.handle_join_session(
+            "teacher", {"sessionId": "s", "subjectId": SUBJECT_ID}
+        )
+        for student_id in students[:2]:
+            await socket_service.handle_scan_qr(
+                "student", {"sessionId": "s", "studentId": student_id}
+            )
+        # The second scan filled the buffer and started a flush
+        await socket_service._flush_tasks["s"]
+        await socket_service.handle_scan_qr(
+            "student", {"sessionId": "s", "studentId": students[2]}
+        )
+        result = await socket_service.stop_and_save_session("s")
+
+    batches = [call.args[0] for call in mock_db.subjects.bulk_write.await_args_list]
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert result["details"] == "Saved 1 records."
+    # The subject is read once per session, not once per flush
+    mock_db.subjects.find_one.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_failed_save_keeps_the_session_until_a_scheduled_flush():
+    state = MemorySessionState()
+    await state.join("s", {"lat": 0.0, "lon": 0.0, "subjectId": SUBJECT_ID})
+    await state.add_scan("s", _scan(STUDENT_ID))
+
+    with (
+        patch.object(socket_service, "session_state", state),
+        patch.object(
+            socket_service,
+            "_save_scans",
+            new=AsyncMock(side_effect=RuntimeError("down")),
+        ),
+    ):
+        result = await socket_service.stop_and_save_session("s")
+
+    assert result["message"] == "Session closing"
+    assert (await state.pending_stats("s"))[0] == 1
+
+    with (
+        patch.object(socket_service, "session_state", state),
+        patch.object(
+            socket_service, "_save_scans", new=AsyncMock(return_value=1)
+        ) as mock_save,
+    ):
+        # Not due by size or age, but the session is waiting to close
+        await socket_service.flush_attendance_data()
+
+    mock_save.assert_awaited_once()
+    assert await state.session_ids() == []
+
+
+@pytest.mark.asyncio
+async def test_end_hands_a_locked_flush_to_the_scheduled_flush():
+    state = MemorySessionState()
+    await state.join("s", {"lat": 0.0, "lon": 0.0, "subjectId": SUBJECT_ID})
+    await state.add_scan("s", _scan(STUDENT_ID))
+
+    with (
+        patch.object(socket_service, "session_state", state),
+        patch.object(
+            socket_service, "_save_scans", new=AsyncMock(return_value=1)
+        ) as mock_save,
+    ):
+        # Another worker holds the lock when the session ends
+        lock = state.flush_lock("s")
+        assert await lock.__aenter__() is True
+        result = await asyncio.wait_for(
+            socket_service.stop_and_save_session("s"), timeout=0.1
+        )
+        assert result["message"] == "Session closing"
+        mock_save.assert_not_awaited()
+
+        await lock.__aexit__(None, None, None)
+        await socket_service.flush_attendance_data()
+
+    mock_save.assert_awaited_once()
+    assert await state.session_ids() == []
+
+
+@pytest.mark.asyncio
+async def test_scan_after_the_end_is_rejected():
+    state = MemorySessionState()
+    mock_db = MagicMock()
+    mock_db.subjects.bulk_write = AsyncMock()
+
+    sio = socket_service.sio
+    with (
+        patch.object(socket_service, "session_state", state),
+        patch.object(socket_service, "db", mock_db),
+        patch.object(sio, "emit", new=AsyncMock()) as mock_emit,
+        patch.object(sio, "enter_room", new=AsyncMock()),
+    ):
+        await socket_service.handle_join_session(
+            "teacher", {"sessionId": "s", "subjectId": SUBJECT_ID}
+        )
+        await socket_service.stop_and_save_session("s")
+        await socket_service.handle_scan_qr(
+            "student", {"sessionId": "s", "studentId": STUDENT_ID}
+        )
+
+    mock_emit.assert_any_await(
+        "scan_error", {"message": "Session has ended"}, room="student"
+    )
+    assert await state.session_ids() == []
+    mock_db.subjects.bulk_write.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_scheduled_flush_drops_subjects_of_sessions_closed_elsewhere():
+    state = MemorySessionState()
+    await state.join("open", {"lat": 0.0, "lon": 0.0, "subjectId": SUBJECT_ID})
+
+    with (
+        patch.object(socket_service, "session_state", state),
+        patch.dict(
+            socket_service._session_subjects, {"open": (None, 1), "closed": (None, 1)}
+        ),
+    ):
+        await socket_service.flush_attendance_data()
+        assert set(socket_service._session_subjects) == {"open"}
+
+
+@pytest.mark.asyncio
+async def test_scheduled_flush_only_takes_due_sessions():
+    state = MemorySessionState()
+    for session_id in ("old", "new"):
+        await state.join(session_id, {"lat": 0.0, "lon": 0.0, "subjectId": SUBJECT_ID})
+        await state.add_scan(session_id, _scan(STUDENT_ID))
+    state._pending_since["old"] = time.time() - 3600
+
+    with (
+        patch.object(socket_service, "session_state", state),
+        patch.object(
+            socket_service, "_save_scans", new=AsyncMock(return_value=1)
+        ) as mock_save,
+    ):
+        await socket_service.flush_attendance_data()
+
+    assert [call.args[0] for call in mock_save.await_args_list] == ["old"]
+    assert await state.pending_stats("old") == (0, None)
+    assert (await state.pending_stats("new"))[0] == 1
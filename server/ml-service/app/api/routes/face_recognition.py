@@ -1,15 +1,26 @@
-from fastapi import APIRouter, Depends
+import asyncio
+from fastapi import APIRouter, Depends, Query, Request, Response
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 import time
 import numpy as np
 
 from app.schemas.requests import (
     EncodeFaceRequest,
+    EncodeFacesBatchRequest,
     DetectFacesRequest,
     MatchFacesRequest,
     BatchMatchRequest,
+    GalleryReference,
+    DetectionOptions,
+    RegisterGalleryRequest,
+    RecognizeFrameOptions,
+    RecognizeFrameRequest,
+    DetectFacesBatchRequest,
 )
 from app.schemas.responses import (
     EncodeFaceResponse,
+    EncodeFacesBatchResponse,
+    EncoderInfoResponse,
     DetectFacesResponse,
     MatchFacesResponse,
     BatchMatchResponse,
@@ -20,19 +31,49 @@ from app.schemas.responses import (
     MatchResult,
     DistanceInfo,
     BatchMatchResult,
+    RegisterGalleryResponse,
+    InvalidateGalleryResponse,
+    TrackedFace,
+    RecognizeFrameResponse,
+    BatchDetectedFace,
+    ImageDetectionResult,
+    StudentSighting,
+    DetectFacesBatchResponse,
 )
 from app.core.constants import (
     ERROR_NO_FACE,
     ERROR_MULTIPLE_FACES,
     ERROR_FACE_TOO_SMALL,
     ERROR_PROCESSING,
+    ERROR_GALLERY_NOT_FOUND,
+    ERROR_MODEL_MISMATCH,
+    ERROR_MODEL_UNAVAILABLE,
+    TILED_MODEL,
 )
+from app.core.batcher import MicroBatcher
+from app.core.executor import stage_executor
+from app.core.exceptions import ServiceOverloadedError
 from app.core.security import verify_api_key
-from app.utils.image_validation import validate_and_decode_image, validate_and_decode_image_to_numpy
+from app.utils.image_validation import (
+    decode_image_bytes_to_numpy,
+    validate_and_decode_image_to_numpy,
+)
+from app.utils.embedding_codec import (
+    EMBEDDING_FORMAT_HEADER,
+    encode_embedding,
+    get_embedding_format,
+)
 
-from app.ml.face_detector import detect_faces
-from app.ml.face_encoder import get_face_embedding
-from app.ml.face_matcher import cosine_similarity
+from app.ml.face_detector import (
+    detect_faces,
+    detect_tile,
+    non_max_suppression,
+    tile_origins,
+)
+from app.ml.face_encoder import get_encoder, get_face_embeddings
+from app.ml.face_matcher import Gallery
+from app.ml.face_tracker import match_tracks, tracker_store
+from app.ml.gallery_store import gallery_store, gallery_content_hash
 from app.ml.liveness import is_live
 from app.core.config import settings
 
@@ -41,135 +82,559 @@ router = APIRouter(
 )
 
 
-@router.post("/encode-face", response_model=EncodeFaceResponse)
-async def encode_face(request: EncodeFaceRequest):
-    try:
-        # Validate and decode image directly to NumPy array (more efficient)
-        success, _image_bytes, image_np, error_msg, error_code = validate_and_decode_image_to_numpy(
-            request.image_base64
+def _resolve_gallery(request: GalleryReference) -> Optional[Gallery]:
+    """
+    Return the gallery a match request refers to.
+
+    A registered gallery_id takes precedence over inline candidates. Returns
+    None when the referenced gallery is unknown, expired or at another version.
+    """
+    if request.gallery_id:
+        return gallery_store.get(request.gallery_id, request.gallery_version)
+    if request.candidate_embeddings is None:
+        raise ValueError("Either candidate_embeddings or gallery_id is required")
+    gallery = Gallery.from_candidates(
+        (c.student_id, c.embeddings) for c in request.candidate_embeddings
+    )
+    gallery.model_version = request.model_version
+    return gallery
+
+
+def _encoder_mismatch(gallery: Gallery, queries: Sequence[Any] = ()) -> bool:
+    """
+    True if the gallery is tagged with another encoder than the active one,
+    or if its embeddings differ in length from the given query embeddings.
+    """
+    if (
+        gallery.model_version is not None
+        and gallery.model_version != get_encoder().model_version
+    ):
+        return True
+    return bool(len(gallery)) and any(
+        len(query) != gallery.dimension for query in queries
+    )
+
+
+def _tiling_for(
+    request: DetectionOptions,
+) -> Optional[Tuple[int, float]]:
+    """Tile size and overlap for a tiled-detection request, else None."""
+    if request.model != TILED_MODEL:
+        return None
+    return (
+        request.tile_size or settings.ML_TILE_SIZE,
+        request.tile_overlap
+        if request.tile_overlap is not None
+        else settings.ML_TILE_OVERLAP,
+    )
+
+
+def _decode_image(image: Union[str, bytes]) -> tuple:
+    """Decode a base64 string or raw encoded bytes to a NumPy array."""
+    # Validate and decode image directly to NumPy array (more efficient)
+    if isinstance(image, str):
+        return validate_and_decode_image_to_numpy(image)
+    return decode_image_bytes_to_numpy(image)
+
+
+async def _locate_tiled(
+    image: Union[str, bytes], tiling: Tuple[int, float]
+) -> Union[Dict[str, Any], Tuple[np.ndarray, List[Tuple[int, int, int, int]]]]:
+    """
+    Decode the image and detect faces tile by tile on the stage executor.
+
+    Every tile is its own "detect" call, so tiles run in parallel and count
+    against the queue depth limit like any other work. At most
+    ``thread_workers`` tiles of one image are in flight, so a large photo
+    does not take the whole queue. Returns the image and the merged boxes,
+    or an error dict.
+    """
+    decoded = await stage_executor.run("detect", _decode_image, image)
+    success, _image_bytes, image_np, error_msg, error_code = decoded
+    if not success:
+        return {"error": error_msg, "error_code": error_code}
+
+    tile_size, overlap = tiling
+    origins = tile_origins(image_np.shape, tile_size, overlap)
+    if len(origins) == 1:
+        faces = await stage_executor.run("detect", detect_faces, image_np, 0)
+        return image_np, faces
+
+    slots = asyncio.Semaphore(stage_executor.thread_workers)
+
+    async def detect_at(y: int, x: int):
+        async with slots:
+            return await stage_executor.run(
+                "detect",
+                detect_tile,
+                image_np[y : y + tile_size, x : x + tile_size],
+                (y, x),
+            )
+
+    per_tile = await asyncio.gather(*(detect_at(y, x) for y, x in origins))
+    return image_np, non_max_suppression(
+        [detection for detections in per_tile for detection in detections]
+    )
+
+
+def _prepare_encode(
+    image_base64: str, validate_single: bool, min_face_area_ratio: float
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[np.ndarray]]:
+    """Decode the image and locate its single face for encoding."""
+    # Validate and decode image directly to NumPy array (more efficient)
+    decoded = validate_and_decode_image_to_numpy(image_base64)
+    success, _image_bytes, image_np, error_msg, error_code = decoded
+
+    if not success:
+        return {"error": error_msg, "error_code": error_code}, [], []
+
+    faces = detect_faces(image_np)
+
+    if not faces:
+        return {"error": "No face detected", "error_code": ERROR_NO_FACE}, [], []
+
+    if validate_single and len(faces) > 1:
+        return (
+            {"error": "Multiple faces detected", "error_code": ERROR_MULTIPLE_FACES},
+            [],
+            [],
         )
 
+    top, right, bottom, left = faces[0]
+
+    face_w = right - left
+    face_h = bottom - top
+
+    im_h, im_w, _ = image_np.shape
+    face_area = face_w * face_h
+    image_area = im_h * im_w
+
+    if (face_area / image_area) < min_face_area_ratio:
+        return {"error": "Face too small", "error_code": ERROR_FACE_TOO_SMALL}, [], []
+
+    result = {
+        "location": (top, right, bottom, left),
+        "face_area_ratio": face_area / image_area,
+        "image_dimensions": [im_w, im_h],
+    }
+    return result, [result], [image_np[top:bottom, left:right]]
+
+
+def _prepare_detect(
+    image: Union[str, bytes, np.ndarray],
+    min_face_area_ratio: float,
+    check_liveness: bool,
+    faces: Optional[List[Tuple[int, int, int, int]]] = None,
+    tracks: Sequence[Tuple[int, Tuple[int, int, int, int]]] = (),
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]], List[np.ndarray]]:
+    """
+    Decode the image, given as a base64 string or as raw encoded bytes, then
+    detect and liveness-check every face.
+
+    An already decoded image may be passed with its ``faces`` located by
+    tiled detection. Faces continuing one of ``tracks`` (track_id, box) get
+    that ``track_id`` and are neither liveness-checked nor cropped for
+    embedding.
+    """
+    if isinstance(image, np.ndarray):
+        image_np = image
+    else:
+        decoded = _decode_image(image)
+        success, _image_bytes, image_np, error_msg, error_code = decoded
         if not success:
-            return EncodeFaceResponse(
-                success=False, error=error_msg, error_code=error_code
+            return {"error": error_msg, "error_code": error_code}, [], []
+
+    if faces is None:
+        faces = detect_faces(image_np)
+    h, w, _ = image_np.shape
+    image_area = h * w
+
+    located = []
+    for face_tuple in faces:
+        # faces detected are already in (top, right, bottom, left) format
+        top, right, bottom, left = face_tuple
+
+        face_width = right - left
+        face_height = bottom - top
+        face_area = face_width * face_height
+
+        if face_area / image_area < min_face_area_ratio:
+            continue
+
+        # Ensure coordinates are within image bounds
+        top = max(0, top)
+        left = max(0, left)
+        bottom = min(h, bottom)
+        right = min(w, right)
+
+        located.append(
+            {
+                "location": (top, right, bottom, left),
+                "face_area_ratio": face_area / image_area,
+            }
+        )
+
+    tracked = match_tracks(
+        [face["location"] for face in located],
+        tracks,
+        settings.ML_TRACK_IOU_THRESHOLD,
+    )
+
+    detected = []
+    crops = []
+    for i, face in enumerate(located):
+        if i in tracked:
+            face["track_id"] = tracked[i]
+            continue
+
+        top, right, bottom, left = face["location"]
+        face_img = image_np[top:bottom, left:right]
+
+        # Liveness Check
+        live = True
+        if check_liveness:
+            live = is_live(face_img)
+
+        face["is_live"] = live
+        detected.append(face)
+        crops.append(face_img)
+
+    return {"faces": located, "image_dimensions": [w, h]}, detected, crops
+
+
+def _embed_batch(jobs: List[Tuple[List[np.ndarray], int]]) -> List[Any]:
+    """
+    Embed a micro-batch of (crops, num_jitters) jobs on the stage executor.
+
+    The crops of all jobs with the same jitter count are embedded in one
+    pass; each job gets back the embeddings of its own crops, in order.
+    """
+    crops_by_jitters: Dict[int, List[np.ndarray]] = {}
+    for crops, num_jitters in jobs:
+        crops_by_jitters.setdefault(num_jitters, []).extend(crops)
+    embeddings = {
+        num_jitters: iter(get_face_embeddings(crops, num_jitters))
+        for num_jitters, crops in crops_by_jitters.items()
+    }
+    return [
+        [next(embeddings[num_jitters]) for _ in crops] for crops, num_jitters in jobs
+    ]
+
+
+async def _prepare_and_embed(
+    prepare: Callable, args: tuple, num_jitters: int
+) -> Dict[str, Any]:
+    """
+    Decode, detect and check one image in its own executor call, then embed
+    its faces together with those of concurrent requests.
+
+    Only embedding is micro-batched: preparing images one per call lets
+    concurrent requests use separate cores, and a slow image does not hold
+    back the others.
+    """
+    result, faces, crops = await stage_executor.run("detect", prepare, *args)
+    # All faces of a frame may be tracked, leaving nothing to embed
+    if crops:
+        embeddings = await embed_batcher.submit((crops, num_jitters))
+        for face, embedding in zip(faces, embeddings):
+            face["embedding"] = embedding
+    return result
+
+
+async def _detect_and_embed(
+    image: Union[str, bytes],
+    min_face_area_ratio: float,
+    num_jitters: int,
+    tiling: Optional[Tuple[int, float]],
+    tracks: Sequence[Tuple[int, Tuple[int, int, int, int]]] = (),
+) -> Dict[str, Any]:
+    """Detect, check and embed the faces of one image, tiled if requested."""
+    faces = None
+    if tiling is not None:
+        located = await _locate_tiled(image, tiling)
+        if isinstance(located, dict):
+            return located
+        image, faces = located
+    return await _prepare_and_embed(
+        _prepare_detect,
+        (image, min_face_area_ratio, settings.ML_LIVENESS_CHECK, faces, tracks),
+        num_jitters,
+    )
+
+
+def _encode_batch(
+    images: List[str],
+    validate_single: bool,
+    min_face_area_ratio: float,
+    num_jitters: int,
+    encoder_name: Optional[str],
+) -> List[Dict[str, Any]]:
+    """
+    Encode the single face of each image with the named encoder.
+
+    Used to re-embed stored photos with a new encoder while the active one
+    keeps serving. Failures are reported per image.
+    """
+    prepared = []
+    for image_base64 in images:
+        try:
+            prepared.append(
+                _prepare_encode(image_base64, validate_single, min_face_area_ratio)
             )
+        except Exception as e:
+            prepared.append(({"error": str(e), "error_code": ERROR_PROCESSING}, [], []))
 
-        # Convert PIL image to numpy array
-        image_np = np.array(image)
+    crops = [crop for _, _, job_crops in prepared for crop in job_crops]
+    embeddings = iter(get_encoder(encoder_name).embed(crops, num_jitters))
+    results = []
+    for result, faces, _ in prepared:
+        for face in faces:
+            face["embedding"] = next(embeddings)
+        results.append(result)
+    return results
 
-        faces = detect_faces(image_np)
 
-        if not faces:
-            return EncodeFaceResponse(
-                success=False, error="No face detected", error_code=ERROR_NO_FACE
+def _match_batch(jobs: List[Tuple[Gallery, Any]]) -> List[Any]:
+    """
+    Score a micro-batch of (gallery, queries) jobs on the stage executor.
+
+    Jobs against the same gallery are stacked into one matrix multiply.
+    Each job gets back its rows of per-student scores.
+    """
+    results: List[Any] = [None] * len(jobs)
+    by_gallery: Dict[int, List[int]] = {}
+    stacked_queries: List[np.ndarray] = [None] * len(jobs)
+
+    for i, (gallery, queries) in enumerate(jobs):
+        q = np.array(queries, dtype=np.float32, ndmin=2)
+        if len(gallery) and q.shape[1] != gallery.dimension:
+            results[i] = ValueError(
+                f"Embedding dimension {q.shape[1]} does not match gallery "
+                f"dimension {gallery.dimension}"
             )
+            continue
+        stacked_queries[i] = q
+        by_gallery.setdefault(id(gallery), []).append(i)
 
-        if request.validate_single and len(faces) > 1:
-            return EncodeFaceResponse(
-                success=False,
-                error="Multiple faces detected",
-                error_code=ERROR_MULTIPLE_FACES,
+    for indices in by_gallery.values():
+        gallery = jobs[indices[0]][0]
+        try:
+            scores = gallery.student_scores(
+                np.concatenate([stacked_queries[i] for i in indices])
             )
+        except Exception as e:
+            for i in indices:
+                results[i] = e
+            continue
+        row = 0
+        for i in indices:
+            n = stacked_queries[i].shape[0]
+            results[i] = scores[row : row + n]
+            row += n
 
-        top, right, bottom, left = faces[0]
+    return results
 
-        face_w = right - left
-        face_h = bottom - top
 
-        im_h, im_w, _ = image_np.shape
-        face_area = face_w * face_h
-        image_area = im_h * im_w
+embed_batcher = MicroBatcher(
+    "encode",
+    _embed_batch,
+    stage_executor,
+    settings.ML_BATCH_MAX_SIZE,
+    settings.ML_BATCH_MAX_WAIT_MS,
+)
+match_batcher = MicroBatcher(
+    "match",
+    _match_batch,
+    stage_executor,
+    settings.ML_BATCH_MAX_SIZE,
+    settings.ML_BATCH_MAX_WAIT_MS,
+)
 
-        if (face_area / image_area) < request.min_face_area_ratio:
+
+def _location(box) -> FaceLocation:
+    top, right, bottom, left = box
+    return FaceLocation(top=top, right=right, bottom=bottom, left=left)
+
+
+@router.post("/encode-face", response_model=EncodeFaceResponse)
+async def encode_face(
+    request: EncodeFaceRequest,
+    response: Response,
+    embedding_format: str = Depends(get_embedding_format),
+):
+    response.headers[EMBEDDING_FORMAT_HEADER] = embedding_format
+    try:
+        result = await _prepare_and_embed(
+            _prepare_encode,
+            (
+                request.image_base64,
+                request.validate_single,
+                request.min_face_area_ratio,
+            ),
+            request.num_jitters,
+        )
+
+        if "error" in result:
             return EncodeFaceResponse(
-                success=False, error="Face too small", error_code=ERROR_FACE_TOO_SMALL
+                success=False, error=result["error"], error_code=result["error_code"]
             )
 
-        face_img = image_np[top:bottom, left:right]
-        embedding = get_face_embedding(face_img)
-
         return EncodeFaceResponse(
             success=True,
-            embedding=embedding,
-            face_location=FaceLocation(top=top, right=right, bottom=bottom, left=left),
+            embedding=encode_embedding(result["embedding"], embedding_format),
+            model_version=get_encoder().model_version,
+            face_location=_location(result["location"]),
             metadata=EncodeFaceMetadata(
-                face_area_ratio=face_area / image_area, image_dimensions=[im_w, im_h]
+                face_area_ratio=result["face_area_ratio"],
+                image_dimensions=result["image_dimensions"],
             ),
         )
 
+    except ServiceOverloadedError:
+        raise
     except Exception as e:
         return EncodeFaceResponse(
             success=False, error=str(e), error_code=ERROR_PROCESSING
         )
 
 
-@router.post("/detect-faces", response_model=DetectFacesResponse)
-async def detect_faces_api(request: DetectFacesRequest):
-    start = time.time()
+@router.post("/encode-faces-batch", response_model=EncodeFacesBatchResponse)
+async def encode_faces_batch(
+    request: EncodeFacesBatchRequest,
+    response: Response,
+    embedding_format: str = Depends(get_embedding_format),
+):
+    """
+    Encode one face per image, optionally with a non-active encoder.
 
+    Meant for background re-embedding of stored photos, so the whole
+    request is a single executor call rather than going through the
+    real-time micro-batcher.
+    """
+    response.headers[EMBEDDING_FORMAT_HEADER] = embedding_format
     try:
-        # Validate and decode image directly to NumPy array (more efficient)
-        success, image_bytes, image_np, error_msg, error_code = validate_and_decode_image_to_numpy(
-            request.image_base64
+        encoder = get_encoder(request.encoder)
+        encoder.check_available()
+        results = await stage_executor.run(
+            "encode",
+            _encode_batch,
+            request.images,
+            request.validate_single,
+            request.min_face_area_ratio,
+            request.num_jitters,
+            request.encoder,
+            weight=len(request.images),
         )
 
-        if not success:
-            return DetectFacesResponse(success=False, error=error_msg)
-
-        # Convert PIL image to numpy array
-        image_np = np.array(image)
+        return EncodeFacesBatchResponse(
+            success=True,
+            model_version=encoder.model_version,
+            results=[
+                EncodeFaceResponse(
+                    success=False,
+                    error=result["error"],
+                    error_code=result["error_code"],
+                )
+                if "error" in result
+                else EncodeFaceResponse(
+                    success=True,
+                    embedding=encode_embedding(result["embedding"], embedding_format),
+                    model_version=encoder.model_version,
+                    face_location=_location(result["location"]),
+                    metadata=EncodeFaceMetadata(
+                        face_area_ratio=result["face_area_ratio"],
+                        image_dimensions=result["image_dimensions"],
+                    ),
+                )
+                for result in results
+            ],
+        )
 
-        faces = detect_faces(image_np)
-        h, w, _ = image_np.shape
-        image_area = h * w
+    except ServiceOverloadedError:
+        raise
+    except FileNotFoundError as e:
+        return EncodeFacesBatchResponse(
+            success=False, error=str(e), error_code=ERROR_MODEL_UNAVAILABLE
+        )
+    except Exception as e:
+        return EncodeFacesBatchResponse(
+            success=False, error=str(e), error_code=ERROR_PROCESSING
+        )
 
-        detected = []
-        for face_tuple in faces:
-            # faces detected are already in (top, right, bottom, left) format
-            top, right, bottom, left = face_tuple
 
-            face_width = right - left
-            face_height = bottom - top
-            face_area = face_width * face_height
+@router.get("/encoders/{name}", response_model=EncoderInfoResponse)
+async def encoder_info(name: str):
+    """
+    Model version and dimension of an encoder, if it can run here.
 
-            if face_area / image_area < request.min_face_area_ratio:
-                continue
+    Lets a re-embedding job learn the tag to store embeddings under, and
+    fail before its first batch when the encoder's model is missing.
+    """
+    try:
+        encoder = get_encoder(name)
+        encoder.check_available()
+    except FileNotFoundError as e:
+        return EncoderInfoResponse(
+            success=False,
+            encoder=name,
+            error=str(e),
+            error_code=ERROR_MODEL_UNAVAILABLE,
+        )
+    except ValueError as e:
+        return EncoderInfoResponse(
+            success=False, encoder=name, error=str(e), error_code=ERROR_PROCESSING
+        )
+    return EncoderInfoResponse(
+        success=True,
+        encoder=name,
+        model_version=encoder.model_version,
+        dimension=encoder.dimension,
+    )
 
-            # Ensure coordinates are within image bounds
-            top = max(0, top)
-            left = max(0, left)
-            bottom = min(h, bottom)
-            right = min(w, right)
 
-            face_img = image_np[top:bottom, left:right]
+@router.post("/detect-faces", response_model=DetectFacesResponse)
+async def detect_faces_api(
+    request: DetectFacesRequest,
+    response: Response,
+    embedding_format: str = Depends(get_embedding_format),
+):
+    start = time.time()
+    response.headers[EMBEDDING_FORMAT_HEADER] = embedding_format
 
-            # Liveness Check
-            live = True
-            if settings.ML_LIVENESS_CHECK:
-                live = is_live(face_img)
+    try:
+        result = await _detect_and_embed(
+            request.image_base64,
+            request.min_face_area_ratio,
+            request.num_jitters,
+            _tiling_for(request),
+        )
 
-            embedding = get_face_embedding(face_img)
+        if "error" in result:
+            return DetectFacesResponse(success=False, error=result["error"])
 
-            detected.append(
-                DetectedFaceInfo(
-                    embedding=embedding,
-                    location=FaceLocation(
-                        top=top, right=right, bottom=bottom, left=left
-                    ),
-                    face_area_ratio=face_area / image_area,
-                    is_live=live,
-                )
+        detected = [
+            DetectedFaceInfo(
+                embedding=encode_embedding(face["embedding"], embedding_format),
+                location=_location(face["location"]),
+                face_area_ratio=face["face_area_ratio"],
+                is_live=face["is_live"],
             )
+            for face in result["faces"]
+        ]
 
         return DetectFacesResponse(
             success=True,
             faces=detected,
             count=len(detected),
+            model_version=get_encoder().model_version,
             metadata=DetectFacesMetadata(
-                image_dimensions=[w, h], processing_time_ms=(time.time() - start) * 1000
+                image_dimensions=result["image_dimensions"],
+                processing_time_ms=(time.time() - start) * 1000,
             ),
         )
 
+    except ServiceOverloadedError:
+        raise
     except Exception as e:
         return DetectFacesResponse(success=False, error=str(e))
 
@@ -177,42 +642,49 @@ async def detect_faces_api(request: DetectFacesRequest):
 @router.post("/match-faces", response_model=MatchFacesResponse)
 async def match_faces(request: MatchFacesRequest):
     try:
-        best_match = None
-        best_score = -1.0
-        all_distances = []
-
-        for candidate in request.candidate_embeddings:
-            scores = [
-                cosine_similarity(request.query_embedding, emb)
-                for emb in candidate.embeddings
-            ]
-            score = max(scores)
+        gallery = _resolve_gallery(request)
+        if gallery is None:
+            return MatchFacesResponse(
+                success=False,
+                error="Gallery not registered",
+                error_code=ERROR_GALLERY_NOT_FOUND,
+            )
+        if _encoder_mismatch(gallery, [request.query_embedding]):
+            return MatchFacesResponse(
+                success=False,
+                error="Gallery embeddings come from another encoder",
+                error_code=ERROR_MODEL_MISMATCH,
+            )
+        if not len(gallery):
+            return MatchFacesResponse(success=True, match=None)
 
-            if request.return_all_distances:
-                all_distances.append(
-                    DistanceInfo(
-                        student_id=candidate.student_id, min_distance=1 - score
-                    )
-                )
+        scores = (await match_batcher.submit((gallery, [request.query_embedding])))[0]
+        best = int(np.argmax(scores))
+        best_score = float(scores[best])
 
-            if score > best_score:
-                best_score = score
-                best_match = candidate.student_id
+        all_distances = None
+        if request.return_all_distances:
+            all_distances = [
+                DistanceInfo(student_id=student_id, min_distance=1 - float(score))
+                for student_id, score in zip(gallery.student_ids, scores)
+            ]
 
         if best_score >= request.threshold:
             return MatchFacesResponse(
                 success=True,
                 match=MatchResult(
-                    student_id=best_match,
+                    student_id=gallery.student_ids[best],
                     distance=1 - best_score,
                     confidence=best_score,
                     status="confident",
                 ),
-                all_distances=all_distances if request.return_all_distances else None,
+                all_distances=all_distances,
             )
 
         return MatchFacesResponse(success=True, match=None)
 
+    except ServiceOverloadedError:
+        raise
     except Exception as e:
         return MatchFacesResponse(success=False, error=str(e))
 
@@ -220,11 +692,45 @@ async def match_faces(request: MatchFacesRequest):
 @router.post("/batch-match", response_model=BatchMatchResponse)
 async def batch_match(request: BatchMatchRequest):
     try:
-        results = []
+        gallery = _resolve_gallery(request)
+        if gallery is None:
+            return BatchMatchResponse(
+                success=False,
+                error="Gallery not registered",
+                error_code=ERROR_GALLERY_NOT_FOUND,
+            )
+        if _encoder_mismatch(
+            gallery, [face.embedding for face in request.detected_faces]
+        ):
+            return BatchMatchResponse(
+                success=False,
+                error="Gallery embeddings come from another encoder",
+                error_code=ERROR_MODEL_MISMATCH,
+            )
 
-        for idx, face in enumerate(request.detected_faces):
-            # Check liveness first
-            if not getattr(face, "is_live", True):
+        # Spoofed faces are never matched; score the live ones in one pass
+        live_indices = [
+            idx
+            for idx, face in enumerate(request.detected_faces)
+            if getattr(face, "is_live", True)
+        ]
+        best_idx, best_scores = (
+            Gallery.best_of(
+                await match_batcher.submit(
+                    (
+                        gallery,
+                        [request.detected_faces[i].embedding for i in live_indices],
+                    )
+                )
+            )
+            if live_indices
+            else ([], [])
+        )
+        live_results = dict(zip(live_indices, zip(best_idx, best_scores)))
+
+        results = []
+        for idx in range(len(request.detected_faces)):
+            if idx not in live_results:
                 results.append(
                     BatchMatchResult(
                         face_index=idx,
@@ -236,20 +742,8 @@ async def batch_match(request: BatchMatchRequest):
                 )
                 continue
 
-            best_id = None
-            best_score = -1.0
-
-            for candidate in request.candidate_embeddings:
-                scores = [
-                    cosine_similarity(face.embedding, emb)
-                    for emb in candidate.embeddings
-                ]
-                score = max(scores)
-
-                if score > best_score:
-                    best_score = score
-                    best_id = candidate.student_id
-
+            student_idx, best_score = live_results[idx]
+            best_score = float(best_score)
             status = (
                 "present" if best_score >= request.confident_threshold else "unknown"
             )
@@ -257,7 +751,9 @@ async def batch_match(request: BatchMatchRequest):
             results.append(
                 BatchMatchResult(
                     face_index=idx,
-                    student_id=best_id if status == "present" else None,
+                    student_id=gallery.student_ids[student_idx]
+                    if status == "present"
+                    else None,
                     distance=1 - best_score,
                     status=status,
                     liveness=True,
@@ -266,5 +762,366 @@ async def batch_match(request: BatchMatchRequest):
 
         return BatchMatchResponse(success=True, matches=results)
 
+    except ServiceOverloadedError:
+        raise
     except Exception as e:
         return BatchMatchResponse(success=False, error=str(e))
+
+
+@router.post("/recognize-frame", response_model=RecognizeFrameResponse)
+async def recognize_frame(request: RecognizeFrameRequest):
+    """
+    Detect, liveness-check and match every face of a frame in one call.
+
+    Replaces a detect-faces call followed by one match-faces call per face.
+    Spoofed faces are returned without a match.
+    """
+    return await _recognize_frame(request.image_base64, request)
+
+
+@router.post("/recognize-frame/raw", response_model=RecognizeFrameResponse)
+async def recognize_frame_raw(
+    request: Request,
+    gallery_id: str = Query(..., description="ID of a registered gallery"),
+    gallery_version: Optional[str] = Query(default=None),
+    min_face_area_ratio: float = Query(default=0.01),
+    threshold: float = Query(default=0.6),
+    model: str = Query(default="hog"),
+    tile_size: Optional[int] = Query(default=None, ge=128),
+    tile_overlap: Optional[float] = Query(default=None, ge=0.0, lt=1.0),
+    session_id: Optional[str] = Query(default=None),
+    confirm_threshold: Optional[float] = Query(default=None),
+):
+    """
+    ``recognize-frame`` for a JPEG/PNG request body, with the options as
+    query parameters. Live frames skip base64 on the way in, and the body is
+    decoded straight from the received buffer. Candidates must come from a
+    registered gallery.
+    """
+    options = RecognizeFrameOptions(
+        gallery_id=gallery_id,
+        gallery_version=gallery_version,
+        min_face_area_ratio=min_face_area_ratio,
+        threshold=threshold,
+        model=model,
+        tile_size=tile_size,
+        tile_overlap=tile_overlap,
+        session_id=session_id,
+        confirm_threshold=confirm_threshold,
+    )
+    return await _recognize_frame(await request.body(), options)
+
+
+async def _recognize_frame(
+    image: Union[str, bytes], request: RecognizeFrameOptions
+) -> RecognizeFrameResponse:
+    start = time.time()
+
+    try:
+        # Resolve first so a stale gallery reference fails before detection
+        gallery = _resolve_gallery(request)
+        if gallery is None:
+            return RecognizeFrameResponse(
+                success=False,
+                error="Gallery not registered",
+                error_code=ERROR_GALLERY_NOT_FOUND,
+            )
+        if _encoder_mismatch(gallery):
+            return RecognizeFrameResponse(
+                success=False,
+                error="Gallery embeddings come from another encoder",
+                error_code=ERROR_MODEL_MISMATCH,
+            )
+
+        tracker = tracker_store.get(request.session_id) if request.session_id else None
+        tracks = tracker.fresh_tracks(gallery) if tracker is not None else {}
+
+        result = await _detect_and_embed(
+            image,
+            request.min_face_area_ratio,
+            # Real-time frames trade jitter averaging for latency
+            1,
+            _tiling_for(request),
+            [(track_id, track.box) for track_id, track in tracks.items()],
+        )
+
+        if "error" in result:
+            return RecognizeFrameResponse(
+                success=False, error=result["error"], error_code=result["error_code"]
+            )
+
+        faces = result["faces"]
+        # Tracked faces take their track's result instead of being recognized
+        reused = set()
+        for i, face in enumerate(faces):
+            track = tracks.get(face.get("track_id"))
+            if track is not None:
+                face["is_live"] = track.is_live
+                face["best"] = track.best
+                reused.add(i)
+
+        live_indices = [
+            i for i, face in enumerate(faces) if face["is_live"] and i not in reused
+        ]
+        # Only a face that is matched at all may confirm its student
+        confirm_threshold = max(
+            request.confirm_threshold or request.threshold, request.threshold
+        )
+        # A session matches against the students it has not confirmed yet;
+        # confirmed ones only for faces without a confident match there
+        parts = [gallery] if tracker is None else tracker.split_gallery(gallery)
+        pending = live_indices
+        for part in parts:
+            if not pending or not len(part):
+                continue
+            best_idx, best_scores = Gallery.best_of(
+                await match_batcher.submit(
+                    (part, [faces[i]["embedding"] for i in pending])
+                )
+            )
+            unsure = []
+            for i, student_idx, score in zip(pending, best_idx, best_scores):
+                score = float(score)
+                best = faces[i].get("best")
+                if best is None or score > best[1]:
+                    best = faces[i]["best"] = (part.student_ids[student_idx], score)
+                if best[1] < confirm_threshold:
+                    unsure.append(i)
+            pending = unsure
+
+        if tracker is not None:
+            tracker.update(faces, gallery, confirm_threshold)
+
+        recognized = []
+        for i, face in enumerate(faces):
+            match = None
+            best = face.get("best")
+            if best is not None and best[1] >= request.threshold:
+                student_id, score = best
+                match = MatchResult(
+                    student_id=student_id,
+                    distance=1 - score,
+                    confidence=score,
+                    status="confident",
+                )
+            recognized.append(
+                TrackedFace(
+                    location=_location(face["location"]),
+                    face_area_ratio=face["face_area_ratio"],
+                    is_live=face["is_live"],
+                    match=match,
+                    track_id=face.get("track_id"),
+                    tracked=i in reused,
+                )
+            )
+
+        return RecognizeFrameResponse(
+            success=True,
+            faces=recognized,
+            count=len(recognized),
+            metadata=DetectFacesMetadata(
+                image_dimensions=result["image_dimensions"],
+                processing_time_ms=(time.time() - start) * 1000,
+            ),
+        )
+
+    except ServiceOverloadedError:
+        raise
+    except Exception as e:
+        return RecognizeFrameResponse(
+            success=False, error=str(e), error_code=ERROR_PROCESSING
+        )
+
+
+@router.post("/detect-faces-batch", response_model=DetectFacesBatchResponse)
+async def detect_faces_batch(
+    request: DetectFacesBatchRequest,
+    response: Response,
+    embedding_format: str = Depends(get_embedding_format),
+):
+    """
+    Detect faces in several photos of one room and dedupe across them.
+
+    Each image is processed on its own executor worker, so the images of a
+    request run in parallel. When a gallery is given, live faces of all
+    images are matched in one pass; a student matched in several images is
+    reported once under ``students`` and their other faces are flagged as
+    ``duplicate``.
+    """
+    start = time.time()
+    response.headers[EMBEDDING_FORMAT_HEADER] = embedding_format
+
+    try:
+        gallery = None
+        if request.gallery_id or request.candidate_embeddings is not None:
+            gallery = _resolve_gallery(request)
+            if gallery is None:
+                return DetectFacesBatchResponse(
+                    success=False,
+                    error="Gallery not registered",
+                    error_code=ERROR_GALLERY_NOT_FOUND,
+                )
+            if _encoder_mismatch(gallery):
+                return DetectFacesBatchResponse(
+                    success=False,
+                    error="Gallery embeddings come from another encoder",
+                    error_code=ERROR_MODEL_MISMATCH,
+                )
+
+        tiling = _tiling_for(request)
+        # One executor call per image so the images run on separate cores;
+        # their faces are then embedded together
+        outcomes = await asyncio.gather(
+            *(
+                _detect_and_embed(image_base64, request.min_face_area_ratio, 1, tiling)
+                for image_base64 in request.images
+            ),
+            return_exceptions=True,
+        )
+        for outcome in outcomes:
+            if isinstance(outcome, ServiceOverloadedError):
+                raise outcome
+        per_image = [
+            {"error": str(outcome), "error_code": ERROR_PROCESSING}
+            if isinstance(outcome, Exception)
+            else outcome
+            for outcome in outcomes
+        ]
+
+        live_faces = [
+            (image_index, face_index)
+            for image_index, result in enumerate(per_image)
+            if "error" not in result
+            for face_index, face in enumerate(result["faces"])
+            if face["is_live"]
+        ]
+
+        matches: Dict[Tuple[int, int], MatchResult] = {}
+        if gallery is not None and len(gallery) and live_faces:
+            best_idx, best_scores = Gallery.best_of(
+                await match_batcher.submit(
+                    (
+                        gallery,
+                        [per_image[i]["faces"][j]["embedding"] for i, j in live_faces],
+                    )
+                )
+            )
+            for key, student_idx, score in zip(live_faces, best_idx, best_scores):
+                score = float(score)
+                if score >= request.threshold:
+                    matches[key] = MatchResult(
+                        student_id=gallery.student_ids[student_idx],
+                        distance=1 - score,
+                        confidence=score,
+                        status="confident",
+                    )
+
+        # Keep each student's most confident face across all images
+        best_sighting: Dict[str, Tuple[int, int]] = {}
+        sightings: Dict[str, int] = {}
+        for key, match in matches.items():
+            sightings[match.student_id] = sightings.get(match.student_id, 0) + 1
+            current = best_sighting.get(match.student_id)
+            if current is None or match.confidence > matches[current].confidence:
+                best_sighting[match.student_id] = key
+
+        images = []
+        for image_index, result in enumerate(per_image):
+            if "error" in result:
+                images.append(
+                    ImageDetectionResult(
+                        image_index=image_index,
+                        success=False,
+                        error=result["error"],
+                        error_code=result["error_code"],
+                    )
+                )
+                continue
+
+            faces = []
+            for face_index, face in enumerate(result["faces"]):
+                match = matches.get((image_index, face_index))
+                faces.append(
+                    BatchDetectedFace(
+                        location=_location(face["location"]),
+                        face_area_ratio=face["face_area_ratio"],
+                        is_live=face["is_live"],
+                        match=match,
+                        embedding=encode_embedding(face["embedding"], embedding_format)
+                        if request.return_embeddings
+                        else None,
+                        duplicate=match is not None
+                        and best_sighting[match.student_id]
+                        != (image_index, face_index),
+                    )
+                )
+            images.append(
+                ImageDetectionResult(
+                    image_index=image_index,
+                    success=True,
+                    faces=faces,
+                    count=len(faces),
+                    image_dimensions=result["image_dimensions"],
+                )
+            )
+
+        students = [
+            StudentSighting(
+                student_id=student_id,
+                image_index=image_index,
+                face_index=face_index,
+                distance=matches[(image_index, face_index)].distance,
+                confidence=matches[(image_index, face_index)].confidence,
+                sightings=sightings[student_id],
+            )
+            for student_id, (image_index, face_index) in best_sighting.items()
+        ]
+
+        return DetectFacesBatchResponse(
+            success=True,
+            images=images,
+            students=students,
+            count=sum(image.count for image in images),
+            model_version=get_encoder().model_version,
+            processing_time_ms=(time.time() - start) * 1000,
+        )
+
+    except ServiceOverloadedError:
+        raise
+    except Exception as e:
+        return DetectFacesBatchResponse(
+            success=False, error=str(e), error_code=ERROR_PROCESSING
+        )
+
+
+@router.post("/galleries", response_model=RegisterGalleryResponse)
+async def register_gallery(request: RegisterGalleryRequest):
+    try:
+        gallery = await stage_executor.run(
+            "match",
+            Gallery.from_candidates,
+            [(c.student_id, c.embeddings) for c in request.candidate_embeddings],
+        )
+        gallery.model_version = request.model_version
+        version = request.version or gallery_content_hash(gallery)
+        gallery_store.put(request.gallery_id, version, gallery)
+
+        return RegisterGalleryResponse(
+            success=True,
+            gallery_id=request.gallery_id,
+            version=version,
+            student_count=len(gallery),
+            embedding_count=gallery.matrix.shape[0],
+        )
+
+    except ServiceOverloadedError:
+        raise
+    except Exception as e:
+        return RegisterGalleryResponse(success=False, error=str(e))
+
+
+@router.delete("/galleries/{gallery_id}", response_model=InvalidateGalleryResponse)
+async def invalidate_gallery(gallery_id: str):
+    return InvalidateGalleryResponse(
+        success=True, invalidated=gallery_store.invalidate(gallery_id)
+    )
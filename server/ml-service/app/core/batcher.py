@@ -0,0 +1,107 @@
+"""
+Micro-batching of concurrent requests for one ML stage.
+
+At peak many requests arrive for the same stage within a few milliseconds
+of each other. ``MicroBatcher`` holds each submitted item until either
+``max_batch_size`` items are waiting or the oldest has waited
+``max_wait_ms``, then hands the whole batch to a single
+``process_batch(items)`` call on the stage executor and fans the results
+back to the waiting requests.
+
+``process_batch`` must return one result per item, in order. A result that
+is an exception instance is raised in the corresponding request only, so
+one bad image does not fail the rest of its batch.
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, List, Optional, Sequence, Set, Tuple
+
+from app.core.executor import StageExecutor
+from app.core.metrics import ML_BATCH_QUEUE_WAIT_SECONDS, ML_BATCH_SIZE
+
+
+def _settle(future: asyncio.Future, result: Any) -> None:
+    if future.done():
+        return
+    if isinstance(result, BaseException):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        stage: str,
+        process_batch: Callable[[List[Any]], Sequence[Any]],
+        executor: StageExecutor,
+        max_batch_size: int,
+        max_wait_ms: float,
+    ):
+        self.stage = stage
+        self.process_batch = process_batch
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+
+        # Only touched from the event loop thread, so no lock is needed
+        self._pending: List[Tuple[Any, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._dispatching: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue ``item`` for the next batch and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+
+        if self._timer is not None and self._timer_loop.is_closed():
+            # The loop that owned the timer is gone; its flush never ran
+            self._timer = None
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+            self._timer_loop = loop
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+        self._dispatching.add(task)
+        task.add_done_callback(self._dispatching.discard)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future, float]]) -> None:
+        now = time.perf_counter()
+        for _, _, queued_at in batch:
+            ML_BATCH_QUEUE_WAIT_SECONDS.labels(stage=self.stage).observe(
+                now - queued_at
+            )
+        ML_BATCH_SIZE.labels(stage=self.stage).observe(len(batch))
+
+        try:
+            results = await self.executor.run(
+                self.stage,
+                self.process_batch,
+                [item for item, _, _ in batch],
+                weight=len(batch),
+            )
+        except Exception as exc:
+            results = [exc] * len(batch)
+
+        for (_, future, _), result in zip(batch, results):
+            # Requests may come from another event loop (e.g. test clients)
+            loop = future.get_loop()
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_settle, future, result)
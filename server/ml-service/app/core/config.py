@@ -24,6 +24,48 @@ class Settings(BaseSettings):
 
     # Liveness Detection (Anti-Spoofing)
     ML_LIVENESS_CHECK: bool = True
+    # Pooled FaceMesh instances (0 = one per stage-executor thread)
+    ML_FACE_MESH_POOL_SIZE: int = 0
+
+    # Face encoder: "patch" (legacy 9216-d) or "sface" (128-d, OpenCV DNN)
+    ML_ENCODER: str = "patch"
+
+    # Whole-image detection runs on a copy downscaled to this longer side
+    # (0 = detect at full resolution)
+    ML_DETECTION_MAX_SIDE: int = 640
+
+    # Tiled detection (model="tiled"): tile edge in pixels, overlap fraction
+    ML_TILE_SIZE: int = 640
+    ML_TILE_OVERLAP: float = 0.2
+
+    # Registered candidate galleries (LRU + TTL)
+    GALLERY_CACHE_MAX_ENTRIES: int = 256
+    GALLERY_CACHE_TTL_SECONDS: int = 3600
+
+    # Face tracking in live sessions (recognize-frame with a session_id):
+    # boxes overlapping a track by ML_TRACK_IOU_THRESHOLD reuse its result
+    # until it is ML_TRACK_REFRESH_SECONDS old; unseen tracks are dropped
+    # after ML_TRACK_MAX_AGE_SECONDS and idle sessions after the session TTL
+    ML_TRACK_IOU_THRESHOLD: float = 0.4
+    ML_TRACK_REFRESH_SECONDS: float = 5.0
+    ML_TRACK_MAX_AGE_SECONDS: float = 3.0
+    ML_TRACK_MAX_SESSIONS: int = 256
+    ML_TRACK_SESSION_TTL_SECONDS: int = 600
+
+    # Execution of CPU-bound stages off the event loop (0 workers = CPU count).
+    # The process pool is only started if ML_PROCESS_STAGES names a stage.
+    ML_THREAD_WORKERS: int = 0
+    ML_PROCESS_WORKERS: int = 0
+    # Comma-separated stages ("encode", "detect") for the process pool; "match"
+    # always runs on threads
+    ML_PROCESS_STAGES: str = ""
+    # Requests running or queued for a worker before new ones get a 503
+    ML_MAX_QUEUE_DEPTH: int = 32
+
+    # Micro-batching of concurrent embed and match calls (size 1 = no batching),
+    # at most ML_MAX_QUEUE_DEPTH
+    ML_BATCH_MAX_SIZE: int = 8
+    ML_BATCH_MAX_WAIT_MS: float = 5.0
 
     CORS_ORIGINS: Union[str, List[str]] = [
         "https://studentcheck.vercel.app",
@@ -58,6 +100,21 @@ class Settings(BaseSettings):
         self.API_KEY = api_key
         return self
 
+    @model_validator(mode="after")
+    def clamp_batch_size(self) -> "Settings":
+        """
+        A micro-batch counts once per request against the queue depth, so a
+        full batch larger than ML_MAX_QUEUE_DEPTH would always be rejected.
+        """
+        if self.ML_BATCH_MAX_SIZE > self.ML_MAX_QUEUE_DEPTH:
+            logger.warning(
+                f"ML_BATCH_MAX_SIZE {self.ML_BATCH_MAX_SIZE} exceeds "
+                f"ML_MAX_QUEUE_DEPTH {self.ML_MAX_QUEUE_DEPTH}; using "
+                f"{self.ML_MAX_QUEUE_DEPTH}"
+            )
+            self.ML_BATCH_MAX_SIZE = self.ML_MAX_QUEUE_DEPTH
+        return self
+
     @property
     def cors_origins_list(self) -> List[str]:
         if isinstance(self.CORS_ORIGINS, str):
@@ -67,5 +124,9 @@ class Settings(BaseSettings):
                 return [self.CORS_ORIGINS]
         return self.CORS_ORIGINS
 
+    @property
+    def process_stages_list(self) -> List[str]:
+        return [s.strip() for s in self.ML_PROCESS_STAGES.split(",") if s.strip()]
+
 
 settings = Settings()
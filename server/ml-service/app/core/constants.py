@@ -4,6 +4,7 @@
 DEFAULT_MIN_FACE_AREA_RATIO = 0.04
 DEFAULT_NUM_JITTERS = 3
 DEFAULT_MODEL = "hog"  # hog or cnn
+TILED_MODEL = "tiled"  # Overlapping-tile detection for high-resolution images
 
 # Face Encoding
 ENCODING_MIN_FACE_AREA_RATIO = 0.05
@@ -19,6 +20,11 @@ MAX_IMAGE_SIZE_BYTES = 5_242_880  # 5MB
 MAX_BASE64_SIZE = int(MAX_IMAGE_SIZE_BYTES * 1.37)  # Base64 is ~37% larger
 MAX_IMAGE_DIMENSION = 4096  # Max width or height
 ALLOWED_IMAGE_FORMATS = {"JPEG", "PNG", "JPG"}
+MAX_BATCH_IMAGES = 10  # Images per detect-faces-batch request
+
+# Response headers reporting executor load (calls in flight / limit)
+QUEUE_DEPTH_HEADER = "X-Queue-Depth"
+QUEUE_CAPACITY_HEADER = "X-Queue-Capacity"
 
 # Error Codes
 ERROR_NO_FACE = "NO_FACE_FOUND"
@@ -29,3 +35,6 @@ ERROR_IMAGE_TOO_LARGE = "IMAGE_TOO_LARGE"
 ERROR_INVALID_FORMAT = "INVALID_FORMAT"
 ERROR_INVALID_DIMENSIONS = "INVALID_DIMENSIONS"
 ERROR_PROCESSING = "PROCESSING_ERROR"
+ERROR_GALLERY_NOT_FOUND = "GALLERY_NOT_FOUND"
+ERROR_MODEL_MISMATCH = "MODEL_VERSION_MISMATCH"
+ERROR_MODEL_UNAVAILABLE = "MODEL_UNAVAILABLE"
@@ -0,0 +1,127 @@
+"""
+Execution of CPU-bound ML stages off the event loop.
+
+Detection, encoding, liveness and matching are synchronous and can take
+tens of milliseconds per frame. Running them inside ``async def`` handlers
+blocks every other request in the worker, ``/health`` included, so the
+routes hand them to a ``StageExecutor`` instead:
+
+* a thread pool for OpenCV/MediaPipe/NumPy work, which releases the GIL;
+* an optional process pool for stages listed in ``ML_PROCESS_STAGES``, for
+  Python-heavy work that would otherwise serialize on the GIL.
+
+"match" always runs on threads: its input is a whole gallery matrix, which
+would be pickled to the worker process on every call and cost more than
+the NumPy product itself.
+
+Calls running or waiting for a worker are capped at ``ML_MAX_QUEUE_DEPTH``;
+beyond that the request is rejected with ``ServiceOverloadedError`` (503)
+rather than queueing without bound.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional
+
+import structlog
+
+from app.core.config import settings
+from app.core.exceptions import ServiceOverloadedError
+from app.core.metrics import EXECUTOR_IN_FLIGHT, EXECUTOR_REJECTED
+
+logger = structlog.get_logger()
+
+# Stages never sent to the process pool; see the module docstring
+THREAD_ONLY_STAGES = frozenset({"match"})
+
+
+class StageExecutor:
+    def __init__(
+        self,
+        thread_workers: int,
+        process_workers: int,
+        process_stages: Iterable[str],
+        max_queue_depth: int,
+    ):
+        cpu_count = os.cpu_count() or 1
+        self.thread_workers = thread_workers or cpu_count
+        self.process_workers = process_workers or cpu_count
+        self.process_stages = frozenset(process_stages) - THREAD_ONLY_STAGES
+        for stage in THREAD_ONLY_STAGES.intersection(process_stages):
+            logger.warning("Stage runs on threads only, ignoring", stage=stage)
+        self.max_queue_depth = max_queue_depth
+
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        # Only touched from the event loop thread, so no lock is needed
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _pool_for(self, stage: str) -> Executor:
+        if stage in self.process_stages:
+            if self._process_pool is None:
+                # MediaPipe graphs are not fork-safe; start clean interpreters
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._process_pool
+
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self.thread_workers, thread_name_prefix="ml-stage"
+            )
+        return self._thread_pool
+
+    async def run(
+        self, stage: str, fn: Callable[..., Any], *args: Any, weight: int = 1
+    ) -> Any:
+        """
+        Run ``fn(*args)`` for ``stage`` in its pool and await the result.
+
+        ``weight`` is the number of requests the call serves (a micro-batch
+        counts once per request) and is what the queue depth limit counts.
+        Functions routed to the process pool must be importable module-level
+        callables with picklable arguments and results.
+        """
+        if self._in_flight + weight > self.max_queue_depth:
+            EXECUTOR_REJECTED.labels(stage=stage).inc(weight)
+            logger.warning(
+                "Executor saturated, rejecting request",
+                stage=stage,
+                in_flight=self._in_flight,
+            )
+            raise ServiceOverloadedError()
+
+        self._in_flight += weight
+        EXECUTOR_IN_FLIGHT.labels(stage=stage).inc(weight)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._pool_for(stage), functools.partial(fn, *args)
+            )
+        finally:
+            self._in_flight -= weight
+            EXECUTOR_IN_FLIGHT.labels(stage=stage).dec(weight)
+
+    def shutdown(self) -> None:
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+
+stage_executor = StageExecutor(
+    thread_workers=settings.ML_THREAD_WORKERS,
+    process_workers=settings.ML_PROCESS_WORKERS,
+    process_stages=settings.process_stages_list,
+    max_queue_depth=settings.ML_MAX_QUEUE_DEPTH,
+)
@@ -1,4 +1,4 @@
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 FACE_DETECTION_ACCURACY = Gauge(
     "face_detection_confidence", "Confidence score of face detection"
@@ -9,3 +9,33 @@ FACES_DETECTED_TOTAL = Counter(
 )
 
 ML_ERRORS = Counter("ml_service_errors_total", "ML service errors", ["error_type"])
+
+EXECUTOR_IN_FLIGHT = Gauge(
+    "ml_executor_in_flight", "Stage calls running or queued on the executor", ["stage"]
+)
+
+EXECUTOR_REJECTED = Counter(
+    "ml_executor_rejected_total",
+    "Requests rejected because the executor queue was full",
+    ["stage"],
+)
+
+LIVENESS_MESH_CHECKOUT_SECONDS = Histogram(
+    "liveness_facemesh_checkout_seconds",
+    "Time spent waiting for a pooled FaceMesh instance",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+ML_BATCH_SIZE = Histogram(
+    "ml_batch_size",
+    "Requests combined into one micro-batch",
+    ["stage"],
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+ML_BATCH_QUEUE_WAIT_SECONDS = Histogram(
+    "ml_batch_queue_wait_seconds",
+    "Time a request waited for its micro-batch to be dispatched",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
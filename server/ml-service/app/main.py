@@ -14,8 +14,10 @@ import structlog
 
 from app.core.config import settings
 from app.api.routes.face_recognition import router as ml_router
+from app.core.executor import stage_executor
 from app.core.security import verify_api_key
 from app.ml.face_detector import _check_model_exists
+from app.ml.liveness import face_mesh_pool
 
 # New Imports
 from prometheus_fastapi_instrumentator import Instrumentator
@@ -26,6 +28,7 @@ from .core.error_handlers import (
 )
 from .core.exceptions import SmartAttendanceException
 from .middleware.correlation import CorrelationIdMiddleware
+from .middleware.load import QueueDepthMiddleware
 from .middleware.timing import TimingMiddleware
 
 from .api.routes.health import router as health_router
@@ -52,7 +55,11 @@ def create_app() -> FastAPI:
     async def lifespan(_: FastAPI):
         # Fail fast at boot if the face detector model is missing.
         _check_model_exists()
+        if settings.ML_LIVENESS_CHECK:
+            face_mesh_pool.warm()
         yield
+        stage_executor.shutdown()
+        face_mesh_pool.close()
 
     app = FastAPI(
         title=settings.SERVICE_NAME,
@@ -81,6 +88,7 @@ def create_app() -> FastAPI:
     # Middleware
     app.add_middleware(CorrelationIdMiddleware)
     app.add_middleware(TimingMiddleware)
+    app.add_middleware(QueueDepthMiddleware)
 
     # CORS middleware
     app.add_middleware(
@@ -0,0 +1,17 @@
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.core.constants import QUEUE_CAPACITY_HEADER, QUEUE_DEPTH_HEADER
+from app.core.executor import stage_executor
+
+
+class QueueDepthMiddleware(BaseHTTPMiddleware):
+    """
+    Report executor load on every response, so callers can slow down
+    before requests start failing with 503.
+    """
+
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        response.headers[QUEUE_DEPTH_HEADER] = str(stage_executor.in_flight)
+        response.headers[QUEUE_CAPACITY_HEADER] = str(stage_executor.max_queue_depth)
+        return response
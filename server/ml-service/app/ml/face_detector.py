@@ -1,10 +1,14 @@
 import os
+import threading
+from typing import Optional
 import cv2
 import mediapipe as mp
 import numpy as np
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
 
+from app.core.config import settings
+
 MIN_FACE_AREA_RATIO = 0.04
 NUM_JITTERS = 3
 
@@ -12,9 +16,11 @@ NUM_JITTERS = 3
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 model_path = os.path.join(BASE_DIR, "blaze_face_short_range.tflite")
 
-# Lazy-initialized detector — created on first use to avoid import-time crash
-# if the model file has not yet been downloaded.
-_detector = None
+# Lazy-initialized detectors — created on first use to avoid import-time crash
+# if the model file has not yet been downloaded. One per worker thread, since
+# detection runs concurrently on the stage executor and a MediaPipe task
+# instance must not be shared between threads.
+_local = threading.local()
 
 
 def _check_model_exists():
@@ -28,8 +34,8 @@ def _check_model_exists():
 
 
 def _get_detector():
-    global _detector
-    if _detector is None:
+    detector = getattr(_local, "detector", None)
+    if detector is None:
         # Check if model file exists before loading
         _check_model_exists()
         base_options = python.BaseOptions(model_asset_path=model_path)
@@ -38,12 +44,13 @@ def _get_detector():
             running_mode=vision.RunningMode.IMAGE,
             min_detection_confidence=0.6,
         )
-        _detector = vision.FaceDetector.create_from_options(options)
-    return _detector
+        detector = vision.FaceDetector.create_from_options(options)
+        _local.detector = detector
+    return detector
 
 
-def detect_faces(image: np.ndarray) -> list[tuple[int, int, int, int]]:
-    """Detect faces in image. Expects RGB (e.g. from PIL Image.convert('RGB'))."""
+def _detect_scored(image: np.ndarray) -> list[tuple[tuple[int, int, int, int], float]]:
+    """Detected (box, score) pairs; boxes are (top, right, bottom, left)."""
     # API sends RGB from PIL; MediaPipe expects RGB — use as-is.
     if image.ndim == 2:
         image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
@@ -77,6 +84,139 @@ def detect_faces(image: np.ndarray) -> list[tuple[int, int, int, int]]:
         x2 = max(0, min(x2, w))
         y2 = max(0, min(y2, h))
 
-        faces.append((y1, x2, y2, x1))
+        score = detection.categories[0].score if detection.categories else 0.0
+        faces.append(((y1, x2, y2, x1), float(score)))
 
     return faces
+
+
+def detect_faces(
+    image: np.ndarray, max_side: Optional[int] = None
+) -> list[tuple[int, int, int, int]]:
+    """
+    Detect faces in image. Expects RGB (e.g. from PIL Image.convert('RGB')).
+
+    The detector's own input is tiny, so images whose longer side exceeds
+    ``max_side`` (default ``ML_DETECTION_MAX_SIDE``, 0 disables) are detected
+    on a downscaled copy. Boxes are returned in the original image's
+    coordinates, so callers crop faces from the full-resolution image.
+    """
+    if max_side is None:
+        max_side = settings.ML_DETECTION_MAX_SIDE
+
+    h, w = image.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return [box for box, _ in _detect_scored(image)]
+
+    scale = max_side / max(h, w)
+    small = cv2.resize(
+        image,
+        (max(1, round(w * scale)), max(1, round(h * scale))),
+        interpolation=cv2.INTER_AREA,
+    )
+    return [
+        (
+            min(h, round(top / scale)),
+            min(w, round(right / scale)),
+            min(h, round(bottom / scale)),
+            min(w, round(left / scale)),
+        )
+        for (top, right, bottom, left), _ in _detect_scored(small)
+    ]
+
+
+def _tile_origins(length: int, tile: int, step: int) -> list[int]:
+    """Start offsets covering [0, length) with tiles of ``tile`` pixels."""
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile, step))
+    origins.append(length - tile)
+    return origins
+
+
+def non_max_suppression(
+    detections: list[tuple[tuple[int, int, int, int], float]],
+    overlap_threshold: float = 0.5,
+) -> list[tuple[int, int, int, int]]:
+    """
+    Merge duplicate boxes, keeping the highest-scoring one.
+
+    Overlap is intersection over the *smaller* box rather than IoU, so a face
+    cut off at a tile edge is suppressed by the full detection from the
+    neighbouring tile even though their IoU is low.
+    """
+    kept: list[tuple[int, int, int, int]] = []
+    for box, _ in sorted(detections, key=lambda d: d[1], reverse=True):
+        top, right, bottom, left = box
+        area = max(0, right - left) * max(0, bottom - top)
+        duplicate = False
+        for k_top, k_right, k_bottom, k_left in kept:
+            inter_w = min(right, k_right) - max(left, k_left)
+            inter_h = min(bottom, k_bottom) - max(top, k_top)
+            if inter_w <= 0 or inter_h <= 0:
+                continue
+            k_area = (k_right - k_left) * (k_bottom - k_top)
+            smaller = min(area, k_area)
+            if smaller and inter_w * inter_h / smaller > overlap_threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(box)
+    return kept
+
+
+def tile_origins(
+    image_shape: tuple, tile_size: int, overlap: float
+) -> list[tuple[int, int]]:
+    """(y, x) origins of the overlapping tiles covering an image."""
+    h, w = image_shape[:2]
+    step = max(1, int(tile_size * (1 - overlap)))
+    return [
+        (y, x)
+        for y in _tile_origins(h, tile_size, step)
+        for x in _tile_origins(w, tile_size, step)
+    ]
+
+
+def detect_tile(
+    tile: np.ndarray, origin: tuple[int, int]
+) -> list[tuple[tuple[int, int, int, int], float]]:
+    """Scored detections of one tile, in the coordinates of the full image."""
+    y, x = origin
+    return [
+        ((top + y, right + x, bottom + y, left + x), score)
+        for (top, right, bottom, left), score in _detect_scored(
+            np.ascontiguousarray(tile)
+        )
+    ]
+
+
+def detect_faces_tiled(
+    image: np.ndarray, tile_size: int, overlap: float
+) -> list[tuple[int, int, int, int]]:
+    """
+    Detect small faces in a large image by running the detector per tile.
+
+    The short-range model sees the whole frame at its small input size, so
+    distant faces in a high-resolution photo shrink to a few pixels. Here the
+    image is split into overlapping ``tile_size`` squares (``overlap`` is a
+    fraction of the tile), each tile is detected and the boxes are mapped
+    back to full-image coordinates and merged with NMS.
+
+    Tiles are detected one after another; the API routes submit them to the
+    stage executor separately instead, so they run in parallel within its
+    bounds.
+    """
+    origins = tile_origins(image.shape, tile_size, overlap)
+    if len(origins) == 1:
+        return detect_faces(image, max_side=0)
+
+    return non_max_suppression(
+        [
+            detection
+            for y, x in origins
+            for detection in detect_tile(
+                image[y : y + tile_size, x : x + tile_size], (y, x)
+            )
+        ]
+    )
@@ -1,19 +1,204 @@
-from typing import List
+"""
+Face embeddings behind a pluggable encoder.
+
+``ML_ENCODER`` selects the backend:
+
+* ``patch`` - the original normalized 96x96 grayscale patch (9216-d). Kept
+  so embeddings stored before the learned encoder remain usable.
+* ``sface`` - OpenCV's SFace recognition model (128-d) run on CPU through
+  OpenCV DNN.
+
+Every encoder has a ``model_version`` that is returned with each embedding
+and stored next to it, so embeddings of different encoders are never
+matched against each other.
+"""
+
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence
 
 import cv2
 import numpy as np
 
+from app.core.config import settings
+
 MIN_FACE_AREA_RATIO = 0.05  # face must cover at least 5% of image
 NUM_JITTERS = 5  # stronger embedding (1 is default)
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SFACE_MODEL_PATH = os.path.join(BASE_DIR, "face_recognition_sface_2021dec.onnx")
 
-def get_face_embedding(face_img: np.ndarray) -> List[float]:
-    """Embedding from face crop. Expects RGB (e.g. from PIL/API)."""
+
+def _face_patch(face_img: np.ndarray) -> np.ndarray:
     if face_img.ndim == 2:
         gray = face_img
     else:
         gray = cv2.cvtColor(face_img, cv2.COLOR_RGB2GRAY)
-    resized = cv2.resize(gray, (96, 96))
-    emb = resized.flatten().astype("float32")
-    emb /= np.linalg.norm(emb)
-    return emb.tolist()
+    return cv2.resize(gray, (96, 96))
+
+
+def _jitter_views(
+    face_img: np.ndarray, size: int, num_jitters: int
+) -> List[np.ndarray]:
+    """
+    Up to ``num_jitters`` deterministic views of a crop, resized to ``size``.
+
+    The original comes first, then its mirror image, then slightly shifted
+    and zoomed crops, so averaging their embeddings smooths out small
+    detector box errors.
+    """
+    h, w = face_img.shape[:2]
+    dy, dx = max(1, h // 16), max(1, w // 16)
+    boxes = [
+        (0, h, 0, w),
+        None,  # mirror of the full crop
+        (0, h - dy, 0, w - dx),
+        (dy, h, dx, w),
+        (0, h - dy, dx, w),
+        (dy, h, 0, w - dx),
+        (dy, h - dy, dx, w - dx),
+    ]
+    views = []
+    for box in boxes[: max(1, num_jitters)]:
+        if box is None:
+            view = cv2.flip(face_img, 1)
+        else:
+            top, bottom, left, right = box
+            view = face_img[top:bottom, left:right]
+        views.append(cv2.resize(view, (size, size)))
+    return views
+
+
+class FaceEncoder(ABC):
+    """Turns RGB face crops into L2-normalized float32 embeddings."""
+
+    model_version: str
+    dimension: int
+
+    @abstractmethod
+    def embed(
+        self, face_imgs: Sequence[np.ndarray], num_jitters: int = 1
+    ) -> np.ndarray:
+        """Embeddings for several face crops, one row per crop."""
+
+    def check_available(self) -> None:
+        """Raise if the encoder cannot run here, e.g. its model is missing."""
+
+
+class PatchEncoder(FaceEncoder):
+    """Legacy grayscale-patch embedding; ``num_jitters`` has no effect."""
+
+    model_version = "patch-96-v1"
+    dimension = 96 * 96
+
+    def embed(
+        self, face_imgs: Sequence[np.ndarray], num_jitters: int = 1
+    ) -> np.ndarray:
+        # Crops are resized individually and then flattened and normalized
+        # as a single (N, 9216) float32 matrix.
+        if not face_imgs:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        patches = np.stack([_face_patch(img) for img in face_imgs])
+        embs = patches.reshape(len(face_imgs), -1).astype(np.float32)
+        embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+        return embs
+
+
+class DnnEncoder(FaceEncoder):
+    """
+    Learned face-recognition model run on CPU with OpenCV DNN.
+
+    The network is loaded lazily, once per worker thread, since a
+    ``cv2.dnn.Net`` must not run concurrently from several threads.
+    """
+
+    def __init__(
+        self, model_path: str, model_version: str, dimension: int, input_size: int
+    ):
+        self.model_path = model_path
+        self.model_version = model_version
+        self.dimension = dimension
+        self.input_size = input_size
+        self._local = threading.local()
+
+    def check_available(self) -> None:
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"Model file not found: {self.model_path}. "
+                "Run 'python download_models.py' or check Docker volume mounts."
+            )
+
+    def _net(self) -> "cv2.dnn.Net":
+        net = getattr(self._local, "net", None)
+        if net is None:
+            self.check_available()
+            net = cv2.dnn.readNetFromONNX(self.model_path)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            self._local.net = net
+        return net
+
+    def embed(
+        self, face_imgs: Sequence[np.ndarray], num_jitters: int = 1
+    ) -> np.ndarray:
+        embs = np.zeros((len(face_imgs), self.dimension), dtype=np.float32)
+        if not face_imgs:
+            return embs
+
+        net = self._net()
+        for i, face_img in enumerate(face_imgs):
+            if face_img.ndim == 2:
+                face_img = cv2.cvtColor(face_img, cv2.COLOR_GRAY2RGB)
+            # The exported model has a fixed batch of one, so views run singly.
+            # Crops are already RGB, which is what the model was trained on.
+            for view in _jitter_views(face_img, self.input_size, num_jitters):
+                net.setInput(cv2.dnn.blobFromImage(view, 1.0, swapRB=False))
+                embs[i] += net.forward().reshape(-1)
+
+        norms = np.linalg.norm(embs, axis=1, keepdims=True)
+        np.divide(embs, norms, out=embs, where=norms > 0)
+        return embs
+
+
+ENCODERS = {
+    "patch": PatchEncoder,
+    "sface": lambda: DnnEncoder(
+        SFACE_MODEL_PATH, "sface-2021dec", dimension=128, input_size=112
+    ),
+}
+
+_encoders: Dict[str, FaceEncoder] = {}
+_encoder_lock = threading.Lock()
+
+
+def get_encoder(name: Optional[str] = None) -> FaceEncoder:
+    """
+    The named encoder, or the one selected by ``ML_ENCODER``, created on
+    first use. Several encoders can be loaded at once so stored embeddings
+    can be re-encoded while the active one keeps serving.
+    """
+    name = name or settings.ML_ENCODER
+    encoder = _encoders.get(name)
+    if encoder is None:
+        with _encoder_lock:
+            encoder = _encoders.get(name)
+            if encoder is None:
+                if name not in ENCODERS:
+                    raise ValueError(
+                        f"Unknown encoder {name!r}; expected one of {sorted(ENCODERS)}"
+                    )
+                encoder = _encoders[name] = ENCODERS[name]()
+    return encoder
+
+
+def get_face_embedding(face_img: np.ndarray, num_jitters: int = 1) -> List[float]:
+    """Embedding from face crop. Expects RGB (e.g. from PIL/API)."""
+    return get_encoder().embed([face_img], num_jitters)[0].tolist()
+
+
+def get_face_embeddings(
+    face_imgs: Sequence[np.ndarray], num_jitters: int = 1
+) -> np.ndarray:
+    """Embeddings for several face crops at once, one row per crop."""
+    return get_encoder().embed(face_imgs, num_jitters)
@@ -1,4 +1,4 @@
-from typing import List, Union
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
 
 import numpy as np
 
@@ -15,3 +15,122 @@ def cosine_similarity(
     if norm_a == 0 or norm_b == 0:
         return 0.0
     return float(np.dot(a_arr, b_arr) / (norm_a * norm_b))
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row in place; all-zero rows are left as zeros."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+class Gallery:
+    """
+    Candidate embeddings packed into a single normalized float32 matrix.
+
+    Rows belonging to the same student are contiguous, so scoring N faces
+    against the whole roster is one matrix multiply followed by a
+    per-student max-reduce over each student's slice of columns.
+    """
+
+    def __init__(self, student_ids: List[str], matrix: np.ndarray, offsets: np.ndarray):
+        self.student_ids = student_ids
+        self.matrix = matrix
+        # offsets[i] is the first matrix row owned by student_ids[i]
+        self.offsets = offsets
+        # Encoder that produced the embeddings, when the caller tagged them
+        self.model_version: Optional[str] = None
+
+    @classmethod
+    def from_candidates(
+        cls, candidates: Iterable[Tuple[str, Sequence[Sequence[float]]]]
+    ) -> "Gallery":
+        """Build a gallery from (student_id, embeddings) pairs."""
+        student_ids: List[str] = []
+        blocks: List[np.ndarray] = []
+        offsets: List[int] = []
+        row = 0
+
+        for student_id, embeddings in candidates:
+            if len(embeddings) == 0:
+                continue
+            block = np.asarray(embeddings, dtype=np.float32)
+            if block.ndim == 1:
+                block = block.reshape(1, -1)
+            student_ids.append(student_id)
+            offsets.append(row)
+            blocks.append(block)
+            row += block.shape[0]
+
+        if not blocks:
+            return cls([], np.zeros((0, 0), dtype=np.float32), np.zeros(0, np.intp))
+
+        matrix = normalize_rows(np.concatenate(blocks, axis=0))
+        return cls(student_ids, matrix, np.asarray(offsets, dtype=np.intp))
+
+    def __len__(self) -> int:
+        return len(self.student_ids)
+
+    def subset(self, indices: Sequence[int]) -> "Gallery":
+        """Gallery of the students at ``indices``, with their rows copied."""
+        indices = np.asarray(indices, dtype=np.intp)
+        if len(indices) == 0:
+            matrix = np.zeros((0, self.matrix.shape[1]), np.float32)
+            empty = Gallery([], matrix, np.zeros(0, np.intp))
+            empty.model_version = self.model_version
+            return empty
+
+        ends = np.append(self.offsets[1:], self.matrix.shape[0])
+        starts = self.offsets[indices]
+        counts = ends[indices] - starts
+        rows = np.concatenate([np.arange(s, s + c) for s, c in zip(starts, counts)])
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.intp)
+
+        subset = Gallery(
+            [self.student_ids[i] for i in indices], self.matrix[rows], offsets
+        )
+        subset.model_version = self.model_version
+        return subset
+
+    @property
+    def dimension(self) -> int:
+        return self.matrix.shape[1]
+
+    def student_scores(
+        self, queries: Union[Sequence[Sequence[float]], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Best cosine similarity of every query against every student.
+
+        Returns an array of shape (n_queries, n_students).
+        """
+        q = normalize_rows(np.array(queries, dtype=np.float32, ndmin=2))
+        if not self.student_ids:
+            return np.zeros((q.shape[0], 0), dtype=np.float32)
+        if q.shape[1] != self.dimension:
+            raise ValueError(
+                f"Embedding dimension {q.shape[1]} does not match gallery "
+                f"dimension {self.dimension}"
+            )
+        scores = q @ self.matrix.T
+        return np.maximum.reduceat(scores, self.offsets, axis=1)
+
+    def best_matches(
+        self, queries: Union[Sequence[Sequence[float]], np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Best matching student per query.
+
+        Returns (student_index, score) arrays. When the gallery is empty the
+        index is -1 and the score is -1.0, mirroring "no candidate".
+        """
+        return self.best_of(self.student_scores(queries))
+
+    @staticmethod
+    def best_of(per_student: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Best student index and score per row of a student_scores result."""
+        n = per_student.shape[0]
+        if per_student.shape[1] == 0:
+            return np.full(n, -1, dtype=np.intp), np.full(n, -1.0, dtype=np.float32)
+        best_idx = np.argmax(per_student, axis=1)
+        return best_idx, per_student[np.arange(n), best_idx]
@@ -0,0 +1,235 @@
+"""
+Face tracks of live recognition sessions.
+
+A classroom camera sees the same, mostly still faces frame after frame. A
+session's tracker follows each face from frame to frame by box overlap (IoU)
+and keeps the last liveness and match result of its track. A face that
+continues a track recognized less than ``ML_TRACK_REFRESH_SECONDS`` ago
+reuses that result, so only detection runs for it; new faces and tracks due
+for a refresh go through liveness, embedding and matching again.
+
+The tracker also remembers which students the session has confirmed, i.e.
+matched confidently on a live face. Faces are matched against the students
+not confirmed yet first, and only a face without a confident match there
+(typically a confirmed student being re-verified or back in view) is
+compared with the confirmed students, so matching shrinks as attendance
+fills up.
+
+Trackers are only used from the event loop. The detect stage, which may run
+in another process, gets the fresh tracks as plain (track_id, box) pairs and
+associates boxes with ``match_tracks``.
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from app.core.config import settings
+from app.ml.face_matcher import Gallery
+
+Box = Tuple[int, int, int, int]  # (top, right, bottom, left)
+
+
+def iou(a: Box, b: Box) -> float:
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    a_top, a_right, a_bottom, a_left = a
+    b_top, b_right, b_bottom, b_left = b
+    inter_w = min(a_right, b_right) - max(a_left, b_left)
+    inter_h = min(a_bottom, b_bottom) - max(a_top, b_top)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    area_a = (a_right - a_left) * (a_bottom - a_top)
+    area_b = (b_right - b_left) * (b_bottom - b_top)
+    return inter / float(area_a + area_b - inter)
+
+
+def match_tracks(
+    boxes: Sequence[Box],
+    tracks: Sequence[Tuple[int, Box]],
+    iou_threshold: float,
+) -> Dict[int, int]:
+    """
+    Greedily pair boxes with tracks, best overlap first.
+
+    Returns box index -> track_id for every pair overlapping by at least
+    ``iou_threshold``; each box and track is used at most once.
+    """
+    pairs = sorted(
+        (
+            (overlap, box_idx, track_id)
+            for box_idx, box in enumerate(boxes)
+            for track_id, track_box in tracks
+            if (overlap := iou(box, track_box)) >= iou_threshold
+        ),
+        key=lambda p: p[0],
+        reverse=True,
+    )
+    assigned: Dict[int, int] = {}
+    used_tracks = set()
+    for _, box_idx, track_id in pairs:
+        if box_idx in assigned or track_id in used_tracks:
+            continue
+        assigned[box_idx] = track_id
+        used_tracks.add(track_id)
+    return assigned
+
+
+@dataclass
+class Track:
+    track_id: int
+    box: Box
+    last_seen: float
+    # When liveness and matching last ran for this face
+    recognized_at: float
+    is_live: bool
+    # (student_id, similarity) of the best candidate, None without one
+    best: Optional[Tuple[str, float]]
+    # Gallery the match was made against; a new gallery invalidates it
+    gallery: Any
+
+
+class FaceTracker:
+    """Tracks of one live session."""
+
+    def __init__(
+        self,
+        iou_threshold: float,
+        refresh_seconds: float,
+        max_age_seconds: float,
+    ):
+        self.iou_threshold = iou_threshold
+        self.refresh_seconds = refresh_seconds
+        self.max_age_seconds = max_age_seconds
+        self._tracks: Dict[int, Track] = {}
+        self._next_id = 1
+        self.confirmed: Set[str] = set()
+        # (gallery, confirmed count) -> its (unconfirmed, confirmed) parts
+        self._split: Optional[Tuple[Any, int, Gallery, Gallery]] = None
+
+    def fresh_tracks(self, gallery: Any) -> Dict[int, Track]:
+        """Tracks whose result can be reused for a frame matched on ``gallery``."""
+        now = time.monotonic()
+        return {
+            track_id: track
+            for track_id, track in self._tracks.items()
+            if track.gallery is gallery
+            and now - track.recognized_at < self.refresh_seconds
+            and now - track.last_seen < self.max_age_seconds
+        }
+
+    def split_gallery(self, gallery: Gallery) -> Tuple[Gallery, Gallery]:
+        """
+        The gallery's students not confirmed yet and those confirmed, rebuilt
+        only when a student is confirmed or the gallery changes.
+        """
+        split = self._split
+        if split is None or split[0] is not gallery or split[1] != len(self.confirmed):
+            unconfirmed, confirmed = [], []
+            for i, student_id in enumerate(gallery.student_ids):
+                (confirmed if student_id in self.confirmed else unconfirmed).append(i)
+            split = (
+                gallery,
+                len(self.confirmed),
+                gallery.subset(unconfirmed) if confirmed else gallery,
+                gallery.subset(confirmed),
+            )
+            self._split = split
+        return split[2], split[3]
+
+    def update(
+        self, faces: List[Dict[str, Any]], gallery: Any, confirm_threshold: float
+    ) -> None:
+        """
+        Record a frame's faces and set each face's ``track_id``.
+
+        Faces that reused a track (``track_id`` set by the detect stage) only
+        move it; recognized faces update the track they overlap or start a
+        new one. Tracks not seen for ``max_age_seconds`` are dropped. Live
+        faces matched with at least ``confirm_threshold`` confirm their
+        student.
+        """
+        now = time.monotonic()
+        seen = set()
+        recognized = []
+        for face in faces:
+            track = self._tracks.get(face.get("track_id"))
+            if track is not None:
+                track.box = face["location"]
+                track.last_seen = now
+                seen.add(track.track_id)
+            else:
+                recognized.append(face)
+
+        candidates = [
+            (track_id, track.box)
+            for track_id, track in self._tracks.items()
+            if track_id not in seen
+        ]
+        assigned = match_tracks(
+            [face["location"] for face in recognized], candidates, self.iou_threshold
+        )
+        for i, face in enumerate(recognized):
+            track_id = assigned.get(i)
+            if track_id is None:
+                track_id = self._next_id
+                self._next_id += 1
+            self._tracks[track_id] = Track(
+                track_id=track_id,
+                box=face["location"],
+                last_seen=now,
+                recognized_at=now,
+                is_live=face["is_live"],
+                best=face.get("best"),
+                gallery=gallery,
+            )
+            face["track_id"] = track_id
+            seen.add(track_id)
+            best = face.get("best")
+            if face["is_live"] and best is not None and best[1] >= confirm_threshold:
+                self.confirmed.add(best[0])
+
+        for track_id, track in list(self._tracks.items()):
+            if track_id not in seen and now - track.last_seen >= self.max_age_seconds:
+                del self._tracks[track_id]
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+
+class TrackerStore:
+    """Trackers keyed by session id, bounded by LRU size and idle TTL."""
+
+    def __init__(self, max_sessions: int, ttl_seconds: float):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._trackers: "OrderedDict[str, Tuple[FaceTracker, float]]" = OrderedDict()
+
+    def get(self, session_id: str) -> FaceTracker:
+        now = time.monotonic()
+        entry = self._trackers.pop(session_id, None)
+        if entry is None or now - entry[1] >= self.ttl_seconds:
+            tracker = FaceTracker(
+                iou_threshold=settings.ML_TRACK_IOU_THRESHOLD,
+                refresh_seconds=settings.ML_TRACK_REFRESH_SECONDS,
+                max_age_seconds=settings.ML_TRACK_MAX_AGE_SECONDS,
+            )
+        else:
+            tracker = entry[0]
+        self._trackers[session_id] = (tracker, now)
+        while len(self._trackers) > self.max_sessions:
+            self._trackers.popitem(last=False)
+        return tracker
+
+    def clear(self) -> None:
+        self._trackers.clear()
+
+    def __len__(self) -> int:
+        return len(self._trackers)
+
+
+tracker_store = TrackerStore(
+    max_sessions=settings.ML_TRACK_MAX_SESSIONS,
+    ttl_seconds=settings.ML_TRACK_SESSION_TTL_SECONDS,
+)
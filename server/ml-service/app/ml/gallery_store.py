@@ -0,0 +1,76 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.core.config import settings
+from app.ml.face_matcher import Gallery
+
+
+def gallery_content_hash(gallery: Gallery) -> str:
+    """Stable content hash of a packed gallery (student order + vectors)."""
+    digest = hashlib.sha1()
+    digest.update("\x00".join(gallery.student_ids).encode("utf-8"))
+    digest.update(gallery.offsets.tobytes())
+    digest.update(gallery.matrix.tobytes())
+    return digest.hexdigest()
+
+
+class GalleryStore:
+    """
+    Registered galleries keyed by gallery_id, bounded by LRU size and TTL.
+
+    Each entry is pinned to the version it was registered with; a lookup for
+    a different version is treated as a miss so callers re-register.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[str, Gallery, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, gallery_id: str, version: str, gallery: Gallery) -> None:
+        with self._lock:
+            self._entries[gallery_id] = (
+                version,
+                gallery,
+                time.monotonic() + self.ttl_seconds,
+            )
+            self._entries.move_to_end(gallery_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, gallery_id: str, version: Optional[str] = None) -> Optional[Gallery]:
+        with self._lock:
+            entry = self._entries.get(gallery_id)
+            if entry is None:
+                return None
+
+            stored_version, gallery, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[gallery_id]
+                return None
+            if version is not None and version != stored_version:
+                return None
+
+            self._entries.move_to_end(gallery_id)
+            return gallery
+
+    def invalidate(self, gallery_id: str) -> bool:
+        with self._lock:
+            return self._entries.pop(gallery_id, None) is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+gallery_store = GalleryStore(
+    max_entries=settings.GALLERY_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.GALLERY_CACHE_TTL_SECONDS,
+)
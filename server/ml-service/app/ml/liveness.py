@@ -1,9 +1,14 @@
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
 import cv2
 import numpy as np
 import mediapipe as mp
 import logging
 from app.core.config import settings
+from app.core.metrics import LIVENESS_MESH_CHECKOUT_SECONDS
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -22,6 +27,93 @@ LIVENESS_FAIL_OPEN = os.getenv("LIVENESS_FAIL_OPEN", "false").lower() == "true"
 mp_face_mesh = mp.solutions.face_mesh
 
 
+class FaceMeshPool:
+    """
+    Long-lived FaceMesh graphs shared by liveness checks.
+
+    Building a FaceMesh loads its graph and model, which costs far more than
+    a single inference, so instances are created once (lazily, or up front
+    via ``warm``) and checked out per face crop. A FaceMesh must not be used
+    by two threads at once; with one instance per stage-executor thread,
+    checkouts normally never wait.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create(self):
+        return mp_face_mesh.FaceMesh(
+            static_image_mode=True,
+            max_num_faces=1,
+            refine_landmarks=True,
+            min_detection_confidence=0.5,
+        )
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if not can_create:
+            return self._idle.get()
+
+        try:
+            return self._create()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, mesh) -> None:
+        with self._lock:
+            self._created -= 1
+        try:
+            mesh.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def checkout(self):
+        start = time.perf_counter()
+        mesh = self._acquire()
+        LIVENESS_MESH_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+        try:
+            yield mesh
+        except Exception:
+            # A graph that failed mid-inference is not trusted again
+            self._discard(mesh)
+            raise
+        else:
+            self._idle.put(mesh)
+
+    def warm(self) -> None:
+        """Create every instance now so the first requests don't pay for it."""
+        meshes = [self._acquire() for _ in range(self.size)]
+        for mesh in meshes:
+            self._idle.put(mesh)
+
+    def close(self) -> None:
+        while True:
+            try:
+                mesh = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(mesh)
+
+
+face_mesh_pool = FaceMeshPool(
+    settings.ML_FACE_MESH_POOL_SIZE or settings.ML_THREAD_WORKERS or os.cpu_count() or 1
+)
+
+
 def is_live(face_crop: np.ndarray) -> bool:
     """
     Check if the provided face crop represents a live person.
@@ -88,12 +180,7 @@ def is_live(face_crop: np.ndarray) -> bool:
         f"Liveness Checks Passed: Variance={variance:.2f}, StdDev={avg_std:.2f}"
     )
     try:
-        with mp_face_mesh.FaceMesh(
-            static_image_mode=True,
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-        ) as face_mesh:
+        with face_mesh_pool.checkout() as face_mesh:
             results = face_mesh.process(rgb)
 
             # If no landmarks detected, likely a spoof or bad crop
@@ -1,5 +1,8 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
+
+from app.core.constants import MAX_BATCH_IMAGES
+from app.utils.embedding_codec import Embedding
 
 
 class EncodeFaceRequest(BaseModel):
@@ -17,7 +20,50 @@ class EncodeFaceRequest(BaseModel):
     )
 
 
-class DetectFacesRequest(BaseModel):
+class EncodeFacesBatchRequest(BaseModel):
+    """Request to encode the single face of each of several images"""
+
+    images: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=MAX_BATCH_IMAGES,
+        description="Base64 encoded image strings",
+    )
+    validate_single: bool = Field(
+        default=True, description="Validate that exactly one face exists"
+    )
+    min_face_area_ratio: float = Field(
+        default=0.05, description="Minimum face area ratio"
+    )
+    num_jitters: int = Field(
+        default=5, description="Number of times to re-sample face for encoding"
+    )
+    encoder: Optional[str] = Field(
+        default=None,
+        description="Encoder to use, e.g. 'sface'; defaults to ML_ENCODER",
+    )
+
+
+class DetectionOptions(BaseModel):
+    """How faces are located in the image"""
+
+    model: str = Field(
+        default="hog",
+        description="Detection model: 'tiled' detects per overlapping tile for "
+        "high-resolution images; any other value detects on the whole image",
+    )
+    tile_size: Optional[int] = Field(
+        default=None, ge=128, description="Tile edge in pixels (tiled model only)"
+    )
+    tile_overlap: Optional[float] = Field(
+        default=None,
+        ge=0.0,
+        lt=1.0,
+        description="Overlap between neighbouring tiles as a fraction of the tile",
+    )
+
+
+class DetectFacesRequest(DetectionOptions):
     """Request to detect multiple faces from an image"""
 
     image_base64: str = Field(..., description="Base64 encoded image string")
@@ -27,25 +73,55 @@ class DetectFacesRequest(BaseModel):
     num_jitters: int = Field(
         default=3, description="Number of times to re-sample face for encoding"
     )
-    model: str = Field(default="hog", description="Detection model: hog or cnn")
 
 
 class CandidateEmbedding(BaseModel):
     """Candidate student embeddings for matching"""
 
     student_id: str = Field(..., description="Student ID")
-    embeddings: List[List[float]] = Field(
+    embeddings: List[Embedding] = Field(
         ..., description="List of face embeddings for this student"
     )
 
 
-class MatchFacesRequest(BaseModel):
-    """Request to match a single face embedding against candidates"""
+class RegisterGalleryRequest(BaseModel):
+    """Request to register a candidate gallery for reuse across match calls"""
 
-    query_embedding: List[float] = Field(..., description="Face embedding to match")
+    gallery_id: str = Field(..., description="Gallery identifier, e.g. subject ID")
+    version: Optional[str] = Field(
+        default=None,
+        description="Gallery version; a content hash is computed when omitted",
+    )
     candidate_embeddings: List[CandidateEmbedding] = Field(
         ..., description="Candidate students with embeddings"
     )
+    model_version: Optional[str] = Field(
+        default=None, description="Encoder version that produced the embeddings"
+    )
+
+
+class GalleryReference(BaseModel):
+    """Candidates given inline or as a reference to a registered gallery"""
+
+    candidate_embeddings: Optional[List[CandidateEmbedding]] = Field(
+        default=None, description="Inline candidate students with embeddings"
+    )
+    gallery_id: Optional[str] = Field(
+        default=None, description="ID of a previously registered gallery"
+    )
+    gallery_version: Optional[str] = Field(
+        default=None, description="Expected version of the registered gallery"
+    )
+    model_version: Optional[str] = Field(
+        default=None,
+        description="Encoder version of the inline candidate embeddings",
+    )
+
+
+class MatchFacesRequest(GalleryReference):
+    """Request to match a single face embedding against candidates"""
+
+    query_embedding: Embedding = Field(..., description="Face embedding to match")
     threshold: float = Field(default=0.6, description="Distance threshold for matching")
     return_all_distances: bool = Field(
         default=False, description="Return distances for all candidates"
@@ -55,24 +131,69 @@ class MatchFacesRequest(BaseModel):
 class DetectedFace(BaseModel):
     """A detected face with embedding"""
 
-    embedding: List[float] = Field(..., description="Face embedding")
+    embedding: Embedding = Field(..., description="Face embedding")
     is_live: bool = Field(
         default=True, description="Whether the face was detected as live"
     )
 
 
-class BatchMatchRequest(BaseModel):
+class BatchMatchRequest(GalleryReference):
     """Request to match multiple detected faces against candidates"""
 
     detected_faces: List[DetectedFace] = Field(
         ..., description="List of detected faces to match"
     )
-    candidate_embeddings: List[CandidateEmbedding] = Field(
-        ..., description="Candidate students with embeddings"
-    )
     confident_threshold: float = Field(
         default=0.50, description="Threshold for confident match"
     )
     uncertain_threshold: float = Field(
         default=0.60, description="Threshold for uncertain match"
     )
+
+
+class RecognizeFrameOptions(GalleryReference, DetectionOptions):
+    """How the faces of a frame are detected and matched"""
+
+    min_face_area_ratio: float = Field(
+        default=0.01, description="Minimum face area ratio"
+    )
+    threshold: float = Field(
+        default=0.6, description="Minimum similarity for a face to be matched"
+    )
+    session_id: Optional[str] = Field(
+        default=None,
+        description="Live session whose faces are tracked across frames; "
+        "tracked faces reuse their last liveness and match result",
+    )
+    confirm_threshold: Optional[float] = Field(
+        default=None,
+        description="Similarity at which a session confirms a student, who is "
+        "then only compared with faces lacking a confident match (defaults to "
+        "threshold; values below threshold count as threshold)",
+    )
+
+
+class RecognizeFrameRequest(RecognizeFrameOptions):
+    """Request to detect, liveness-check and match every face in a frame"""
+
+    image_base64: str = Field(..., description="Base64 encoded image string")
+
+
+class DetectFacesBatchRequest(GalleryReference, DetectionOptions):
+    """Request to detect faces in several images of the same room"""
+
+    images: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=MAX_BATCH_IMAGES,
+        description="Base64 encoded image strings",
+    )
+    min_face_area_ratio: float = Field(
+        default=0.01, description="Minimum face area ratio"
+    )
+    threshold: float = Field(
+        default=0.6, description="Minimum similarity for a face to be matched"
+    )
+    return_embeddings: bool = Field(
+        default=False, description="Include each face's embedding in the response"
+    )
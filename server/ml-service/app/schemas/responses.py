@@ -1,6 +1,8 @@
 from pydantic import BaseModel
 from typing import Optional, List
 
+from app.utils.embedding_codec import EncodedEmbedding
+
 
 class FaceLocation(BaseModel):
     """Face location in image"""
@@ -22,17 +24,39 @@ class EncodeFaceResponse(BaseModel):
     """Response from encode face endpoint"""
 
     success: bool
-    embedding: Optional[List[float]] = None
+    embedding: Optional[EncodedEmbedding] = None
+    model_version: Optional[str] = None
     face_location: Optional[FaceLocation] = None
     metadata: Optional[EncodeFaceMetadata] = None
     error: Optional[str] = None
     error_code: Optional[str] = None
 
 
+class EncodeFacesBatchResponse(BaseModel):
+    """Response from encode faces batch endpoint, one result per image"""
+
+    success: bool
+    results: List[EncodeFaceResponse] = []
+    model_version: Optional[str] = None
+    error: Optional[str] = None
+    error_code: Optional[str] = None
+
+
+class EncoderInfoResponse(BaseModel):
+    """Response from encoder info endpoint"""
+
+    success: bool
+    encoder: str
+    model_version: Optional[str] = None
+    dimension: Optional[int] = None
+    error: Optional[str] = None
+    error_code: Optional[str] = None
+
+
 class DetectedFaceInfo(BaseModel):
     """Information about a detected face"""
 
-    embedding: List[float]
+    embedding: EncodedEmbedding
     location: FaceLocation
     face_area_ratio: float
     is_live: bool = True
@@ -51,6 +75,7 @@ class DetectFacesResponse(BaseModel):
     success: bool
     faces: List[DetectedFaceInfo] = []
     count: int = 0
+    model_version: Optional[str] = None
     metadata: Optional[DetectFacesMetadata] = None
     error: Optional[str] = None
 
@@ -78,6 +103,7 @@ class MatchFacesResponse(BaseModel):
     match: Optional[MatchResult] = None
     all_distances: Optional[List[DistanceInfo]] = None
     error: Optional[str] = None
+    error_code: Optional[str] = None
 
 
 class BatchMatchResult(BaseModel):
@@ -96,6 +122,97 @@ class BatchMatchResponse(BaseModel):
     success: bool
     matches: List[BatchMatchResult] = []
     error: Optional[str] = None
+    error_code: Optional[str] = None
+
+
+class RecognizedFace(BaseModel):
+    """A detected face with its liveness and match result"""
+
+    location: FaceLocation
+    face_area_ratio: float
+    is_live: bool = True
+    match: Optional[MatchResult] = None
+
+
+class TrackedFace(RecognizedFace):
+    """A face of a live session frame"""
+
+    track_id: Optional[int] = None
+    # True when liveness and match were reused from the face's track
+    tracked: bool = False
+
+
+class RecognizeFrameResponse(BaseModel):
+    """Response from recognize frame endpoint"""
+
+    success: bool
+    faces: List[TrackedFace] = []
+    count: int = 0
+    metadata: Optional[DetectFacesMetadata] = None
+    error: Optional[str] = None
+    error_code: Optional[str] = None
+
+
+class BatchDetectedFace(RecognizedFace):
+    """A face from a multi-image request"""
+
+    embedding: Optional[EncodedEmbedding] = None
+    # True when the same student was matched with higher confidence elsewhere
+    duplicate: bool = False
+
+
+class ImageDetectionResult(BaseModel):
+    """Faces found in one image of a multi-image request"""
+
+    image_index: int
+    success: bool
+    faces: List[BatchDetectedFace] = []
+    count: int = 0
+    image_dimensions: Optional[List[int]] = None
+    error: Optional[str] = None
+    error_code: Optional[str] = None
+
+
+class StudentSighting(BaseModel):
+    """Best match of a student across all images of a request"""
+
+    student_id: str
+    image_index: int
+    face_index: int
+    distance: float
+    confidence: float
+    sightings: int
+
+
+class DetectFacesBatchResponse(BaseModel):
+    """Response from detect faces batch endpoint"""
+
+    success: bool
+    images: List[ImageDetectionResult] = []
+    students: List[StudentSighting] = []
+    count: int = 0
+    model_version: Optional[str] = None
+    processing_time_ms: Optional[float] = None
+    error: Optional[str] = None
+    error_code: Optional[str] = None
+
+
+class RegisterGalleryResponse(BaseModel):
+    """Response from gallery registration"""
+
+    success: bool
+    gallery_id: Optional[str] = None
+    version: Optional[str] = None
+    student_count: int = 0
+    embedding_count: int = 0
+    error: Optional[str] = None
+
+
+class InvalidateGalleryResponse(BaseModel):
+    """Response from gallery invalidation"""
+
+    success: bool
+    invalidated: bool = False
 
 
 class HealthResponse(BaseModel):
@@ -0,0 +1,82 @@
+"""
+Embedding wire format.
+
+Embeddings can travel either as JSON float lists or as compact strings of
+the form ``"<format>:<base64>"`` holding little-endian float32 (``f32``) or
+float16 (``f16``) buffers. Encoded strings are decoded with ``np.frombuffer``
+so no per-element parsing happens in Python or Pydantic.
+
+Clients ask for encoded embeddings in responses with the
+``X-Embedding-Format`` request header; the service echoes the format it
+used so older clients that never send the header keep receiving JSON.
+"""
+
+import base64
+from typing import Annotated, Any, List, Union
+
+import numpy as np
+from fastapi import Header
+from pydantic import BeforeValidator, WithJsonSchema
+
+EMBEDDING_FORMAT_HEADER = "X-Embedding-Format"
+
+FORMAT_JSON = "json"
+BINARY_FORMATS = {"f32": np.dtype("<f4"), "f16": np.dtype("<f2")}
+
+
+def decode_embedding(value: Any) -> np.ndarray:
+    """Decode an embedding sent as a float list or an encoded string."""
+    if isinstance(value, np.ndarray):
+        return value
+    if isinstance(value, str):
+        fmt, sep, payload = value.partition(":")
+        dtype = BINARY_FORMATS.get(fmt)
+        if not sep or dtype is None:
+            raise ValueError(f"Unsupported embedding encoding '{fmt}'")
+        try:
+            raw = base64.b64decode(payload, validate=True)
+        except Exception:
+            raise ValueError("Invalid base64 embedding")
+        if len(raw) % dtype.itemsize:
+            raise ValueError("Embedding buffer size is not a multiple of its dtype")
+        return np.frombuffer(raw, dtype=dtype)
+    if isinstance(value, (list, tuple)):
+        return np.asarray(value, dtype=np.float32)
+    raise ValueError("Embedding must be a list of floats or an encoded string")
+
+
+def encode_embedding(
+    embedding: Union[List[float], np.ndarray], fmt: str
+) -> Union[List[float], str]:
+    """Encode an embedding for a response in the negotiated format."""
+    dtype = BINARY_FORMATS.get(fmt)
+    if dtype is None:
+        if isinstance(embedding, np.ndarray):
+            return embedding.astype(np.float32).tolist()
+        return embedding
+    raw = np.asarray(embedding, dtype=dtype).tobytes()
+    return f"{fmt}:{base64.b64encode(raw).decode('ascii')}"
+
+
+def get_embedding_format(
+    x_embedding_format: str = Header(default=FORMAT_JSON),
+) -> str:
+    """Response embedding format requested by the client (JSON if unknown)."""
+    fmt = x_embedding_format.strip().lower()
+    return fmt if fmt in BINARY_FORMATS else FORMAT_JSON
+
+
+_EMBEDDING_JSON_SCHEMA = WithJsonSchema(
+    {
+        "anyOf": [
+            {"type": "array", "items": {"type": "number"}},
+            {"type": "string", "description": "f32:<base64> or f16:<base64>"},
+        ]
+    }
+)
+
+# Request field type: either wire representation, decoded to a NumPy array
+Embedding = Annotated[Any, BeforeValidator(decode_embedding), _EMBEDDING_JSON_SCHEMA]
+
+# Response field type: already encoded by encode_embedding, passed through as-is
+EncodedEmbedding = Annotated[Any, _EMBEDDING_JSON_SCHEMA]
@@ -145,7 +145,23 @@ def validate_and_decode_image_to_numpy(
             ERROR_INVALID_FORMAT,
         )
     
-    # 3. Validate decoded image size
+    return decode_image_bytes_to_numpy(image_bytes)
+
+
+def decode_image_bytes_to_numpy(
+    image_bytes: bytes,
+) -> Tuple[bool, Optional[bytes], Optional[np.ndarray], Optional[str], Optional[str]]:
+    """
+    Validate and decode raw encoded image bytes (JPEG/PNG) to a NumPy array.
+    The bytes are decoded in place through np.frombuffer, without a copy.
+
+    Args:
+        image_bytes: Encoded image bytes, e.g. a binary request body
+
+    Returns:
+        Tuple of (success, image_bytes, image_np, error_message, error_code)
+    """
+    # 1. Validate encoded image size
     if len(image_bytes) > MAX_IMAGE_SIZE_BYTES:
         return (
             False,
@@ -155,7 +171,7 @@ def validate_and_decode_image_to_numpy(
             ERROR_IMAGE_TOO_LARGE,
         )
     
-    # 4. Decode image directly to NumPy array using cv2.imdecode
+    # 2. Decode image directly to NumPy array using cv2.imdecode
     # cv2.imdecode returns None if the image cannot be decoded
     image_np = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
     
@@ -168,7 +184,7 @@ def validate_and_decode_image_to_numpy(
             ERROR_INVALID_FORMAT,
         )
     
-    # 5. Validate dimensions
+    # 3. Validate dimensions
     height, width = image_np.shape[:2]
     if width > MAX_IMAGE_DIMENSION or height > MAX_IMAGE_DIMENSION:
         return (
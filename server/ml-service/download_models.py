@@ -27,12 +27,16 @@ MODEL_URLS = [
 MODEL_NAME = "blaze_face_short_range.tflite"
 FACE_LANDMARKER_MODEL_URL = "https://storage.googleapis.com/mediapipe-models/face_landmarker/face_landmarker/float16/1/face_landmarker.task"
 FACE_LANDMARKER_NAME = "face_landmarker.task"
+# OpenCV SFace recognition model, used when ML_ENCODER=sface
+SFACE_MODEL_URL = "https://github.com/opencv/opencv_zoo/raw/main/models/face_recognition_sface/face_recognition_sface_2021dec.onnx"
+SFACE_MODEL_NAME = "face_recognition_sface_2021dec.onnx"
 
 # Determine the target directory (app/ml/)
 SCRIPT_DIR = Path(__file__).parent
 ML_DIR = SCRIPT_DIR / "app" / "ml"
 TARGET_PATH = ML_DIR / MODEL_NAME
 LANDMARKER_TARGET_PATH = ML_DIR / FACE_LANDMARKER_NAME
+SFACE_TARGET_PATH = ML_DIR / SFACE_MODEL_NAME
 
 
 def download_model():
@@ -96,7 +100,32 @@ def download_model():
             print(f"❌ Failed to download landmarker: {e}")
             return False
 
-    return True
+    # Always fetched, not only for ML_ENCODER=sface: the backend's embedding
+    # migration re-encodes with SFace while the active encoder is still patch
+    return download_sface_model()
+
+
+def download_sface_model():
+    """Download the SFace face recognition model if it doesn't exist."""
+    if SFACE_TARGET_PATH.exists() and SFACE_TARGET_PATH.stat().st_size > 0:
+        print(f"✓ SFace model already exists at {SFACE_TARGET_PATH}")
+        return True
+
+    print("\nDownloading SFace recognition model from:")
+    print(f"  {SFACE_MODEL_URL}")
+    try:
+        tmp_sface = SFACE_TARGET_PATH.with_suffix(f"{SFACE_TARGET_PATH.suffix}.tmp")
+        urllib.request.urlretrieve(SFACE_MODEL_URL, tmp_sface)
+        if tmp_sface.exists() and tmp_sface.stat().st_size > 1024:
+            tmp_sface.replace(SFACE_TARGET_PATH)
+            print(f"✓ Successfully downloaded SFace model to {SFACE_TARGET_PATH}")
+            return True
+        print("❌ Downloaded file is empty, too small, or missing.")
+        if tmp_sface.exists():
+            tmp_sface.unlink()
+    except Exception as e:
+        print(f"❌ Failed to download SFace model: {e}")
+    return False
 
 
 if __name__ == "__main__":
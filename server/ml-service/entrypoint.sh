@@ -4,7 +4,9 @@ set -e
 echo "Starting ML Service initialization..."
 
 # Download models if they don't exist
-if [ ! -f "/app/app/ml/blaze_face_short_range.tflite" ]; then
+# (the SFace model too, since the embedding migration may target it)
+if [ ! -f "/app/app/ml/blaze_face_short_range.tflite" ] || \
+   [ ! -f "/app/app/ml/face_recognition_sface_2021dec.onnx" ]; then
     echo "Model file not found. Attempting to download..."
     python3 /app/download_models.py
     
@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 import base64
@@ -7,6 +8,7 @@ from PIL import Image
 from app.core.config import settings
 from unittest.mock import patch
 import app.api.routes.face_recognition as fr_module
+from app.ml.face_encoder import DnnEncoder
 
 client = TestClient(app)
 client.headers = {"X-API-KEY": settings.API_KEY}
@@ -35,6 +37,12 @@ def test_health():
     assert "timestamp" in data
 
 
+def test_responses_report_queue_depth():
+    response = client.get("/health")
+    assert response.headers["X-Queue-Depth"] == "0"
+    assert int(response.headers["X-Queue-Capacity"]) == settings.ML_MAX_QUEUE_DEPTH
+
+
 def test_encode_face_no_face():
     b64_img = create_dummy_image_b64()
     response = client.post("/api/ml/encode-face", json={"image_base64": b64_img})
@@ -86,6 +94,90 @@ def test_match_faces():
     assert data["match"]["student_id"] == "student1"
 
 
+def test_batch_match():
+    payload = {
+        "detected_faces": [
+            {"embedding": [1.0, 0.0, 0.0]},
+            {"embedding": [0.0, 0.0, 1.0]},
+            {"embedding": [0.0, 1.0, 0.0], "is_live": False},
+        ],
+        "candidate_embeddings": [
+            {"student_id": "student1", "embeddings": [[0.9, 0.1, 0.0]]},
+            {"student_id": "student2", "embeddings": [[0.0, 1.0, 0.0]]},
+        ],
+        "confident_threshold": 0.5,
+    }
+
+    response = client.post("/api/ml/batch-match", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    matches = data["matches"]
+    assert matches[0]["student_id"] == "student1"
+    assert matches[0]["status"] == "present"
+    assert matches[1]["student_id"] is None
+    assert matches[1]["status"] == "unknown"
+    assert matches[2]["status"] == "spoof"
+
+
+@pytest.mark.parametrize(
+    "endpoint, queries",
+    [
+        ("/api/ml/match-faces", {"query_embedding": [1.0, 0.0, 0.0]}),
+        ("/api/ml/batch-match", {"detected_faces": [{"embedding": [1.0, 0.0, 0.0]}]}),
+    ],
+)
+@pytest.mark.parametrize(
+    "gallery",
+    [
+        # Tagged with an encoder other than the active one
+        {"model_version": "sface-2021dec", "embeddings": [[1.0, 0.0, 0.0]]},
+        # Untagged, but of another length than the query
+        {"model_version": None, "embeddings": [[1.0, 0.0]]},
+    ],
+)
+def test_match_endpoints_reject_other_encoder_gallery(endpoint, queries, gallery):
+    payload = {
+        **queries,
+        "candidate_embeddings": [
+            {"student_id": "student1", "embeddings": gallery["embeddings"]}
+        ],
+        "model_version": gallery["model_version"],
+    }
+    data = client.post(endpoint, json=payload).json()
+    assert data["success"] is False
+    assert data["error_code"] == "MODEL_VERSION_MISMATCH"
+
+
+def test_detect_faces_rejected_when_executor_saturated():
+    with patch.object(fr_module.stage_executor, "max_queue_depth", 0):
+        response = client.post(
+            "/api/ml/detect-faces", json={"image_base64": create_dummy_image_b64()}
+        )
+    assert response.status_code == 503
+    assert response.json()["error"] == "ServiceOverloadedError"
+
+
+def test_match_faces_binary_embeddings():
+    def f32(values):
+        raw = np.asarray(values, dtype="<f4").tobytes()
+        return "f32:" + base64.b64encode(raw).decode()
+
+    payload = {
+        "query_embedding": f32([0.0, 1.0, 0.0]),
+        "candidate_embeddings": [
+            {"student_id": "student1", "embeddings": [f32([1.0, 0.0, 0.0])]},
+            {"student_id": "student2", "embeddings": [[0.0, 0.9, 0.1]]},
+        ],
+        "threshold": 0.5,
+    }
+
+    response = client.post("/api/ml/match-faces", json=payload)
+    data = response.json()
+    assert data["success"] is True
+    assert data["match"]["student_id"] == "student2"
+
+
 def test_encode_face_success():
     b64_img = create_dummy_image_b64()
     # Mock detect_faces using patch.object to ensure we hit the right module reference
@@ -104,6 +196,29 @@ def test_encode_face_success():
         assert data["success"] is True
         assert "embedding" in data
         assert len(data["embedding"]) > 0
+        assert data["model_version"] == "patch-96-v1"
+
+
+def test_detect_faces_binary_embedding_format():
+    b64_img = create_dummy_image_b64()
+    with (
+        patch.object(fr_module, "detect_faces") as mock_detect,
+        patch.object(fr_module, "is_live", return_value=True),
+    ):
+        mock_detect.return_value = [(10, 60, 60, 10)]
+
+        response = client.post(
+            "/api/ml/detect-faces",
+            json={"image_base64": b64_img},
+            headers={"X-Embedding-Format": "f32"},
+        )
+        assert response.headers["X-Embedding-Format"] == "f32"
+        data = response.json()
+        assert data["success"] is True
+        embedding = data["faces"][0]["embedding"]
+        assert embedding.startswith("f32:")
+        decoded = np.frombuffer(base64.b64decode(embedding[4:]), dtype="<f4")
+        assert decoded.shape == (96 * 96,)
 
 
 def test_detect_faces_success():
@@ -124,3 +239,411 @@ def test_detect_faces_success():
         assert loc["bottom"] == 60
         assert loc["right"] == 60
         assert loc["bottom"] == 60
+
+
+def test_registered_gallery_match_and_invalidate():
+    register = client.post(
+        "/api/ml/galleries",
+        json={
+            "gallery_id": "subject-1",
+            "candidate_embeddings": [
+                {"student_id": "student1", "embeddings": [[1.0, 0.0]]},
+                {"student_id": "student2", "embeddings": [[0.0, 1.0]]},
+            ],
+        },
+    )
+    data = register.json()
+    assert data["success"] is True
+    assert data["student_count"] == 2
+    version = data["version"]
+
+    response = client.post(
+        "/api/ml/match-faces",
+        json={
+            "query_embedding": [0.1, 0.9],
+            "gallery_id": "subject-1",
+            "gallery_version": version,
+        },
+    )
+    assert response.json()["match"]["student_id"] == "student2"
+
+    stale = client.post(
+        "/api/ml/batch-match",
+        json={
+            "detected_faces": [{"embedding": [0.1, 0.9]}],
+            "gallery_id": "subject-1",
+            "gallery_version": "old-version",
+        },
+    )
+    assert stale.json()["error_code"] == "GALLERY_NOT_FOUND"
+
+    invalidate = client.delete("/api/ml/galleries/subject-1")
+    assert invalidate.json()["invalidated"] is True
+
+    missing = client.post(
+        "/api/ml/match-faces",
+        json={"query_embedding": [0.1, 0.9], "gallery_id": "subject-1"},
+    )
+    assert missing.json()["success"] is False
+    assert missing.json()["error_code"] == "GALLERY_NOT_FOUND"
+
+
+def test_recognize_frame():
+    b64_img = create_dummy_image_b64()
+    with (
+        patch.object(fr_module, "detect_faces") as mock_detect,
+        patch.object(fr_module, "is_live", side_effect=[True, False, True]),
+        patch.object(
+            fr_module,
+            "get_face_embeddings",
+            return_value=np.array(
+                [[1.0, 0.0, 0.0], [0.9, 0.1, 0.0], [0.0, 0.0, 1.0]], dtype=np.float32
+            ),
+        ),
+    ):
+        mock_detect.return_value = [
+            (10, 40, 40, 10),
+            (10, 80, 40, 50),
+            (50, 40, 80, 10),
+        ]
+
+        response = client.post(
+            "/api/ml/recognize-frame",
+            json={
+                "image_base64": b64_img,
+                "candidate_embeddings": [
+                    {"student_id": "student1", "embeddings": [[0.9, 0.1, 0.0]]},
+                    {"student_id": "student2", "embeddings": [[0.0, 1.0, 0.0]]},
+                ],
+                "threshold": 0.5,
+            },
+        )
+
+    data = response.json()
+    assert data["success"] is True
+    assert data["count"] == 3
+    live, spoof, unknown = data["faces"]
+    assert live["match"]["student_id"] == "student1"
+    assert live["location"] == {"top": 10, "right": 40, "bottom": 40, "left": 10}
+    assert spoof["is_live"] is False and spoof["match"] is None
+    assert unknown["is_live"] is True and unknown["match"] is None
+
+
+def test_recognize_frame_reuses_tracked_faces():
+    client.post(
+        "/api/ml/galleries",
+        json={
+            "gallery_id": "subject-tracked",
+            "candidate_embeddings": [
+                {"student_id": "student1", "embeddings": [[1.0, 0.0, 0.0]]},
+            ],
+        },
+    )
+    request = {
+        "image_base64": create_dummy_image_b64(),
+        "gallery_id": "subject-tracked",
+        "session_id": "session-1",
+        "threshold": 0.5,
+    }
+
+    with (
+        patch.object(
+            fr_module,
+            "detect_faces",
+            side_effect=[[(10, 40, 40, 10)], [(11, 41, 41, 11)]],
+        ),
+        patch.object(fr_module, "is_live", return_value=True) as mock_live,
+        patch.object(
+            fr_module,
+            "get_face_embeddings",
+            return_value=np.array([[1.0, 0.0, 0.0]], dtype=np.float32),
+        ) as mock_embed,
+    ):
+        first = client.post("/api/ml/recognize-frame", json=request).json()
+        second = client.post("/api/ml/recognize-frame", json=request).json()
+
+    assert first["faces"][0]["tracked"] is False
+    face = second["faces"][0]
+    assert face["tracked"] is True
+    assert face["track_id"] == first["faces"][0]["track_id"]
+    assert face["match"]["student_id"] == "student1"
+    assert face["location"]["top"] == 11
+    # The moved face is neither liveness-checked nor embedded again
+    assert mock_live.call_count == 1
+    assert mock_embed.call_count == 1
+    client.delete("/api/ml/galleries/subject-tracked")
+
+
+def test_recognize_frame_skips_confirmed_students():
+    client.post(
+        "/api/ml/galleries",
+        json={
+            "gallery_id": "subject-confirmed",
+            "candidate_embeddings": [
+                {"student_id": "student1", "embeddings": [[1.0, 0.0, 0.0]]},
+                {"student_id": "student2", "embeddings": [[0.0, 1.0, 0.0]]},
+            ],
+        },
+    )
+    request = {
+        "image_base64": create_dummy_image_b64(),
+        "gallery_id": "subject-confirmed",
+        "session_id": "session-confirmed",
+        "threshold": 0.5,
+        "confirm_threshold": 0.9,
+    }
+    # Faces far apart, so each frame starts a new track
+    boxes = [[(0, 30, 30, 0)], [(60, 90, 90, 60)], [(0, 90, 30, 60)]]
+    embeddings = [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.95, 0.05, 0.0]]
+    searched = []
+    submit = fr_module.match_batcher.submit
+
+    async def spy(job):
+        searched.append(job[0].student_ids)
+        return await submit(job)
+
+    with (
+        patch.object(fr_module, "detect_faces", side_effect=boxes),
+        patch.object(fr_module, "is_live", return_value=True),
+        patch.object(
+            fr_module,
+            "get_face_embeddings",
+            side_effect=[np.array([e], dtype=np.float32) for e in embeddings],
+        ),
+        patch.object(fr_module.match_batcher, "submit", side_effect=spy),
+    ):
+        results = [
+            client.post("/api/ml/recognize-frame", json=request).json() for _ in boxes
+        ]
+
+    matched = [r["faces"][0]["match"]["student_id"] for r in results]
+    assert matched == ["student1", "student2", "student1"]
+    assert searched == [
+        ["student1", "student2"],
+        ["student2"],
+        # Nobody is left unconfirmed, so only the confirmed part is searched
+        ["student1", "student2"],
+    ]
+    client.delete("/api/ml/galleries/subject-confirmed")
+
+
+def test_recognize_frame_unmatched_face_does_not_confirm():
+    request = {
+        "image_base64": create_dummy_image_b64(),
+        "candidate_embeddings": [
+            {"student_id": "student1", "embeddings": [[1.0, 0.0, 0.0]]}
+        ],
+        "session_id": "session-between",
+        "threshold": 0.6,
+        "confirm_threshold": 0.5,
+    }
+    # Similarity 0.55: above confirm_threshold but below threshold
+    embedding = np.array([[0.55, np.sqrt(1 - 0.55**2), 0.0]], dtype=np.float32)
+    with (
+        patch.object(fr_module, "detect_faces", return_value=[(0, 30, 30, 0)]),
+        patch.object(fr_module, "is_live", return_value=True),
+        patch.object(fr_module, "get_face_embeddings", return_value=embedding),
+    ):
+        data = client.post("/api/ml/recognize-frame", json=request).json()
+
+    assert data["faces"][0]["match"] is None
+    assert fr_module.tracker_store.get("session-between").confirmed == set()
+
+
+def test_recognize_frame_unknown_gallery():
+    response = client.post(
+        "/api/ml/recognize-frame",
+        json={"image_base64": create_dummy_image_b64(), "gallery_id": "subject:none"},
+    )
+    data = response.json()
+    assert data["success"] is False
+    assert data["error_code"] == "GALLERY_NOT_FOUND"
+
+
+def test_recognize_frame_rejects_other_encoder_gallery():
+    response = client.post(
+        "/api/ml/recognize-frame",
+        json={
+            "image_base64": create_dummy_image_b64(),
+            "candidate_embeddings": [
+                {"student_id": "student1", "embeddings": [[1.0, 0.0]]},
+            ],
+            "model_version": "sface-2021dec",
+        },
+    )
+    data = response.json()
+    assert data["success"] is False
+    assert data["error_code"] == "MODEL_VERSION_MISMATCH"
+
+
+def test_recognize_frame_raw_jpeg_body():
+    client.post(
+        "/api/ml/galleries",
+        json={
+            "gallery_id": "subject-raw",
+            "candidate_embeddings": [
+                {"student_id": "student1", "embeddings": [[1.0, 0.0, 0.0]]},
+            ],
+        },
+    )
+    jpeg = base64.b64decode(create_dummy_image_b64())
+
+    with (
+        patch.object(fr_module, "detect_faces", return_value=[(10, 40, 40, 10)]),
+        patch.object(fr_module, "is_live", return_value=True),
+        patch.object(
+            fr_module,
+            "get_face_embeddings",
+            return_value=np.array([[1.0, 0.0, 0.0]], dtype=np.float32),
+        ),
+    ):
+        response = client.post(
+            "/api/ml/recognize-frame/raw",
+            params={"gallery_id": "subject-raw", "threshold": 0.5},
+            content=jpeg,
+            headers={"Content-Type": "image/jpeg"},
+        )
+
+    data = response.json()
+    assert data["success"] is True
+    assert data["faces"][0]["match"]["student_id"] == "student1"
+
+    corrupt = client.post(
+        "/api/ml/recognize-frame/raw",
+        params={"gallery_id": "subject-raw"},
+        content=b"not an image",
+        headers={"Content-Type": "image/jpeg"},
+    )
+    assert corrupt.json()["error_code"] == "INVALID_FORMAT"
+    client.delete("/api/ml/galleries/subject-raw")
+
+
+def test_detect_faces_batch_dedupes_across_images():
+    # Images run in parallel, so tell them apart by size rather than order
+    images = [create_dummy_image_b64(width=100), create_dummy_image_b64(width=120)]
+
+    def detect(image):
+        return [(10, 40, 40, 10)] if image.shape[1] == 100 else [(10, 40, 30, 20)]
+
+    def embed(crops, num_jitters=1):
+        return np.array(
+            [[1.0, 0.0] if crop.shape[0] == 30 else [0.95, 0.05] for crop in crops],
+            dtype=np.float32,
+        )
+
+    with (
+        patch.object(fr_module, "detect_faces", side_effect=detect),
+        patch.object(fr_module, "is_live", return_value=True),
+        patch.object(fr_module, "get_face_embeddings", side_effect=embed),
+    ):
+        response = client.post(
+            "/api/ml/detect-faces-batch",
+            json={
+                "images": images,
+                "candidate_embeddings": [
+                    {"student_id": "student1", "embeddings": [[1.0, 0.0]]},
+                ],
+                "threshold": 0.5,
+            },
+        )
+
+    data = response.json()
+    assert data["success"] is True
+    assert data["count"] == 2
+    assert [image["count"] for image in data["images"]] == [1, 1]
+    first, second = (image["faces"][0] for image in data["images"])
+    assert first["match"]["student_id"] == second["match"]["student_id"] == "student1"
+    assert first["duplicate"] is False and second["duplicate"] is True
+    assert data["students"] == [
+        {
+            "student_id": "student1",
+            "image_index": 0,
+            "face_index": 0,
+            "distance": pytest.approx(0.0, abs=1e-6),
+            "confidence": pytest.approx(1.0, abs=1e-6),
+            "sightings": 2,
+        }
+    ]
+
+
+def test_detect_faces_batch_reports_bad_image():
+    with patch.object(fr_module, "detect_faces", return_value=[]):
+        response = client.post(
+            "/api/ml/detect-faces-batch",
+            json={"images": [create_dummy_image_b64(), "not-base64!"]},
+        )
+
+    data = response.json()
+    assert data["success"] is True
+    assert data["images"][0]["success"] is True
+    assert data["images"][1]["success"] is False
+    assert data["images"][1]["error_code"] == "INVALID_FORMAT"
+    assert data["students"] == []
+
+
+def test_detect_faces_tiled_model():
+    b64_img = create_dummy_image_b64(width=200, height=200)
+
+    def detect_tile(tile, origin):
+        assert tile.shape[:2] == (128, 128)
+        return [((10, 60, 60, 10), 0.9)] if origin == (0, 0) else []
+
+    with (
+        patch.object(fr_module, "detect_tile", side_effect=detect_tile) as mock_tile,
+        patch.object(fr_module, "is_live", return_value=True),
+    ):
+        response = client.post(
+            "/api/ml/detect-faces",
+            json={"image_base64": b64_img, "model": "tiled", "tile_size": 128},
+        )
+
+    assert response.json()["count"] == 1
+    # Each tile is a separate executor call
+    assert mock_tile.call_count == 4
+
+
+def test_encode_faces_batch_reports_each_image():
+    images = [create_dummy_image_b64(), "not-base64!"]
+    with patch.object(fr_module, "detect_faces", return_value=[(10, 60, 60, 10)]):
+        response = client.post(
+            "/api/ml/encode-faces-batch", json={"images": images, "encoder": "patch"}
+        )
+
+    data = response.json()
+    assert data["success"] is True
+    assert data["model_version"] == "patch-96-v1"
+    ok, bad = data["results"]
+    assert ok["success"] is True and len(ok["embedding"]) == 96 * 96
+    assert bad["success"] is False and bad["error_code"] == "INVALID_FORMAT"
+
+
+def test_encoder_info():
+    data = client.get("/api/ml/encoders/patch").json()
+    assert data["success"] is True
+    assert data["model_version"] == "patch-96-v1"
+    assert data["dimension"] == 96 * 96
+
+
+def test_missing_encoder_model_is_reported_up_front():
+    missing = FileNotFoundError("Model file not found")
+    with patch.object(DnnEncoder, "check_available", side_effect=missing):
+        info = client.get("/api/ml/encoders/sface").json()
+        batch = client.post(
+            "/api/ml/encode-faces-batch",
+            json={"images": [create_dummy_image_b64()], "encoder": "sface"},
+        ).json()
+
+    assert info["success"] is False
+    assert info["error_code"] == "MODEL_UNAVAILABLE"
+    assert batch["success"] is False
+    assert batch["error_code"] == "MODEL_UNAVAILABLE"
+
+
+def test_encode_faces_batch_unknown_encoder():
+    response = client.post(
+        "/api/ml/encode-faces-batch",
+        json={"images": [create_dummy_image_b64()], "encoder": "nope"},
+    )
+    data = response.json()
+    assert data["success"] is False
+    assert "Unknown encoder" in data["error"]
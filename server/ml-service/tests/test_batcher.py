@@ -0,0 +1,152 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from app.api.routes import face_recognition as fr_module
+from app.api.routes.face_recognition import _embed_batch, _match_batch
+from app.core.batcher import MicroBatcher
+from app.core.config import Settings
+from app.core.exceptions import ServiceOverloadedError
+from app.core.executor import StageExecutor
+from app.ml.face_matcher import Gallery
+
+
+@pytest.fixture
+def executor():
+    executor = StageExecutor(
+        thread_workers=2, process_workers=1, process_stages=[], max_queue_depth=16
+    )
+    yield executor
+    executor.shutdown()
+
+
+async def test_concurrent_requests_share_a_batch(executor):
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(
+        "detect", process, executor, max_batch_size=4, max_wait_ms=50
+    )
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(3)))
+
+    assert results == [0, 2, 4]
+    assert batches == [[0, 1, 2]]
+
+
+async def test_full_batch_dispatches_without_waiting(executor):
+    batches = []
+
+    def process(items):
+        batches.append(len(items))
+        return items
+
+    batcher = MicroBatcher(
+        "detect", process, executor, max_batch_size=2, max_wait_ms=10_000
+    )
+    results = await asyncio.wait_for(
+        asyncio.gather(*(batcher.submit(i) for i in range(4))), timeout=2
+    )
+
+    assert results == [0, 1, 2, 3]
+    assert batches == [2, 2]
+
+
+async def test_per_item_errors_stay_with_their_request(executor):
+    def process(items):
+        return [ValueError("bad image") if item < 0 else item for item in items]
+
+    batcher = MicroBatcher("encode", process, executor, max_batch_size=4, max_wait_ms=5)
+    ok, bad = await asyncio.gather(
+        batcher.submit(1), batcher.submit(-1), return_exceptions=True
+    )
+
+    assert ok == 1
+    assert isinstance(bad, ValueError)
+
+
+async def test_batch_rejected_when_executor_full():
+    executor = StageExecutor(
+        thread_workers=1, process_workers=1, process_stages=[], max_queue_depth=1
+    )
+    batcher = MicroBatcher("match", list, executor, max_batch_size=2, max_wait_ms=5)
+    try:
+        results = await asyncio.gather(
+            batcher.submit(1), batcher.submit(2), return_exceptions=True
+        )
+        assert all(isinstance(r, ServiceOverloadedError) for r in results)
+    finally:
+        executor.shutdown()
+
+
+def test_match_batch_stacks_queries_per_gallery():
+    gallery = Gallery.from_candidates([("s1", [[1.0, 0.0]]), ("s2", [[0.0, 1.0]])])
+    other = Gallery.from_candidates([("s3", [[1.0, 1.0]])])
+
+    results = _match_batch(
+        [
+            (gallery, [[1.0, 0.0]]),
+            (other, [[1.0, 0.0]]),
+            (gallery, [[0.0, 1.0], [1.0, 0.0]]),
+            (gallery, [[1.0, 0.0, 0.0]]),
+        ]
+    )
+
+    np.testing.assert_allclose(results[0], [[1.0, 0.0]], atol=1e-6)
+    assert results[1].shape == (1, 1)
+    np.testing.assert_allclose(results[2], [[0.0, 1.0], [1.0, 0.0]], atol=1e-6)
+    assert isinstance(results[3], ValueError)
+
+
+def test_embed_batch_returns_each_jobs_embeddings():
+    crops = [np.full((2, 2), i, np.uint8) for i in range(3)]
+
+    def embed(batch, num_jitters):
+        return [(int(crop[0, 0]), num_jitters) for crop in batch]
+
+    with patch.object(fr_module, "get_face_embeddings", side_effect=embed) as mock:
+        results = _embed_batch([(crops[:2], 1), ([], 1), (crops[2:], 3)])
+
+    assert results == [[(0, 1), (1, 1)], [], [(2, 3)]]
+    assert mock.call_count == 2
+
+
+async def test_images_are_prepared_in_parallel_and_embedded_together(executor):
+    # Both prepare calls must be running at once to pass the barrier
+    barrier = threading.Barrier(2, timeout=2)
+
+    def prepare(n):
+        barrier.wait()
+        face = {"n": n}
+        return {"faces": [face]}, [face], [np.full((2, 2), n, np.uint8)]
+
+    batches = []
+
+    def embed(batch, num_jitters):
+        batches.append(len(batch))
+        return [int(crop[0, 0]) for crop in batch]
+
+    embed_batcher = MicroBatcher(
+        "encode", _embed_batch, executor, max_batch_size=4, max_wait_ms=50
+    )
+    with (
+        patch.object(fr_module, "stage_executor", executor),
+        patch.object(fr_module, "embed_batcher", embed_batcher),
+        patch.object(fr_module, "get_face_embeddings", side_effect=embed),
+    ):
+        results = await asyncio.gather(
+            *(fr_module._prepare_and_embed(prepare, (n,), 1) for n in (1, 2))
+        )
+
+    assert [r["faces"][0]["embedding"] for r in results] == [1, 2]
+    assert batches == [2]
+
+
+def test_batch_size_is_clamped_to_queue_depth():
+    settings = Settings(ML_BATCH_MAX_SIZE=64, ML_MAX_QUEUE_DEPTH=16)
+    assert settings.ML_BATCH_MAX_SIZE == 16
@@ -0,0 +1,45 @@
+import base64
+
+import numpy as np
+import pytest
+
+from app.utils.embedding_codec import decode_embedding, encode_embedding
+
+
+def test_f32_round_trip():
+    emb = np.random.default_rng(0).normal(size=128).astype(np.float32)
+    encoded = encode_embedding(emb, "f32")
+    assert encoded.startswith("f32:")
+    np.testing.assert_array_equal(decode_embedding(encoded), emb)
+
+
+def test_f16_round_trip_is_close():
+    emb = np.random.default_rng(1).normal(size=64).astype(np.float32)
+    decoded = decode_embedding(encode_embedding(emb, "f16"))
+    assert decoded.dtype == np.float16
+    np.testing.assert_allclose(decoded, emb, rtol=1e-3, atol=1e-3)
+
+
+def test_json_format_passes_lists_through():
+    assert encode_embedding([0.5, 0.25], "json") == [0.5, 0.25]
+    np.testing.assert_array_equal(decode_embedding([0.5, 0.25]), [0.5, 0.25])
+
+
+def test_decode_is_zero_copy_over_buffer():
+    decoded = decode_embedding(encode_embedding([1.0, 2.0], "f32"))
+    assert not decoded.flags.owndata
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "f64:AAAA",
+        "no-prefix",
+        "f32:not-base64!",
+        "f32:" + base64.b64encode(b"\x00\x00\x00").decode(),
+        42,
+    ],
+)
+def test_decode_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        decode_embedding(value)
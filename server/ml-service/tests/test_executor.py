@@ -0,0 +1,69 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.core.exceptions import ServiceOverloadedError
+from app.core.executor import StageExecutor
+
+
+def _executor(max_queue_depth=4):
+    return StageExecutor(
+        thread_workers=2,
+        process_workers=1,
+        process_stages=[],
+        max_queue_depth=max_queue_depth,
+    )
+
+
+async def test_run_uses_worker_thread():
+    executor = _executor()
+    try:
+        name = await executor.run("detect", lambda: threading.current_thread().name)
+        assert name.startswith("ml-stage")
+        assert executor.in_flight == 0
+    finally:
+        executor.shutdown()
+
+
+async def test_rejects_when_queue_full():
+    executor = _executor(max_queue_depth=1)
+    release = threading.Event()
+    try:
+        blocked = asyncio.create_task(executor.run("detect", release.wait, 5))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(ServiceOverloadedError):
+            await executor.run("detect", lambda: None)
+
+        release.set()
+        assert await blocked is True
+        # Capacity frees up once the running call completes
+        assert await executor.run("detect", lambda: 42) == 42
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+async def test_errors_propagate_and_release_slot():
+    executor = _executor(max_queue_depth=1)
+
+    def boom():
+        raise ValueError("bad frame")
+
+    try:
+        with pytest.raises(ValueError):
+            await executor.run("encode", boom)
+        assert executor.in_flight == 0
+    finally:
+        executor.shutdown()
+
+
+def test_match_stage_never_uses_process_pool():
+    executor = StageExecutor(
+        thread_workers=1,
+        process_workers=1,
+        process_stages=["detect", "match"],
+        max_queue_depth=1,
+    )
+    assert executor.process_stages == {"detect"}
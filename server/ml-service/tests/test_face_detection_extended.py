@@ -1,6 +1,8 @@
 import pytest
 import numpy as np
+from unittest.mock import patch
 from PIL import Image
+import app.ml.face_detector as face_detector
 from app.ml.face_detector import detect_faces
 
 
@@ -38,3 +40,24 @@ def test_detect_faces_invalid_input():
 
 # Note: Testing actual face detection requires a real face image.
 # For unit tests without external assets, we ensure robustness to various inputs.
+
+
+def test_detect_faces_downscales_large_images():
+    image = np.zeros((3000, 4000, 3), dtype=np.uint8)
+    with patch.object(
+        face_detector, "_detect_scored", return_value=[((100, 200, 150, 150), 0.9)]
+    ) as mock_detect:
+        faces = detect_faces(image, max_side=800)
+
+    small = mock_detect.call_args.args[0]
+    assert small.shape == (600, 800, 3)
+    # Boxes come back in full-resolution coordinates
+    assert faces == [(500, 1000, 750, 750)]
+
+
+def test_detect_faces_small_image_not_resized():
+    image = np.zeros((300, 400, 3), dtype=np.uint8)
+    with patch.object(face_detector, "_detect_scored", return_value=[]) as mock_detect:
+        detect_faces(image, max_side=800)
+
+    assert mock_detect.call_args.args[0] is image
@@ -1,5 +1,14 @@
+from unittest.mock import MagicMock, patch
+
+import cv2
 import numpy as np
-from app.ml.face_encoder import get_face_embedding
+import pytest
+from app.ml.face_encoder import (
+    DnnEncoder,
+    _jitter_views,
+    get_face_embedding,
+    get_face_embeddings,
+)
 
 
 def test_get_face_embedding_length():
@@ -28,3 +37,48 @@ def test_get_face_embedding_zeros():
     arr = np.array(emb)
     norm = np.linalg.norm(arr)
     assert abs(norm - 1.0) < 1e-5
+
+
+def test_get_face_embeddings_matches_single():
+    rng = np.random.default_rng(0)
+    crops = [
+        rng.integers(1, 255, (120, 100, 3), dtype=np.uint8),
+        rng.integers(1, 255, (80, 90, 3), dtype=np.uint8),
+    ]
+    embs = get_face_embeddings(crops)
+    assert embs.shape == (2, 96 * 96)
+    for crop, emb in zip(crops, embs):
+        np.testing.assert_allclose(emb, get_face_embedding(crop), rtol=1e-5)
+    assert get_face_embeddings([]).shape == (0, 96 * 96)
+
+
+def test_jitter_views_are_resized_and_capped():
+    img = np.zeros((120, 100, 3), dtype=np.uint8)
+    views = _jitter_views(img, 112, num_jitters=3)
+    assert len(views) == 3
+    assert all(view.shape == (112, 112, 3) for view in views)
+    assert len(_jitter_views(img, 112, num_jitters=0)) == 1
+    assert len(_jitter_views(img, 112, num_jitters=50)) == 7
+
+
+def test_dnn_encoder_averages_jitters_and_normalizes(tmp_path):
+    model = tmp_path / "model.onnx"
+    model.write_bytes(b"onnx")
+
+    net = MagicMock()
+    outputs = iter([[[3.0, 0.0]], [[0.0, 4.0]]])
+    net.forward.side_effect = lambda: np.array(next(outputs), dtype=np.float32)
+
+    encoder = DnnEncoder(str(model), "test-v1", dimension=2, input_size=112)
+    with patch.object(cv2.dnn, "readNetFromONNX", return_value=net):
+        embs = encoder.embed([np.full((60, 50, 3), 128, np.uint8)], num_jitters=2)
+
+    assert net.setInput.call_count == 2
+    np.testing.assert_allclose(embs, [[0.6, 0.8]], rtol=1e-6)
+    assert encoder.embed([]).shape == (0, 2)
+
+
+def test_dnn_encoder_missing_model():
+    encoder = DnnEncoder("/nonexistent.onnx", "test-v1", dimension=2, input_size=112)
+    with pytest.raises(FileNotFoundError):
+        encoder.embed([np.zeros((10, 10, 3), np.uint8)])
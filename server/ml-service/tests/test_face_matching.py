@@ -1,4 +1,6 @@
-from app.ml.face_matcher import cosine_similarity
+import numpy as np
+
+from app.ml.face_matcher import Gallery, cosine_similarity
 
 
 def test_cosine_similarity_identical():
@@ -23,3 +25,62 @@ def test_cosine_similarity_zeros():
     a = [0, 0, 0]
     b = [1, 2, 3]
     assert cosine_similarity(a, b) == 0.0
+
+
+def test_gallery_matches_per_student_max():
+    gallery = Gallery.from_candidates(
+        [
+            ("s1", [[1, 0, 0], [0, 1, 0]]),
+            ("s2", [[0, 0, 1]]),
+        ]
+    )
+    scores = gallery.student_scores([[0, 1, 0], [0, 0, 2]])
+    assert scores.shape == (2, 2)
+    np.testing.assert_allclose(scores, [[1.0, 0.0], [0.0, 1.0]], atol=1e-6)
+
+
+def test_gallery_agrees_with_cosine_similarity():
+    rng = np.random.default_rng(0)
+    candidates = [(f"s{i}", rng.normal(size=(3, 16)).tolist()) for i in range(5)]
+    queries = rng.normal(size=(4, 16))
+    gallery = Gallery.from_candidates(candidates)
+
+    best_idx, best_scores = gallery.best_matches(queries)
+
+    for q, idx, score in zip(queries, best_idx, best_scores):
+        expected = [
+            max(cosine_similarity(q, emb) for emb in embs) for _, embs in candidates
+        ]
+        assert idx == int(np.argmax(expected))
+        assert abs(score - max(expected)) < 1e-5
+
+
+def test_gallery_skips_students_without_embeddings():
+    gallery = Gallery.from_candidates([("s1", []), ("s2", [[1, 0]])])
+    assert gallery.student_ids == ["s2"]
+
+
+def test_gallery_empty():
+    gallery = Gallery.from_candidates([])
+    best_idx, best_scores = gallery.best_matches([[1, 0]])
+    assert best_idx[0] == -1
+    assert best_scores[0] == -1.0
+
+
+def test_gallery_subset_keeps_each_students_rows():
+    gallery = Gallery.from_candidates(
+        [
+            ("s1", [[1, 0, 0], [0, 1, 0]]),
+            ("s2", [[0, 0, 1]]),
+            ("s3", [[1, 1, 0]]),
+        ]
+    )
+    subset = gallery.subset([0, 2])
+    assert subset.student_ids == ["s1", "s3"]
+    np.testing.assert_allclose(
+        subset.student_scores([[0, 1, 0]]),
+        gallery.student_scores([[0, 1, 0]])[:, [0, 2]],
+        atol=1e-6,
+    )
+    assert len(gallery.subset([])) == 0
+    assert gallery.subset([]).dimension == 3
@@ -0,0 +1,66 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.ml.liveness import FaceMeshPool
+
+
+@pytest.fixture
+def mock_face_mesh_class():
+    with patch("app.ml.liveness.mp_face_mesh.FaceMesh") as MockFaceMesh:
+        MockFaceMesh.side_effect = lambda **kwargs: MagicMock()
+        yield MockFaceMesh
+
+
+def test_instances_are_reused(mock_face_mesh_class):
+    pool = FaceMeshPool(size=2)
+
+    with pool.checkout() as first:
+        pass
+    with pool.checkout() as second:
+        pass
+
+    assert first is second
+    assert mock_face_mesh_class.call_count == 1
+
+
+def test_warm_creates_full_pool(mock_face_mesh_class):
+    pool = FaceMeshPool(size=3)
+    pool.warm()
+    assert mock_face_mesh_class.call_count == 3
+
+    with pool.checkout(), pool.checkout(), pool.checkout():
+        pass
+    assert mock_face_mesh_class.call_count == 3
+
+
+def test_checkout_waits_when_exhausted(mock_face_mesh_class):
+    pool = FaceMeshPool(size=1)
+    acquired = threading.Event()
+
+    def worker():
+        with pool.checkout():
+            acquired.set()
+
+    with pool.checkout() as held:
+        thread = threading.Thread(target=worker)
+        thread.start()
+        assert not acquired.wait(0.05)
+
+    thread.join(1)
+    assert acquired.is_set()
+    assert mock_face_mesh_class.call_count == 1
+    held.close.assert_not_called()
+
+
+def test_failed_instance_is_discarded(mock_face_mesh_class):
+    pool = FaceMeshPool(size=1)
+
+    with pytest.raises(RuntimeError):
+        with pool.checkout() as broken:
+            raise RuntimeError("graph failure")
+
+    broken.close.assert_called_once()
+    with pool.checkout() as replacement:
+        assert replacement is not broken
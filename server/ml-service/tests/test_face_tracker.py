@@ -0,0 +1,101 @@
+from unittest.mock import patch
+
+from app.ml.face_matcher import Gallery
+from app.ml.face_tracker import FaceTracker, TrackerStore, iou, match_tracks
+
+GALLERY = object()
+
+
+def _tracker():
+    return FaceTracker(iou_threshold=0.4, refresh_seconds=5, max_age_seconds=3)
+
+
+def _face(box, is_live=True, best=("s1", 0.9), track_id=None):
+    face = {"location": box, "is_live": is_live, "best": best}
+    if track_id is not None:
+        face["track_id"] = track_id
+    return face
+
+
+def test_iou():
+    box = (0, 10, 10, 0)
+    assert iou(box, box) == 1.0
+    assert iou(box, (0, 20, 10, 10)) == 0.0
+    assert iou(box, (0, 15, 10, 5)) == 50 / 150
+
+
+def test_match_tracks_pairs_best_overlap_first():
+    boxes = [(0, 10, 10, 0), (0, 11, 10, 1)]
+    tracks = [(7, (0, 11, 10, 1)), (8, (0, 100, 10, 90))]
+    # Both boxes overlap track 7; the closer one takes it
+    assert match_tracks(boxes, tracks, 0.4) == {1: 7}
+
+
+def test_recognized_face_is_reused_until_refresh():
+    tracker = _tracker()
+    with patch("app.ml.face_tracker.time.monotonic", return_value=100.0):
+        faces = [_face((0, 10, 10, 0))]
+        tracker.update(faces, GALLERY, 0.95)
+        track_id = faces[0]["track_id"]
+        assert tracker.fresh_tracks(GALLERY)[track_id].best == ("s1", 0.9)
+        # Matches made against another gallery are not reused
+        assert tracker.fresh_tracks(object()) == {}
+
+    with patch("app.ml.face_tracker.time.monotonic", return_value=104.0):
+        # Reused faces move their track along
+        tracker.update(
+            [{"location": (0, 11, 10, 1), "track_id": track_id}], GALLERY, 0.95
+        )
+        assert tracker.fresh_tracks(GALLERY)[track_id].box == (0, 11, 10, 1)
+
+    with patch("app.ml.face_tracker.time.monotonic", return_value=105.5):
+        assert tracker.fresh_tracks(GALLERY) == {}
+        # A refreshed face keeps its track id
+        faces = [_face((0, 11, 10, 1), best=("s2", 0.8))]
+        tracker.update(faces, GALLERY, 0.95)
+        assert faces[0]["track_id"] == track_id
+        assert tracker.fresh_tracks(GALLERY)[track_id].best == ("s2", 0.8)
+
+
+def test_unseen_tracks_are_dropped():
+    tracker = _tracker()
+    with patch("app.ml.face_tracker.time.monotonic", return_value=100.0):
+        tracker.update([_face((0, 10, 10, 0)), _face((0, 50, 10, 40))], GALLERY, 0.95)
+    with patch("app.ml.face_tracker.time.monotonic", return_value=104.0):
+        tracker.update([_face((0, 10, 10, 0))], GALLERY, 0.95)
+    assert len(tracker) == 1
+
+
+def test_confident_live_matches_shrink_the_gallery():
+    gallery = Gallery.from_candidates([("s1", [[1, 0]]), ("s2", [[0, 1]])])
+    tracker = _tracker()
+    unconfirmed, confirmed = tracker.split_gallery(gallery)
+    assert unconfirmed is gallery and len(confirmed) == 0
+
+    tracker.update(
+        [
+            _face((0, 10, 10, 0), best=("s1", 0.9)),
+            # Neither an unsure match nor a spoof confirms a student
+            _face((0, 50, 10, 40), best=("s2", 0.5)),
+            _face((0, 90, 10, 80), is_live=False, best=("s2", 0.9)),
+        ],
+        gallery,
+        0.8,
+    )
+    assert tracker.confirmed == {"s1"}
+    unconfirmed, confirmed = tracker.split_gallery(gallery)
+    assert unconfirmed.student_ids == ["s2"]
+    assert confirmed.student_ids == ["s1"]
+    assert tracker.split_gallery(gallery)[0] is unconfirmed
+
+
+def test_store_expires_idle_sessions():
+    store = TrackerStore(max_sessions=2, ttl_seconds=10)
+    with patch("app.ml.face_tracker.time.monotonic", return_value=100.0):
+        tracker = store.get("a")
+        assert store.get("a") is tracker
+        store.get("b")
+        store.get("c")
+    assert len(store) == 2
+    with patch("app.ml.face_tracker.time.monotonic", return_value=111.0):
+        assert store.get("c") is not tracker
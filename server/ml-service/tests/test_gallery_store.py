@@ -0,0 +1,43 @@
+from unittest.mock import patch
+
+from app.ml.face_matcher import Gallery
+from app.ml.gallery_store import GalleryStore, gallery_content_hash
+
+
+def _gallery(value=1.0):
+    return Gallery.from_candidates([("s1", [[value, 0.0]])])
+
+
+def test_lru_eviction():
+    store = GalleryStore(max_entries=2, ttl_seconds=60)
+    store.put("a", "v1", _gallery())
+    store.put("b", "v1", _gallery())
+    assert store.get("a") is not None  # "a" becomes most recently used
+    store.put("c", "v1", _gallery())
+
+    assert store.get("b") is None
+    assert store.get("a") is not None
+    assert store.get("c") is not None
+
+
+def test_ttl_expiry():
+    store = GalleryStore(max_entries=2, ttl_seconds=10)
+    with patch("app.ml.gallery_store.time.monotonic", return_value=100.0):
+        store.put("a", "v1", _gallery())
+    with patch("app.ml.gallery_store.time.monotonic", return_value=111.0):
+        assert store.get("a") is None
+    assert len(store) == 0
+
+
+def test_version_mismatch_is_a_miss():
+    store = GalleryStore(max_entries=2, ttl_seconds=60)
+    store.put("a", "v1", _gallery())
+    assert store.get("a", "v2") is None
+    assert store.get("a", "v1") is not None
+
+
+def test_content_hash_changes_with_embeddings():
+    assert gallery_content_hash(_gallery(1.0)) == gallery_content_hash(_gallery(1.0))
+    assert gallery_content_hash(_gallery(1.0)) != gallery_content_hash(
+        Gallery.from_candidates([("s1", [[0.0, 1.0]])])
+    )
@@ -30,10 +30,15 @@ def create_spoof_base64_image(width=100, height=100):
 @pytest.fixture
 def mock_face_mesh():
     """Mock the FaceMesh class used in liveness check."""
+    from app.ml.liveness import face_mesh_pool
+
+    # Drop pooled instances so the pool builds them from the mocked class
+    face_mesh_pool.close()
     with patch("app.ml.liveness.mp_face_mesh.FaceMesh") as MockFaceMesh:
         mock_instance = MockFaceMesh.return_value
         mock_instance.__enter__.return_value = mock_instance
         yield mock_instance
+    face_mesh_pool.close()
 
 
 @pytest.fixture
@@ -47,8 +52,10 @@ def mock_detector(monkeypatch):
 @pytest.fixture
 def mock_encoder(monkeypatch):
     mock = MagicMock()
-    mock.return_value = [0.1] * 128
-    monkeypatch.setattr("app.api.routes.face_recognition.get_face_embedding", mock)
+    mock.side_effect = lambda crops, num_jitters=1: np.full(
+        (len(crops), 128), 0.1, np.float32
+    )
+    monkeypatch.setattr("app.api.routes.face_recognition.get_face_embeddings", mock)
     return mock
 
 
@@ -0,0 +1,55 @@
+from unittest.mock import patch
+
+import numpy as np
+
+import app.ml.face_detector as face_detector
+from app.ml.face_detector import (
+    _tile_origins,
+    detect_faces_tiled,
+    non_max_suppression,
+)
+
+
+def test_tile_origins_cover_edges():
+    assert _tile_origins(300, 640, 512) == [0]
+    assert _tile_origins(1500, 640, 512) == [0, 512, 860]
+
+
+def test_nms_keeps_highest_score():
+    kept = non_max_suppression(
+        [((0, 50, 50, 0), 0.6), ((2, 52, 52, 2), 0.9), ((100, 150, 150, 100), 0.7)]
+    )
+    assert kept == [(2, 52, 52, 2), (100, 150, 150, 100)]
+
+
+def test_nms_merges_face_cut_at_tile_edge():
+    # Right half of a face seen by one tile, the whole face by its neighbour
+    kept = non_max_suppression([((0, 100, 60, 40), 0.95), ((0, 100, 60, 70), 0.5)])
+    assert kept == [(0, 100, 60, 40)]
+
+
+def test_tiled_detection_maps_boxes_to_full_image():
+    image = np.zeros((1000, 1500, 3), dtype=np.uint8)
+    seen = []
+
+    def detect(tile):
+        seen.append(tile.shape[:2])
+        return [((10, 30, 30, 10), 0.9)]
+
+    with patch.object(face_detector, "_detect_scored", side_effect=detect):
+        faces = detect_faces_tiled(image, tile_size=640, overlap=0.2)
+
+    # 2 rows x 3 columns, all full-size because the last tile is edge-aligned
+    assert seen == [(640, 640)] * 6
+    assert len(faces) == 6
+    assert (10, 30, 30, 10) in faces
+    assert (360 + 10, 860 + 30, 360 + 30, 860 + 10) in faces
+
+
+def test_tiled_detection_small_image_uses_single_pass():
+    image = np.zeros((200, 300, 3), dtype=np.uint8)
+    with patch.object(
+        face_detector, "_detect_scored", return_value=[((1, 5, 5, 1), 0.8)]
+    ) as mock_detect:
+        assert detect_faces_tiled(image, tile_size=640, overlap=0.2) == [(1, 5, 5, 1)]
+    assert mock_detect.call_count == 1